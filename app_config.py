@@ -25,5 +25,29 @@ class Config(Singleton):
         self.database_url: str = os.environ.get("DATABASE_URL")
         self.sentry_dsn: str = os.environ.get("SENTRY_DSN")
         self.scraping_template_url: str = os.environ["SCRAPING_TEMPLATE_URL"]
+        self.attack_report_storage: str = os.environ.get("ATTACK_REPORT_STORAGE", "member")
+        self.settings_cache_ttl: float = float(os.environ.get("SETTINGS_CACHE_TTL", "3600"))
+        self.settings_cache_max_entries: int = int(os.environ.get("SETTINGS_CACHE_MAX_ENTRIES", "10000"))
+        self.attack_report_write_behind: bool = os.environ.get("ATTACK_REPORT_WRITE_BEHIND", "false").lower() == "true"
+        self.attack_report_flush_interval: float = float(os.environ.get("ATTACK_REPORT_FLUSH_INTERVAL", "2"))
+        self.report_publish_concurrency: int = int(os.environ.get("REPORT_PUBLISH_CONCURRENCY", "4"))
+        self.report_cache_size: int = int(os.environ.get("REPORT_CACHE_SIZE", "1000"))
+        self.report_cache_idle_seconds: float = float(os.environ.get("REPORT_CACHE_IDLE_SECONDS", "3600"))
+        self.board_cache_size: int = int(os.environ.get("BOARD_CACHE_SIZE", "1000"))
+        self.board_cache_idle_seconds: float = float(os.environ.get("BOARD_CACHE_IDLE_SECONDS", "86400"))
+        self.board_edit_window: float = float(os.environ.get("BOARD_EDIT_WINDOW", "0.5"))
+        self.board_edit_max_delay: float = float(os.environ.get("BOARD_EDIT_MAX_DELAY", "2"))
+        self.board_lock_backend: str = os.environ.get("BOARD_LOCK_BACKEND", "local")
+        self.board_lock_lease_seconds: float = float(os.environ.get("BOARD_LOCK_LEASE_SECONDS", "10"))
+        self.board_lock_timeout: float = float(os.environ.get("BOARD_LOCK_TIMEOUT", "2"))
+        self.role_index_refresh_interval: float = float(os.environ.get("ROLE_INDEX_REFRESH_INTERVAL", "300"))
+        self.role_index_refresh_timeout: float = float(os.environ.get("ROLE_INDEX_REFRESH_TIMEOUT", "30"))
+        self.role_sync_concurrency: int = int(os.environ.get("ROLE_SYNC_CONCURRENCY", "5"))
+        self.role_sync_debounce: float = float(os.environ.get("ROLE_SYNC_DEBOUNCE", "1"))
+        self.role_sync_cache_size: int = int(os.environ.get("ROLE_SYNC_CACHE_SIZE", "10000"))
+        self.role_sync_cache_idle_seconds: float = float(os.environ.get("ROLE_SYNC_CACHE_IDLE_SECONDS", "3600"))
+        self.notify_workers: int = int(os.environ.get("NOTIFY_WORKERS", "4"))
+        self.notify_queue_size: int = int(os.environ.get("NOTIFY_QUEUE_SIZE", "1000"))
+        self.mongo_slow_query_ms: float = float(os.environ.get("MONGO_SLOW_QUERY_MS", "100"))
         if len(self.guild_ids) == 0:
             self.guild_ids = None
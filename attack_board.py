@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+BATTLE_IN_PREFIX = "本戦 "
+SEPARATOR = "------"
+
+header_regexp = re.compile(r"^(\d+):(.*?) 残りHP\(万\):(.*)$")
+# 凸の行。本文全体に対して一度だけ走査できるよう複数行モードでコンパイルしておく
+entry_regexp = re.compile(r"^(本戦 )?(.*?)  (.+) 目標(\d+)万 :(.*)$", re.MULTILINE)
+damage_regexp = re.compile(r"\d{3,}")
+add_damage_regexp = re.compile(r"\+\d{2,}")
+
+
+def parse_damage(note: Optional[str]) -> Optional[int]:
+    # メモの最初の3桁以上の数値をダメージ、"+数値"を追加ダメージとして扱う
+    if not note:
+        return None
+    dmg = damage_regexp.search(note)
+    if dmg is None:
+        return None
+    add_dmg = add_damage_regexp.search(note)
+    return int(dmg.group()) + (int(add_dmg.group()) if add_dmg is not None else 0)
+
+
+class AttackEntry:
+    def __init__(
+        self,
+        username: str,
+        attack_kind: str,
+        target_damage: int,
+        note: Optional[str] = None,
+        is_battle_in: bool = False,
+        user_id: Optional[int] = None,
+    ) -> None:
+        self.username = username
+        self.attack_kind = attack_kind
+        self.target_damage = target_damage
+        self.note = note
+        self.damage = parse_damage(note)
+        self.is_battle_in = is_battle_in
+        self.user_id = user_id
+
+    @classmethod
+    def parse(cls, line: str) -> Optional[AttackEntry]:
+        m = entry_regexp.match(line)
+        return cls.from_match(m) if m is not None else None
+
+    @classmethod
+    def from_match(cls, m: re.Match) -> AttackEntry:
+        battle_in, attack_kind, username, target_damage, rest = m.groups()
+        note = rest[1:] if rest.startswith(" ") else None
+        return cls(username, attack_kind, int(target_damage), note=note, is_battle_in=battle_in is not None)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> AttackEntry:
+        return cls(
+            d["username"],
+            d["attack_kind"],
+            d["target_damage"],
+            note=d.get("note"),
+            is_battle_in=d.get("is_battle_in", False),
+            user_id=d.get("user_id"),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "username": self.username,
+            "attack_kind": self.attack_kind,
+            "target_damage": self.target_damage,
+            "note": self.note,
+            "is_battle_in": self.is_battle_in,
+            "user_id": self.user_id,
+        }
+
+    def set_note(self, note: str) -> None:
+        self.note = note
+        self.damage = parse_damage(note)
+
+    def attack_text(self) -> str:
+        prefix = BATTLE_IN_PREFIX if self.is_battle_in else ""
+        return f"{prefix}{self.attack_kind}  {self.username} 目標{self.target_damage}万 :"
+
+    def render(self) -> str:
+        atk = self.attack_text()
+        return atk if self.note is None else f"{atk} {self.note}"
+
+
+def damage_order(entry: AttackEntry) -> tuple[bool, int]:
+    return (entry.damage is None, -entry.damage if entry.damage is not None else 0)
+
+
+class AttackBoard:
+    # 同時凸の状況。メッセージ本文は一度だけ解析し、以降はこのオブジェクトを正として本文を生成する
+    def __init__(self, header: str, entries: Optional[list[AttackEntry]] = None, separator: str = SEPARATOR) -> None:
+        self.header = header
+        self.separator = separator
+        # 表示順を保持したユーザー名からの索引
+        self.entries: dict[str, AttackEntry] = {e.username: e for e in entries or []}
+        m = header_regexp.match(header)
+        self.boss_number = int(m.group(1)) if m else 0
+        self.boss_name = m.group(2) if m else ""
+        self.boss_hp = m.group(3) if m else ""
+
+    @classmethod
+    def create(cls, boss_number: int, boss_name: str, boss_hp: int) -> AttackBoard:
+        return cls(f"{boss_number}:{boss_name} 残りHP(万):{boss_hp}")
+
+    @classmethod
+    def parse(cls, content: str) -> AttackBoard:
+        # 1行目が見出し、2行目が区切り、以降を凸の行として本文を1回だけ走査する
+        header, _, rest = content.partition("\n")
+        separator, has_body, body = rest.partition("\n")
+        entries = [AttackEntry.from_match(m) for m in entry_regexp.finditer(body)] if has_body else []
+        return cls(header, entries, separator or SEPARATOR)
+
+    def to_dicts(self) -> list[dict]:
+        return [e.to_dict() for e in self.entries.values()]
+
+    @property
+    def boss_str(self) -> str:
+        return self.header.split(" ")[0]
+
+    @property
+    def boss_label(self) -> str:
+        # 通知に使う「番号:ボス名」までの表示
+        idx = self.header.find(" 残りHP")
+        return self.header[:idx] if idx >= 0 else "error"
+
+    def get(self, username: str) -> Optional[AttackEntry]:
+        return self.entries.get(username)
+
+    def usernames(self) -> list[str]:
+        return list(self.entries.keys())
+
+    def register(
+        self, username: str, attack_kind: str, target_damage: int, user_id: Optional[int] = None
+    ) -> AttackEntry:
+        # 既存の凸は取り消して末尾に追加する
+        self.entries.pop(username, None)
+        entry = AttackEntry(username, attack_kind, target_damage, user_id=user_id)
+        self.entries[username] = entry
+        return entry
+
+    def remove(self, username: str) -> Optional[AttackEntry]:
+        return self.entries.pop(username, None)
+
+    def toggle_battle_in(self, username: str) -> None:
+        entry = self.entries.get(username)
+        if entry is not None:
+            entry.is_battle_in = not entry.is_battle_in
+
+    def set_note(self, username: str, note: str) -> None:
+        entry = self.entries.get(username)
+        if entry is not None:
+            entry.set_note(note)
+        self.sort_by_damage()
+
+    def sort_by_damage(self) -> None:
+        # ダメージ入力済みの凸をダメージ降順に、未入力の凸はその後ろに元の順で並べる
+        # ダメージはメモの入力時に解析済みのため、ここでは安定ソート1回のみ行う
+        ordered = sorted(self.entries.values(), key=damage_order)
+        self.entries = {e.username: e for e in ordered}
+
+    def render(self) -> str:
+        return "\n".join([self.header, self.separator] + [e.render() for e in self.entries.values()])
@@ -0,0 +1,58 @@
+# 同時凸の1クリックあたりの処理時間を凸数毎に計測する
+# 本文の解析(parse)はメッセージ毎に初回のみ行われる
+# python -m bench.bench_attack_board
+import re
+import timeit
+
+from attack_board import AttackBoard
+
+escape_regexp = re.compile(r"([\(\)\[\]\{\}\.\^\$\*\+\?\\])")
+
+
+def make_content(size: int) -> str:
+    board = AttackBoard.create(1, "ワイバーン", 6000)
+    for i in range(size):
+        board.register(f"user({i})", "　新凸　 物🗡️", 1000 + i)
+        if i % 2 == 0:
+            board.set_note(f"user({i})", f"{2000 + i}+30")
+    return board.render()
+
+
+def text_click(content: str, username: str) -> str:
+    # 本文を毎回分割し、ユーザー毎の正規表現を組み立てて走査する従来の処理
+    atk_contents = content.splitlines()
+    re_username = escape_regexp.sub(r"\\\1", username)
+    atk_list = atk_contents[2:]
+    target_indexes = [i for i, atk in enumerate(atk_list) if re.search(rf"  {re_username} 目標\d+万 :.*", atk)]
+    for i in target_indexes:
+        if re.match(r"本戦 ", atk_list[i]):
+            atk_list[i] = atk_list[i].removeprefix("本戦 ")
+        else:
+            atk_list[i] = "本戦 " + atk_list[i]
+    return "\n".join(atk_contents[:2] + atk_list)
+
+
+def board_click(board: AttackBoard, username: str) -> str:
+    board.toggle_battle_in(username)
+    return board.render()
+
+
+def bench(stmt, number: int) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    print(f"{'size':>6} {'text(us)':>10} {'parse(us)':>10} {'board(us)':>10}")
+    for size in [5, 30, 100, 500]:
+        content = make_content(size)
+        username = f"user({size // 2})"
+        board = AttackBoard.parse(content)
+        number = max(100, 20000 // size)
+        text_us = bench(lambda: text_click(content, username), number)
+        parse_us = bench(lambda: AttackBoard.parse(content), number)
+        board_us = bench(lambda: board_click(board, username), number)
+        print(f"{size:>6} {text_us:>10.1f} {parse_us:>10.1f} {board_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
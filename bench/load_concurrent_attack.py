@@ -0,0 +1,281 @@
+# 同時凸のボタン操作の負荷試験。Discordとmongoの代わりにメモリ上の偽オブジェクトを使い、
+# 指定した人数が指定した頻度で操作した場合の処理時間、ロック待ち時間、メッセージ編集回数を計測する
+# SCRAPING_TEMPLATE_URL= python -m bench.load_concurrent_attack --users 30 --rate 1 --duration 10
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+
+import cogs.concurrent_attack_cog as cog
+import mongo_data as mongo
+from attack_board import AttackBoard
+
+ATTACK_KINDS = ["　新凸　 物🗡️", "　新凸　 魔✡️", "★持越★ 物🗡️", "★持越★ 魔✡️"]
+ACTIONS = ["select", "declaration", "damage", "cancel", "proxy_cancel"]
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {a: [] for a in ACTIONS}
+        self.lock_waits: list[float] = []
+        self.errors: list[Exception] = []
+        self.edits = 0
+        self.mongo_calls = 0
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class FakeMongo:
+    # ConcurrentAttackBoard/ConcurrentAttackNotifyの読み書きをメモリ上で行い、DBの往復時間を待機で再現する
+    def __init__(self, recorder: Recorder, latency: float) -> None:
+        self.recorder = recorder
+        self.latency = latency
+        self.boards: dict[int, mongo.ConcurrentAttackBoard] = {}
+
+    async def round_trip(self) -> None:
+        self.recorder.mongo_calls += 1
+        await asyncio.sleep(self.latency)
+
+    def install(self) -> None:
+        fake = self
+
+        async def get_board(cls, message_id: int) -> Optional[mongo.ConcurrentAttackBoard]:
+            await fake.round_trip()
+            return fake.boards.get(message_id)
+
+        async def set_board(self, lease_owner: Optional[str] = None) -> mongo.ConcurrentAttackBoard:
+            await fake.round_trip()
+            fake.boards[self.message_id] = self
+            return self
+
+        async def get_notify(cls, guild_id: int) -> None:
+            await fake.round_trip()
+            return None
+
+        mongo.ConcurrentAttackBoard.Get = classmethod(get_board)
+        mongo.ConcurrentAttackBoard.Set = set_board
+        mongo.ConcurrentAttackNotify.Get = classmethod(get_notify)
+
+
+class TimedLock:
+    # ロックの取得までの待ち時間を記録する
+    def __init__(self, inner: Any, recorder: Recorder) -> None:
+        self.inner = inner
+        self.shared = inner.shared
+        self.recorder = recorder
+
+    @asynccontextmanager
+    async def hold(self, id: int):
+        start = time.perf_counter()
+        async with self.inner.hold(id) as lease_owner:
+            self.recorder.lock_waits.append(time.perf_counter() - start)
+            yield lease_owner
+
+
+class FakeMessage:
+    def __init__(self, id: int, content: str, recorder: Recorder) -> None:
+        self.id = id
+        self.content = content
+        self.jump_url = f"https://discord.com/channels/1/1/{id}"
+        self.recorder = recorder
+
+    async def edit(self, content: str, **kwargs: Any) -> None:
+        self.recorder.edits += 1
+        self.content = content
+
+
+class FakeChannel:
+    def __init__(self, messages: dict[int, FakeMessage]) -> None:
+        self.messages = messages
+
+    def get_partial_message(self, id: int) -> FakeMessage:
+        return self.messages[id]
+
+
+class FakeGuild:
+    id = 1
+    chunked = True
+    members: list = []
+    scheduled_events: list = []
+
+    def get_member(self, id: int) -> None:
+        return None
+
+
+class FakeUser:
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.display_name = f"member{id}"
+        self.mention = f"<@{id}>"
+
+
+class FakeResponse:
+    def __init__(self) -> None:
+        self.modal = None
+        self.view = None
+
+    async def defer(self, **kwargs: Any) -> None:
+        pass
+
+    async def send_modal(self, modal: Any) -> None:
+        self.modal = modal
+
+    async def send_message(self, content: Optional[str] = None, view: Any = None, **kwargs: Any) -> None:
+        self.view = view
+
+    async def edit_message(self, **kwargs: Any) -> None:
+        pass
+
+
+class FakeFollowup:
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, message: FakeMessage, channel: FakeChannel) -> None:
+        self.user = user
+        self.message = message
+        self.channel = channel
+        self.guild = FakeGuild()
+        self.guild_id = self.guild.id
+        self.channel_id = 1
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.data = {}
+
+
+def choose(select: Any, values: list[str], interaction: FakeInteraction) -> None:
+    # 選択メニューの選択状態を直接設定する
+    select._selected_values = values
+    select._interaction = interaction
+
+
+async def click(
+    view: cog.ConcurrentAttackButtonView, user: FakeUser, message: FakeMessage, channel: FakeChannel, action: str
+) -> None:
+    interaction = FakeInteraction(user, message, channel)
+    if action == "select":
+        choose(view.AttackSelectCallback, [random.choice(ATTACK_KINDS)], interaction)
+        await view.AttackSelectCallback.callback(interaction)
+        modal = interaction.response.modal
+        modal.children[0].value = str(random.randint(500, 3000))
+        modal.children[1].value = ""
+        await modal.callback(FakeInteraction(user, message, channel))
+    elif action == "declaration":
+        await view.DeclarationButton.callback(interaction)
+    elif action == "damage":
+        await view.InputDamageButton.callback(interaction)
+        modal = interaction.response.modal
+        if modal is not None:
+            modal.children[0].value = f"{random.randint(100, 3000)}+{random.randint(10, 90)}"
+            await modal.callback(FakeInteraction(user, message, channel))
+    elif action == "cancel":
+        await view.CancelAttackButton.callback(interaction)
+    elif action == "proxy_cancel":
+        await view.ProxyCancelAttackButton.callback(interaction)
+        pcview = interaction.response.view
+        if pcview is not None:
+            select = pcview.children[0]
+            options = [o.label for o in select.options]
+            select_interaction = FakeInteraction(user, message, channel)
+            choose(select, random.sample(options, k=min(len(options), 1)), select_interaction)
+            await select.callback(select_interaction)
+            pcview.stop()
+
+
+async def simulate_user(
+    view: cog.ConcurrentAttackButtonView,
+    user: FakeUser,
+    messages: list[FakeMessage],
+    channel: FakeChannel,
+    rate: float,
+    deadline: float,
+    weights: list[float],
+    recorder: Recorder,
+) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(random.expovariate(rate))
+        if loop.time() >= deadline:
+            return
+        action = random.choices(ACTIONS, weights=weights)[0]
+        start = time.perf_counter()
+        try:
+            await click(view, user, random.choice(messages), channel, action)
+        except Exception as e:
+            recorder.errors.append(e)
+        recorder.latencies[action].append(time.perf_counter() - start)
+
+
+async def run(args: argparse.Namespace) -> Recorder:
+    random.seed(args.seed)
+    recorder = Recorder()
+    FakeMongo(recorder, args.mongo_latency_ms / 1000).install()
+    cog.board_lock = TimedLock(cog.board_lock, recorder)
+    cog.edit_coalescer.window = args.edit_window
+    cog.edit_coalescer.max_delay = args.edit_max_delay
+
+    content = AttackBoard.create(1, "ワイバーン", 6000).render()
+    messages = {i: FakeMessage(i, content, recorder) for i in range(1, args.boards + 1)}
+    channel = FakeChannel(messages)
+    view = cog.ConcurrentAttackButtonView()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    weights = [args.select_weight, 1.0, 1.0, 0.5, 0.2]
+    await asyncio.gather(
+        *[
+            simulate_user(view, FakeUser(i), list(messages.values()), channel, args.rate, deadline, weights, recorder)
+            for i in range(args.users)
+        ]
+    )
+    # まとめ待ちの編集が送信されるまで待つ
+    await asyncio.sleep(args.edit_max_delay + args.edit_window)
+    return recorder
+
+
+def report(recorder: Recorder) -> None:
+    print(f"{'action':>14} {'count':>6} {'p50(ms)':>9} {'p99(ms)':>9}")
+    all_latencies = []
+    for action, latencies in recorder.latencies.items():
+        all_latencies += latencies
+        p50, p99 = percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000
+        print(f"{action:>14} {len(latencies):>6} {p50:>9.2f} {p99:>9.2f}")
+    p50, p99 = percentile(all_latencies, 0.5) * 1000, percentile(all_latencies, 0.99) * 1000
+    print(f"{'all':>14} {len(all_latencies):>6} {p50:>9.2f} {p99:>9.2f}")
+    waits = recorder.lock_waits
+    print(
+        f"lock wait p50: {percentile(waits, 0.5) * 1000:.2f}ms, p99: {percentile(waits, 0.99) * 1000:.2f}ms, "
+        f"max: {max(waits, default=0) * 1000:.2f}ms"
+    )
+    edits = cog.edit_coalescer.stats()
+    print(f"edits requested: {edits['requested']}, issued: {recorder.edits}, mongo calls: {recorder.mongo_calls}")
+    print(f"errors: {len(recorder.errors)}")
+    for e in recorder.errors[:3]:
+        print(f"  {type(e).__name__}: {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--boards", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=1.0, help="1人あたりの毎秒の操作回数")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mongo-latency-ms", type=float, default=5.0)
+    parser.add_argument("--edit-window", type=float, default=cog.config.board_edit_window)
+    parser.add_argument("--edit-max-delay", type=float, default=cog.config.board_edit_max_delay)
+    parser.add_argument("--select-weight", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
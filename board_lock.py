@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator, Optional, Union
+
+import app_config
+import mongo_data as mongo
+from bounded_map import BoundedLockMap
+
+config = app_config.Config.get_instance()
+
+
+class BoardLockError(Exception):
+    pass
+
+
+class BoardLockTimeout(BoardLockError):
+    pass
+
+
+class BoardLeaseLost(BoardLockError):
+    # リースの期限が切れ、他のプロセスに取得された後に書き込もうとした
+    pass
+
+
+class LocalBoardLock:
+    # 同一プロセス内のロック(既定)。1プロセスで動かす場合はメモリ上の状況を正として使い続けられる
+    shared = False
+
+    def __init__(self, locks: BoundedLockMap) -> None:
+        self.__locks = locks
+
+    def hold(self, id: int) -> AsyncContextManager[Optional[str]]:
+        return self.__locks.hold(id)
+
+
+class MongoLeaseBoardLock:
+    # Mongoのリース(期限付きのロック)による複数プロセス間のロック
+    # 他のプロセスが更新している可能性があるため、ロック中に状況をDBから読み直し、解放前に書き込むこと
+    # holdはリースの保持者を返す。書き込みはその保持者を指定して行い、期限切れで他のプロセスに取得されていれば失敗する
+    shared = True
+
+    def __init__(self, locks: BoundedLockMap, lease_seconds: float, timeout: float) -> None:
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.__locks = locks
+
+    @asynccontextmanager
+    async def hold(self, id: int) -> AsyncIterator[Optional[str]]:
+        # 同じプロセス内の競合はプロセス内のロックで待たせ、DBへの取得要求を減らす
+        async with self.__locks.hold(id):
+            lease = mongo.ConcurrentAttackBoardLease(id, uuid.uuid4().hex)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            delay = 0.05
+            while await lease.Acquire(self.lease_seconds) is None:
+                if loop.time() >= deadline:
+                    raise BoardLockTimeout(f"failed to acquire board lease. message_id: {id}")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, 0.5)
+            try:
+                yield lease.lease_owner
+            finally:
+                await lease.Release()
+
+
+BoardLock = Union[LocalBoardLock, MongoLeaseBoardLock]
+
+
+def create_board_lock(locks: BoundedLockMap) -> BoardLock:
+    if config.board_lock_backend == "mongo":
+        return MongoLeaseBoardLock(
+            locks, lease_seconds=config.board_lock_lease_seconds, timeout=config.board_lock_timeout
+        )
+    return LocalBoardLock(locks)
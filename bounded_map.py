@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+import types
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# 参照を辿らずにサイズだけを数える型。イベントループやクラスなどの共有オブジェクトは数えない
+_ATOMIC_TYPES = (str, bytes, int, float, bool, type(None))
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, asyncio.AbstractEventLoop)
+
+
+def deep_sizeof(obj: Any, seen: Optional[set[int]] = None) -> int:
+    # 参照先のオブジェクトも含めたおおよそのメモリ使用量(bytes)。同じオブジェクトは1回だけ数える
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, _ATOMIC_TYPES):
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name.startswith("__") and not name.endswith("__"):
+                name = f"_{cls.__name__.lstrip('_')}{name}"
+            if hasattr(obj, name):
+                size += deep_sizeof(getattr(obj, name), seen)
+    return size
+
+
+class _Entry(Generic[V]):
+    __slots__ = ("lock", "users", "value", "touched")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # ロック中・ロック待ちの数
+        self.users = 0
+        self.value: Optional[V] = None
+        self.touched = time.monotonic()
+
+
+class BoundedLockMap(Generic[K, V]):
+    # キー毎のロックと値を保持する。件数の上限と最終アクセスからの経過時間で古いものから削除する
+    # ロック中・ロック待ちのエントリは削除しない
+    def __init__(self, max_entries: int, idle_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self.__entries: OrderedDict[K, _Entry[V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __touch(self, key: K) -> _Entry[V]:
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.__evict(reserve=1)
+            entry = self.__entries[key] = _Entry()
+        else:
+            entry.touched = time.monotonic()
+            self.__entries.move_to_end(key)
+        return entry
+
+    @asynccontextmanager
+    async def hold(self, key: K) -> AsyncIterator[None]:
+        entry = self.__touch(key)
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        entry.touched = time.monotonic()
+        self.__entries.move_to_end(key)
+        return entry.value
+
+    def set(self, key: K, value: V) -> None:
+        self.__touch(key).value = value
+
+    def __evict(self, reserve: int = 0) -> None:
+        expired = time.monotonic() - self.idle_seconds
+        # 古い順に見て、上限超過分と期限切れのものを削除する
+        over = len(self.__entries) + reserve - self.max_entries
+        targets = []
+        for key, entry in self.__entries.items():
+            if len(targets) >= over and entry.touched >= expired:
+                break
+            if entry.users == 0:
+                targets.append(key)
+        for key in targets:
+            del self.__entries[key]
+        self.evictions += len(targets)
+
+    def evict(self) -> None:
+        self.__evict()
+
+    def stats(self) -> dict[str, int]:
+        # bytesはキー、ロック、値を含めた全エントリのおおよそのメモリ使用量。全体を辿るため頻繁に呼ばないこと
+        self.__evict()
+        return {
+            "entries": len(self.__entries),
+            "held": sum(1 for e in self.__entries.values() if e.users > 0),
+            "evictions": self.evictions,
+            "bytes": deep_sizeof(self.__entries),
+        }
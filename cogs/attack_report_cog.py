@@ -2,7 +2,7 @@ import asyncio
 from datetime import date, datetime, time, timedelta
 from http.client import HTTPException
 from logging import getLogger
-from typing import Callable
+from typing import Optional
 from zoneinfo import ZoneInfo
 
 import discord
@@ -12,8 +12,13 @@ from discord.ui import InputText, Modal
 
 import app_config
 import mongo_data as mongo
+from bounded_map import BoundedLockMap
 from log_decorator import ButtonLogDecorator, CallbackLogDecorator, CommandLogDecorator
+from member_index import role_index
+from mongo_monitor import create_background_task
 from mybot import BotClass
+from report_aggregate import EMOJI_CARRY, EMOJI_CMP_ATK, EMOJI_YET_ATK, ReportAggregate
+from role_sync import role_sync
 
 logger = getLogger(__name__)
 config = app_config.Config.get_instance()
@@ -21,9 +26,15 @@ btn_log = ButtonLogDecorator(logger=logger)
 cmd_log = CommandLogDecorator(logger=logger)
 cb_log = CallbackLogDecorator(logger=logger)
 
-EMOJI_YET_ATK = "🍖"
-EMOJI_CMP_ATK = "🦴"
-EMOJI_CARRY = "🍰"
+# ギルド・日付毎の凸状況の更新用のロックと集計。報告表の変更から表示の更新までを他のギルドと独立して直列化する
+report_locks: BoundedLockMap[tuple[int, date], ReportAggregate] = BoundedLockMap(
+    max_entries=config.report_cache_size,
+    idle_seconds=config.report_cache_idle_seconds,
+)
+# 見つからないメンバーの再取得・表示の更新を実行中のギルド・日付
+resolving_reports: set[tuple[int, date]] = set()
+# 集計を保持しているギルド毎の日付。メンバーの表示名の変更・退出を集計へ反映するために使う
+report_dates: dict[int, set[date]] = {}
 
 
 class MemoModal(Modal):
@@ -35,20 +46,17 @@ class MemoModal(Modal):
 
     @cb_log.info("submit a memo modal")
     async def callback(self, interaction: discord.Interaction):
-        self.repo.memo = "" if self.children[0].value is None else self.children[0].value
-        self.repo.Set()
-        reports = mongo.AttackReport.Gets(self.repo.guild_id, self.repo.target_date)
-        reports = sorted(
-            reports, key=lambda r: (r.report.count(EMOJI_YET_ATK), r.report.count(EMOJI_CARRY)), reverse=True
-        )
-        member = interaction.guild.get_member(self.repo.user_id)
-        if member is None:
-            _ = interaction.guild.fetch_members()
-        repo_list = [
-            f"{r.report} : {interaction.guild.get_member(r.user_id).display_name} : {r.memo}" for r in reports
-        ]
-        self.embed.fields[0].value = "```\n" + "\n".join(repo_list) + "\n```"
-        await interaction.response.edit_message(embed=self.embed)
+        memo = "" if self.children[0].value is None else self.children[0].value
+        async with report_locks.hold((self.repo.guild_id, self.repo.target_date)):
+            reports = await mongo.AttackReport.Change(
+                self.repo.guild_id, self.repo.target_date, self.repo.user_id, memo=memo
+            )
+            if reports is None:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+            aggregate = update_report_aggregate(interaction.guild, self.repo.target_date, reports, self.repo.user_id)
+            self.embed.fields[0].value = aggregate.render()
+            await interaction.response.edit_message(embed=self.embed)
+            request_lost_members_refresh(interaction.guild, self.repo.target_date, aggregate, interaction.message)
 
     @cb_log.error("error a memo modal")
     async def on_error(self, error: Exception, interaction: discord.Interaction) -> None:
@@ -59,7 +67,6 @@ class AttarckReportView(discord.ui.View):
     def __init__(self):
         # making None is important if you want the button work after restart!
         super().__init__(timeout=None)
-        self.lock = asyncio.Lock()
 
     @discord.ui.button(
         style=discord.ButtonStyle.gray, label=f"凸消化{EMOJI_YET_ATK}→{EMOJI_CMP_ATK}", custom_id="attack_complete"
@@ -72,19 +79,22 @@ class AttarckReportView(discord.ui.View):
 
         embed = interaction.message.embeds[0].copy()
         reports_field = embed.fields[0]
-        repl_func: Callable[[str], str] = lambda r: r.replace(EMOJI_YET_ATK, EMOJI_CMP_ATK, 1)
-
-        is_target, repl_reports, repo_summary = await change_reports(
-            guild=interaction.guild, target_date=create_date, user_id=interaction.user.id, repl_func=repl_func
-        )
-        if not is_target:
-            return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+        change = mongo.ReportChange(EMOJI_YET_ATK, EMOJI_CMP_ATK)
+
+        async with report_locks.hold((interaction.guild_id, create_date)):
+            is_target, repl_reports, repo_summary = await change_reports(
+                guild=interaction.guild,
+                target_date=create_date,
+                user_id=interaction.user.id,
+                change=change,
+                message=interaction.message,
+            )
+            if not is_target:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
 
-        reports_field.value = repl_reports
-        reports_field.name = repo_summary
-        await interaction.response.edit_message(embed=embed)
-        async with self.lock:
-            await update_yet_complete_role(guild=interaction.guild, target_date=create_date)
+            reports_field.value = repl_reports
+            reports_field.name = repo_summary
+            await interaction.response.edit_message(embed=embed)
 
     @discord.ui.button(
         style=discord.ButtonStyle.gray, label=f"凸持越{EMOJI_YET_ATK}→{EMOJI_CARRY}", custom_id="attack_carry"
@@ -97,17 +107,22 @@ class AttarckReportView(discord.ui.View):
 
         embed = interaction.message.embeds[0].copy()
         reports_field = embed.fields[0]
-        repl_func: Callable[[str], str] = lambda r: r.replace(EMOJI_YET_ATK, EMOJI_CARRY, 1)
-
-        is_target, repl_reports, repo_summary = await change_reports(
-            guild=interaction.guild, target_date=create_date, user_id=interaction.user.id, repl_func=repl_func
-        )
-        if not is_target:
-            return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+        change = mongo.ReportChange(EMOJI_YET_ATK, EMOJI_CARRY)
+
+        async with report_locks.hold((interaction.guild_id, create_date)):
+            is_target, repl_reports, repo_summary = await change_reports(
+                guild=interaction.guild,
+                target_date=create_date,
+                user_id=interaction.user.id,
+                change=change,
+                message=interaction.message,
+            )
+            if not is_target:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
 
-        reports_field.value = repl_reports
-        reports_field.name = repo_summary
-        await interaction.response.edit_message(embed=embed)
+            reports_field.value = repl_reports
+            reports_field.name = repo_summary
+            await interaction.response.edit_message(embed=embed)
 
     @discord.ui.button(
         style=discord.ButtonStyle.gray, label=f"持越消化{EMOJI_CARRY}→{EMOJI_CMP_ATK}", custom_id="carry_complete"
@@ -120,19 +135,22 @@ class AttarckReportView(discord.ui.View):
 
         embed = interaction.message.embeds[0].copy()
         reports_field = embed.fields[0]
-        repl_func: Callable[[str], str] = lambda r: r.replace(EMOJI_CARRY, EMOJI_CMP_ATK, 1)
-
-        is_target, repl_reports, repo_summary = await change_reports(
-            guild=interaction.guild, target_date=create_date, user_id=interaction.user.id, repl_func=repl_func
-        )
-        if not is_target:
-            return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+        change = mongo.ReportChange(EMOJI_CARRY, EMOJI_CMP_ATK)
+
+        async with report_locks.hold((interaction.guild_id, create_date)):
+            is_target, repl_reports, repo_summary = await change_reports(
+                guild=interaction.guild,
+                target_date=create_date,
+                user_id=interaction.user.id,
+                change=change,
+                message=interaction.message,
+            )
+            if not is_target:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
 
-        reports_field.value = repl_reports
-        reports_field.name = repo_summary
-        await interaction.response.edit_message(embed=embed)
-        async with self.lock:
-            await update_yet_complete_role(guild=interaction.guild, target_date=create_date)
+            reports_field.value = repl_reports
+            reports_field.name = repo_summary
+            await interaction.response.edit_message(embed=embed)
 
     @discord.ui.button(style=discord.ButtonStyle.gray, label="全凸消化", custom_id="all_complete")
     @btn_log.log("push all complete button")
@@ -143,25 +161,28 @@ class AttarckReportView(discord.ui.View):
 
         embed = interaction.message.embeds[0].copy()
         reports_field = embed.fields[0]
-        repl_func: Callable[[str], str] = lambda r: EMOJI_CMP_ATK * 3
-
-        is_target, repl_reports, repo_summary = await change_reports(
-            guild=interaction.guild, target_date=create_date, user_id=interaction.user.id, repl_func=repl_func
-        )
-        if not is_target:
-            return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+        change = mongo.ReportChange(None, EMOJI_CMP_ATK * 3)
+
+        async with report_locks.hold((interaction.guild_id, create_date)):
+            is_target, repl_reports, repo_summary = await change_reports(
+                guild=interaction.guild,
+                target_date=create_date,
+                user_id=interaction.user.id,
+                change=change,
+                message=interaction.message,
+            )
+            if not is_target:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
 
-        reports_field.value = repl_reports
-        reports_field.name = repo_summary
-        await interaction.response.edit_message(embed=embed)
-        async with self.lock:
-            await update_yet_complete_role(guild=interaction.guild, target_date=create_date)
+            reports_field.value = repl_reports
+            reports_field.name = repo_summary
+            await interaction.response.edit_message(embed=embed)
 
     @discord.ui.button(style=discord.ButtonStyle.blurple, label="メモ", custom_id="report_memo", row=2)
     @btn_log.log("push report memo button")
     async def ReportMemoButton(self, button, interaction: discord.Interaction):
         create_date = (interaction.message.created_at.astimezone(ZoneInfo("Asia/Tokyo")) - timedelta(hours=5)).date()
-        target_repo = mongo.AttackReport.Get(interaction.guild.id, create_date, interaction.user.id)
+        target_repo = await mongo.AttackReport.Get(interaction.guild.id, create_date, interaction.user.id)
 
         if target_repo is None:
             return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
@@ -178,117 +199,196 @@ class AttarckReportView(discord.ui.View):
 
         embed = interaction.message.embeds[0].copy()
         reports_field = embed.fields[0]
-        repl_func: Callable[[str], str] = lambda r: EMOJI_YET_ATK * 3
-
-        is_target, repl_reports, repo_summary = await change_reports(
-            guild=interaction.guild, target_date=create_date, user_id=interaction.user.id, repl_func=repl_func
-        )
-        if not is_target:
-            return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
+        change = mongo.ReportChange(None, EMOJI_YET_ATK * 3)
+
+        async with report_locks.hold((interaction.guild_id, create_date)):
+            is_target, repl_reports, repo_summary = await change_reports(
+                guild=interaction.guild,
+                target_date=create_date,
+                user_id=interaction.user.id,
+                change=change,
+                message=interaction.message,
+            )
+            if not is_target:
+                return await interaction.response.send_message("対象ユーザーではありません。", ephemeral=True)
 
-        reports_field.value = repl_reports
-        reports_field.name = repo_summary
-        await interaction.response.edit_message(embed=embed)
-        async with self.lock:
-            await update_yet_complete_role(guild=interaction.guild, target_date=create_date)
+            reports_field.value = repl_reports
+            reports_field.name = repo_summary
+            await interaction.response.edit_message(embed=embed)
 
 
 class AttarckReportCog(commands.Cog):
     def __init__(self, bot: BotClass):
         self.bot = bot
         self.scheduled_create_report.start()
+        if mongo.report_buffer.enabled:
+            self.flush_report_buffer.change_interval(seconds=config.attack_report_flush_interval)
+            self.flush_report_buffer.start()
 
     def cog_unload(self):
         self.scheduled_create_report.cancel()
+        self.flush_report_buffer.cancel()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        rename_report_member(member.guild.id, member.id, member.display_name)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.display_name != after.display_name:
+            rename_report_member(after.guild.id, after.id, after.display_name)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        rename_report_member(payload.guild_id, payload.user.id, None)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # グローバル表示名の変更はニックネーム未設定のギルド全てで表示名に影響する
+        for guild_id in list(report_dates):
+            guild = self.bot.get_guild(guild_id)
+            member = None if guild is None else guild.get_member(after.id)
+            if member is not None:
+                rename_report_member(guild_id, member.id, member.display_name)
+
+    @tasks.loop(seconds=2.0)
+    async def flush_report_buffer(self):
+        try:
+            await mongo.report_buffer.Flush()
+        except Exception:
+            # 失敗した変更はバッファに残り、次回のflushで再度書き込む
+            pass
+
+    @flush_report_buffer.after_loop
+    async def after_flush_report_buffer(self):
+        try:
+            await mongo.report_buffer.Flush()
+        except Exception:
+            pass
 
     async def create_report_embed(self, guild: discord.Guild, target_date: date) -> discord.Embed:
         embed = discord.Embed(title="凸完了報告")
-        clan_role = mongo.ClanMemberRole.Get(guild_id=guild.id)
+        clan_role = await mongo.ClanMemberRole.Get(guild_id=guild.id)
         if clan_role is not None:
-            all_members = await guild.fetch_members().flatten()
-            role_user_ids = [m.id for m in all_members if clan_role.role_id in [r.id for r in m.roles]]
-            reports = mongo.AttackReport.Gets(guild_id=guild.id, target_date=target_date)
-            reg_user_ids = [r.user_id for r in reports]
-            yet_reg_user_ids = set(role_user_ids) - set(reg_user_ids)
-            del_reg_user_ids = set(reg_user_ids) - set(role_user_ids)
-            del_reports = [r for r in reports if r.user_id in del_reg_user_ids]
-            keep_reports = [r for r in reports if r.user_id not in del_reg_user_ids]
-            for dr in del_reports:
-                dr.Delete()
-            init_repo = EMOJI_YET_ATK * 3
-            yet_reports = [mongo.AttackReport(guild.id, target_date, id, init_repo, "") for id in yet_reg_user_ids]
-            if yet_reports:
-                mongo.AttackReport.Sets(yet_reports)
-            update_reports = keep_reports + yet_reports
-            repo_list = [f"{r.report} : {guild.get_member(r.user_id).display_name} : {r.memo}" for r in update_reports]
-            repl_reports = "```\n" + "\n".join(repo_list) + "\n```"
-
-            yet_atk_count = sum([r.report.count(EMOJI_YET_ATK, 0, 3) for r in update_reports])
-            cmp_atk_count = sum([r.report.count(EMOJI_CMP_ATK, 0, 3) for r in update_reports])
-            carry_count = sum([r.report.count(EMOJI_CARRY, 0, 3) for r in update_reports])
-            repo_summary = (
-                f"凸状況 (残凸`{EMOJI_YET_ATK}`= **{yet_atk_count}** , "
-                f"持越`{EMOJI_CARRY}`= **{carry_count}** , "
-                f"消化`{EMOJI_CMP_ATK}`= **{cmp_atk_count}** )"
-            )
+            # メンバーの再取得を待つ可能性があるため、ロックの外で求める
+            role_user_ids = await role_index.members(guild, clan_role.role_id)
+            async with report_locks.hold((guild.id, target_date)):
+                reports = await mongo.AttackReport.Gets(guild_id=guild.id, target_date=target_date)
+                reg_user_ids = [r.user_id for r in reports]
+                yet_reg_user_ids = set(role_user_ids) - set(reg_user_ids)
+                del_reg_user_ids = set(reg_user_ids) - set(role_user_ids)
+                del_reports = [r for r in reports if r.user_id in del_reg_user_ids]
+                keep_reports = [r for r in reports if r.user_id not in del_reg_user_ids]
+                if del_reports:
+                    await mongo.AttackReport.DeleteMany(del_reports)
+                init_repo = EMOJI_YET_ATK * 3
+                yet_reports = [mongo.AttackReport(guild.id, target_date, id, init_repo, "") for id in yet_reg_user_ids]
+                if yet_reports:
+                    await mongo.AttackReport.Sets(yet_reports)
+                update_reports = keep_reports + yet_reports
+                # 作成時の表示もボタン操作後と同じく、残凸・持越の多い順に並べる
+                aggregate = update_report_aggregate(guild, target_date, update_reports)
+            # 作成時はボタン操作ではないため、見つからないメンバーの再取得を待ってから表示する
+            await resolve_lost_members(guild, target_date, aggregate.lost_user_ids())
+            repl_reports = aggregate.render()
+            repo_summary = aggregate.summary()
             embed.add_field(
                 name=repo_summary,
                 value=repl_reports,
             )
         return embed
 
+    async def publish_guild_reports(
+        self,
+        reglist: list[mongo.AttackReportRegister],
+        target_date: date,
+        day_index: int,
+        started: float,
+        semaphore: asyncio.Semaphore,
+    ) -> tuple[list[mongo.AttackReportRegister], list[mongo.AttackReportRegister], float]:
+        # 1ギルド分の凸完了報告表を作成する。失敗しても他のギルドには影響させない
+        # 作成済み、チャンネルが存在しない登録と、開始からの経過時間(ms)を返す
+        published_reglist: list[mongo.AttackReportRegister] = []
+        err_reglist: list[mongo.AttackReportRegister] = []
+        async with semaphore:
+            for reg in reglist:
+                log_fields = {"guild_id": reg.guild_id, "channel_id": reg.channel_id}
+                try:
+                    navigator = AttarckReportView()
+                    guild = self.bot.get_guild(reg.guild_id)
+                    if guild is None:
+                        guild = await self.bot.fetch_guild(reg.guild_id)
+                    channel = guild.get_channel(reg.channel_id)
+                    if channel is None:
+                        channel = await guild.fetch_channel(reg.channel_id)
+                    embed = await self.create_report_embed(guild=guild, target_date=target_date)
+                    await update_yet_complete_role(guild, target_date)
+                    await channel.send(content=f"{day_index + 1}日目", embed=embed, view=navigator)
+
+                except discord.NotFound:
+                    err_reglist.append(reg)
+                except HTTPException:
+                    logger.error(
+                        "HTTP exception by create attack report", exc_info=True, extra={"json_fields": log_fields}
+                    )
+                except Exception:
+                    logger.error(
+                        "unknown exception by create attack report", exc_info=True, extra={"json_fields": log_fields}
+                    )
+                else:
+                    published_reglist.append(reg.replace(last_published=target_date))
+        elapsed = (asyncio.get_running_loop().time() - started) * 1000
+        logger.info(
+            "published attack report",
+            extra={
+                "json_fields": {
+                    "guild_id": reglist[0].guild_id,
+                    "published": len(published_reglist),
+                    "elapsed_ms": round(elapsed, 1),
+                }
+            },
+        )
+        return published_reglist, err_reglist, elapsed
+
     @tasks.loop(time=time(hour=20, minute=0))
     async def scheduled_create_report(self):
         logger.info("run scheduled create report")
         now_date = (datetime.now(ZoneInfo("Asia/Tokyo")) - timedelta(hours=5)).date()
-        cbs = mongo.ClanBattleSchedule.Get()
+        cbs = await mongo.ClanBattleSchedule.Get()
         if cbs is None:
             return
         elif now_date >= cbs.start_date and now_date <= cbs.end_date:
             day_index = (now_date - cbs.start_date).days
-            reglist = mongo.AttackReportRegister.Gets()
-            err_reglist: list[mongo.AttackReportRegister] = []
+            reglist = await mongo.AttackReportRegister.Gets()
+            # 同じギルドのチャンネルはロール更新が競合しないよう順に、ギルド間は同時実行数を制限して並行に作成する
+            guild_reglists: dict[int, list[mongo.AttackReportRegister]] = {}
             for reg in reglist:
                 if reg.last_published < now_date:
-                    try:
-                        navigator = AttarckReportView()
-                        guild = self.bot.get_guild(reg.guild_id)
-                        if guild is None:
-                            guild = await self.bot.fetch_guild(reg.guild_id)
-                        channel = guild.get_channel(reg.channel_id)
-                        if channel is None:
-                            channel = await guild.fetch_channel(reg.channel_id)
-                        embed = await self.create_report_embed(guild=guild, target_date=now_date)
-                        await update_yet_complete_role(guild, now_date)
-                        await channel.send(content=f"{day_index + 1}日目", embed=embed, view=navigator)
-
-                    except discord.NotFound:
-                        err_reglist.append(reg)
-                    except HTTPException:
-                        logger.error(
-                            "HTTP exception by create attack report",
-                            exc_info=True,
-                            extra={
-                                "json_fields": {
-                                    "guild_id": reg.guild_id,
-                                    "channel_id": reg.channel_id,
-                                }
-                            },
-                        )
-                    except Exception:
-                        logger.error(
-                            "unknown exception by create attack report",
-                            exc_info=True,
-                            extra={
-                                "json_fields": {
-                                    "guild_id": reg.guild_id,
-                                    "channel_id": reg.channel_id,
-                                }
-                            },
-                        )
-                    else:
-                        reg.last_published = now_date
-                        reg.Set()
+                    guild_reglists.setdefault(reg.guild_id, []).append(reg)
+            semaphore = asyncio.Semaphore(config.report_publish_concurrency)
+            started = asyncio.get_running_loop().time()
+            results = await asyncio.gather(
+                *[
+                    self.publish_guild_reports(regs, now_date, day_index, started, semaphore)
+                    for regs in guild_reglists.values()
+                ]
+            )
+            published_reglist = [reg for published, _, _ in results for reg in published]
+            err_reglist = [reg for _, errs, _ in results for reg in errs]
+            elapsed_list = [elapsed for _, _, elapsed in results]
+            logger.info(
+                "finished scheduled create report",
+                extra={
+                    "json_fields": {
+                        "guilds": len(guild_reglists),
+                        "published": len(published_reglist),
+                        "not_found": len(err_reglist),
+                        "max_elapsed_ms": round(max(elapsed_list, default=0.0), 1),
+                    }
+                },
+            )
+
+            await mongo.AttackReportRegister.SetMany(published_reglist)
 
             for err_reg in err_reglist:
                 # 対象チャンネルがない(削除された)場合、report_registerから当チャンネルを外す
@@ -301,17 +401,16 @@ class AttarckReportCog(commands.Cog):
                         }
                     },
                 )
-                err_reg.Delete()
+            await mongo.AttackReportRegister.DeleteMany(err_reglist)
 
     @slash_command(
         guild_ids=config.guild_ids, name="atk_report_auto_register", description="凸完了報告表の自動作成を登録する"
     )
     @cmd_log.info("call attack report make auto register command")
     async def AttackReportAutoRegisterCommand(self, ctx: discord.ApplicationContext):
-        reglist = mongo.AttackReportRegister.Gets()
-        reg = next(filter(lambda x: x.guild_id == ctx.guild.id and x.channel_id == ctx.channel.id, reglist), None)
-        if reg is None:
-            mongo.AttackReportRegister(ctx.guild.id, ctx.channel.id, date(2020, 1, 1)).Set()
+        is_registered = await mongo.AttackReportRegister.Exists(guild_id=ctx.guild.id, channel_id=ctx.channel.id)
+        if not is_registered:
+            await mongo.AttackReportRegister(ctx.guild.id, ctx.channel.id, date(2020, 1, 1)).Set()
             await ctx.respond("このチャンネルに凸完了報告表の自動作成を登録しました")
         else:
             await ctx.respond("このチャンネルに凸完了報告表の自動作成は既に登録されています", ephemeral=True)
@@ -328,10 +427,9 @@ class AttarckReportCog(commands.Cog):
     )
     @cmd_log.info("call attack report make auto unregister command")
     async def AttackReportAutoUnregisterCommand(self, ctx: discord.ApplicationContext):
-        reglist = mongo.AttackReportRegister.Gets()
-        reg = next(filter(lambda x: x.guild_id == ctx.guild.id and x.channel_id == ctx.channel.id, reglist), None)
-        if reg is not None:
-            reg.Delete()
+        is_registered = await mongo.AttackReportRegister.Exists(guild_id=ctx.guild.id, channel_id=ctx.channel.id)
+        if is_registered:
+            await mongo.AttackReportRegister(ctx.guild.id, ctx.channel.id, date(2020, 1, 1)).Delete()
             await ctx.respond("このチャンネルに登録されていた凸完了報告表の自動作成を解除しました")
         else:
             await ctx.respond("このチャンネルに凸完了報告表の自動作成は登録されていません", ephemeral=True)
@@ -356,79 +454,197 @@ class AttarckReportCog(commands.Cog):
     async def AttackReportCommand_error(self, ctx: discord.ApplicationContext, error):
         return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
 
+    @slash_command(
+        guild_ids=[config.admin_guild_id],
+        name="atk_report_flush",
+        description="[admin]凸状況の書き込みバッファをDBへ書き込む",
+    )
+    @cmd_log.info("call attack report flush command")
+    @commands.is_owner()
+    async def AttackReportFlushCommand(self, ctx: discord.ApplicationContext):
+        if not mongo.report_buffer.enabled:
+            return await ctx.respond("書き込みバッファは無効です。", ephemeral=True)
+
+        await ctx.defer(ephemeral=True)
+        flushed = await mongo.report_buffer.Flush()
+        stats = mongo.report_buffer.stats()
+        await ctx.respond(
+            f"書き込み完了 件数:{flushed}, 保持中:{stats['boards']}日分, 未書き込み:{stats['dirty']}件",
+            ephemeral=True,
+        )
+
+    @AttackReportFlushCommand.error
+    @cmd_log.error("attack report flush command error")
+    async def AttackReportFlushCommand_error(self, ctx: discord.ApplicationContext, error):
+        return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
+
+    @slash_command(
+        guild_ids=[config.admin_guild_id],
+        name="get_report_lock_stats",
+        description="[admin]凸報告のロックとロール同期の状況の参照",
+    )
+    @cmd_log.info("call get report lock stats command")
+    @commands.is_owner()
+    async def GetReportLockStatsCommand(self, ctx: discord.ApplicationContext):
+        locks = report_locks.stats()
+        sync = role_sync.stats()
+        await ctx.respond(
+            f"凸報告 件数:{locks['entries']}, 使用中:{locks['held']}, 削除数:{locks['evictions']}, "
+            f"サイズ:{locks['bytes'] // 1024}KB\n"
+            f"ロール同期 件数:{sync['entries']}, 使用中:{sync['held']}, 削除数:{sync['evictions']}, "
+            f"サイズ:{sync['bytes'] // 1024}KB, "
+            f"待機中:{sync['pending']}, 実行中:{sync['running']}",
+            ephemeral=True,
+        )
+
+    @GetReportLockStatsCommand.error
+    @cmd_log.error("get report lock stats command error")
+    async def GetReportLockStatsCommand_error(self, ctx: discord.ApplicationContext, error):
+        return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
+
 
 def setup(bot: BotClass):
     logger.info("Load bot cog from %s", __name__)
     bot.add_cog(AttarckReportCog(bot))
+    if mongo.report_buffer.enabled:
+        bot.close_callbacks.append(mongo.report_buffer.Flush)
     bot.persistent_view_classes.add(AttarckReportView)
 
 
 async def change_reports(
-    guild: discord.Guild, target_date: date, user_id: int, repl_func: Callable[[str], str]
+    guild: discord.Guild,
+    target_date: date,
+    user_id: int,
+    change: mongo.ReportChange,
+    message: Optional[discord.Message] = None,
 ) -> tuple[bool, str, str]:
-    reports = mongo.AttackReport.Gets(guild.id, target_date)
-    target_repo = next(filter(lambda r: r[1].user_id == user_id, enumerate(reports)), None)
-    if target_repo is None:
+    reports = await mongo.AttackReport.Change(guild.id, target_date, user_id, change=change)
+    if reports is None:
         return False, "", ""
+    aggregate = update_report_aggregate(guild, target_date, reports, user_id)
+    await request_yet_complete_role_sync(guild, aggregate.yet_complete_user_ids())
+    request_lost_members_refresh(guild, target_date, aggregate, message)
+    return True, aggregate.render(), aggregate.summary()
+
+
+def update_report_aggregate(
+    guild: discord.Guild, target_date: date, reports: list[mongo.AttackReport], user_id: Optional[int] = None
+) -> ReportAggregate:
+    # report_locksのロック中に、user_idのメンバーの報告を1件変更した直後に呼び出すこと
+    # user_idを指定した場合はそのメンバーの報告のみを集計に反映する。集計がない、または集計後にその変更以外の
+    # 書き込みやDBからの読み直しがあった(書き込みの版が1つ先でない)場合は作り直す
+    # キャッシュにいないメンバーは見つからないメンバーとして表示し、ここではメンバーの再取得を待たない
+    key = (guild.id, target_date)
+    aggregate = report_locks.get(key)
+    version = mongo.report_versions.Get(guild.id, target_date)
+    report = None if user_id is None else aggregate_target(aggregate, reports, user_id, version)
+    if report is None:
+        aggregate = ReportAggregate(reports, member_names(guild, [r.user_id for r in reports]), version)
+        report_locks.set(key, aggregate)
+        report_dates.setdefault(guild.id, set()).add(target_date)
+    else:
+        aggregate.update(report, member_names(guild, [report.user_id])[report.user_id])
+        aggregate.version = version
+    return aggregate
+
+
+def aggregate_target(
+    aggregate: Optional[ReportAggregate],
+    reports: list[mongo.AttackReport],
+    user_id: int,
+    version: Optional[tuple[int, int]],
+) -> Optional[mongo.AttackReport]:
+    # 集計へ差分で反映できる場合は変更されたメンバーの報告を返す。作り直す必要がある場合はNone
+    if aggregate is None or aggregate.version is None or version is None or len(reports) != len(aggregate):
+        return None
+    if aggregate.version != (version[0], version[1] - 1) or aggregate.get(user_id) is None:
+        return None
+    return next((r for r in reports if r.user_id == user_id), None)
+
+
+def rename_report_member(guild_id: int, user_id: int, name: Optional[str]) -> None:
+    # メンバーの表示名の変更・参加・退出を、保持している集計へ反映する。削除済みの集計の日付はここで外す
+    dates = report_dates.get(guild_id)
+    if dates is None:
+        return
+    for target_date in list(dates):
+        aggregate = report_locks.get((guild_id, target_date))
+        if aggregate is None:
+            dates.discard(target_date)
+        else:
+            aggregate.rename(user_id, name)
+    if not dates:
+        del report_dates[guild_id]
 
-    repl_repo = repl_func(target_repo[1].report)
-    target_repo[1].report = repl_repo
-    target_repo[1].Set()
-    reports[target_repo[0]] = target_repo[1]
-    reports = sorted(reports, key=lambda r: (r.report.count(EMOJI_YET_ATK), r.report.count(EMOJI_CARRY)), reverse=True)
-
-    lost_members = []
-    for r in reports:
-        if guild.get_member(r.user_id) is None:
-            fetched_mems = await guild.fetch_members().flatten()
-            fetched_uids = [m.id for m in fetched_mems]
-            lost_members = [rr for rr in reports if rr.user_id not in fetched_uids]
-            break
-
-    repo_list = [
-        f"{r.report} : {guild.get_member(r.user_id).display_name} : {r.memo}" for r in reports if r not in lost_members
-    ]
-    lost_repo_list = [
-        f"{r.report} : ユーザID: {r.user_id} が見つかりませんでした。" for r in reports if r in lost_members
-    ]
-    repo_list += lost_repo_list
-    repl_reports = "```\n" + "\n".join(repo_list) + "\n```"
-
-    yet_atk_count = sum([r.report.count(EMOJI_YET_ATK, 0, 3) for r in reports])
-    cmp_atk_count = sum([r.report.count(EMOJI_CMP_ATK, 0, 3) for r in reports])
-    carry_count = sum([r.report.count(EMOJI_CARRY, 0, 3) for r in reports])
-    repo_summary = (
-        f"凸状況 (残凸`{EMOJI_YET_ATK}`= **{yet_atk_count}** , "
-        f"持越`{EMOJI_CARRY}`= **{carry_count}** , "
-        f"消化`{EMOJI_CMP_ATK}`= **{cmp_atk_count}** )"
-    )
 
-    return True, repl_reports, repo_summary
+def member_names(guild: discord.Guild, user_ids: list[int]) -> dict[int, Optional[str]]:
+    # キャッシュ済みのメンバーの表示名。見つからないメンバーはNone
+    members = {uid: guild.get_member(uid) for uid in user_ids}
+    return {uid: None if m is None else m.display_name for uid, m in members.items()}
 
 
-async def update_yet_complete_role(guild: discord.Guild, target_date: date):
-    mongo_role = mongo.YetCompleteRole.Get(guild.id)
-    if mongo_role is None:
+async def resolve_lost_members(
+    guild: discord.Guild, target_date: date, user_ids: set[int], message: Optional[discord.Message] = None
+) -> None:
+    # report_locksの外で呼び出すこと。メンバーを再取得し、見つかったメンバーを集計と表示に反映する
+    if not user_ids:
         return
+    await role_index.refresh(guild)
+    async with report_locks.hold((guild.id, target_date)):
+        aggregate = report_locks.get((guild.id, target_date))
+        if aggregate is None:
+            return
+        names = {uid: name for uid, name in member_names(guild, list(user_ids)).items() if name is not None}
+        for uid, name in names.items():
+            aggregate.rename(uid, name)
+        if names and message is not None and message.embeds:
+            embed = message.embeds[0].copy()
+            embed.set_field_at(0, name=aggregate.summary(), value=aggregate.render(), inline=embed.fields[0].inline)
+            try:
+                await message.edit(embed=embed)
+            except discord.HTTPException:
+                logger.warning(
+                    "failed to update attack report", exc_info=True, extra={"json_fields": {"guild_id": guild.id}}
+                )
+
+
+def request_lost_members_refresh(
+    guild: discord.Guild, target_date: date, aggregate: ReportAggregate, message: Optional[discord.Message]
+) -> None:
+    # ボタン操作の応答を待たせないよう、見つからないメンバーの再取得と表示の更新はバックグラウンドで行う
+    key = (guild.id, target_date)
+    lost_user_ids = aggregate.lost_user_ids()
+    if lost_user_ids and key not in resolving_reports and role_index.refresh_due(guild):
+        resolving_reports.add(key)
+        task = create_background_task(resolve_lost_members(guild, target_date, lost_user_ids, message))
+        task.add_done_callback(lambda _: resolving_reports.discard(key))
+
+
+async def yet_complete_role(guild: discord.Guild) -> Optional[discord.Role]:
+    mongo_role = await mongo.YetCompleteRole.Get(guild.id)
+    if mongo_role is None:
+        return None
     yet_cmp_role = guild.get_role(mongo_role.role_id)
     if yet_cmp_role is None:
         roles = await guild.fetch_roles()
         yet_cmp_role = next(filter(lambda r: r.id == mongo_role.role_id, roles), None)
-        if yet_cmp_role is None:
-            return
-    role_user_ids = set([m.id for m in yet_cmp_role.members])
-
-    reports = mongo.AttackReport.Gets(guild.id, target_date)
-    repo_yet_user_ids = set([r.user_id for r in reports if r.report != EMOJI_CMP_ATK * 3])
-
-    remove_role_user_ids = role_user_ids - repo_yet_user_ids
-    for uid in remove_role_user_ids:
-        mem = guild.get_member(uid)
-        if mem is not None:
-            await mem.remove_roles(yet_cmp_role)
-
-    add_role_user_ids = repo_yet_user_ids - role_user_ids
-    for uid in add_role_user_ids:
-        mem = guild.get_member(uid)
-        if mem is not None:
-            await mem.add_roles(yet_cmp_role)
+    return yet_cmp_role
+
+
+def yet_complete_user_ids(reports: list[mongo.AttackReport]) -> set[int]:
+    return set([r.user_id for r in reports if r.report != EMOJI_CMP_ATK * 3])
+
+
+async def update_yet_complete_role(guild: discord.Guild, target_date: date):
+    yet_cmp_role = await yet_complete_role(guild)
+    if yet_cmp_role is None:
+        return
+    reports = await mongo.AttackReport.Gets(guild.id, target_date)
+    await role_sync.sync(guild, yet_cmp_role, yet_complete_user_ids(reports))
+
+
+async def request_yet_complete_role_sync(guild: discord.Guild, user_ids: set[int]):
+    # ボタン操作毎の同期はまとめてバックグラウンドで行う
+    yet_cmp_role = await yet_complete_role(guild)
+    if yet_cmp_role is not None:
+        role_sync.request(guild, yet_cmp_role, user_ids)
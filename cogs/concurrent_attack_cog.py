@@ -1,10 +1,8 @@
 import asyncio
-import re
 from datetime import datetime, timedelta
 from logging import getLogger
-from pyclbr import Function
 from string import Template
-from typing import Optional
+from typing import Awaitable, Callable, Optional, Union
 
 import discord
 from discord.commands import Option, slash_command
@@ -13,8 +11,14 @@ from discord.ui import InputText, Modal, Select, View
 
 import app_config
 import mongo_data as mongo
+from attack_board import AttackBoard, AttackEntry
+from board_lock import BoardLeaseLost, BoardLockError, create_board_lock
+from bounded_map import BoundedLockMap
 from log_decorator import ButtonLogDecorator, CallbackLogDecorator, CommandLogDecorator
+from member_index import member_index
+from mongo_monitor import create_background_task
 from mybot import BotClass
+from notify_dispatcher import notify_dispatcher
 
 logger = getLogger(__name__)
 config = app_config.Config.get_instance()
@@ -22,14 +26,132 @@ btn_log = ButtonLogDecorator(logger=logger)
 cb_log = CallbackLogDecorator(logger=logger)
 cmd_log = CommandLogDecorator(logger=logger)
 
-escape_regexp = re.compile(r"([\(\)\[\]\{\}\.\^\$\*\+\?\\])")
+UpdateBoardMethod = Callable[[int, str, Callable[[AttackBoard], None]], Awaitable[AttackBoard]]
+
+# メッセージID毎の同時凸の状況と更新用のロック
+boards: BoundedLockMap[int, AttackBoard] = BoundedLockMap(
+    max_entries=config.board_cache_size,
+    idle_seconds=config.board_cache_idle_seconds,
+)
+board_lock = create_board_lock(boards)
+
+
+async def save_board(id: int, board: AttackBoard, lease_owner: Optional[str] = None) -> None:
+    saved = await mongo.ConcurrentAttackBoard(id, board.header, board.separator, board.to_dicts()).Set(lease_owner)
+    if lease_owner is not None and saved is None:
+        raise BoardLeaseLost(f"board lease was taken by another process. message_id: {id}")
+
+
+async def send_board_busy(interaction: discord.Interaction) -> None:
+    # ロックを取得できなかった、またはリースを失った場合は更新せずに再操作を促す
+    await interaction.followup.send(
+        "他の操作と重なったため更新できませんでした。もう一度操作して下さい。", ephemeral=True
+    )
+
+
+class BoardSnapshotWriter:
+    # 同時凸の状況をDBへ書き込む。メッセージ毎に書き込みは1つずつ行い、書き込み中の変更は完了後にまとめて書き込む
+    def __init__(self) -> None:
+        self.__running: dict[int, asyncio.Task] = {}
+        self.__pending: dict[int, AttackBoard] = {}
+
+    def schedule(self, id: int, board: AttackBoard) -> None:
+        self.__pending[id] = board
+        if id not in self.__running:
+            self.__running[id] = create_background_task(self.__run(id))
+
+    async def __run(self, id: int) -> None:
+        try:
+            while id in self.__pending:
+                board = self.__pending.pop(id)
+                try:
+                    await save_board(id, board)
+                except Exception:
+                    logger.error(
+                        "failed to save concurrent attack board",
+                        exc_info=True,
+                        extra={"json_fields": {"message_id": id}},
+                    )
+        finally:
+            self.__running.pop(id, None)
+
+
+snapshot_writer = BoardSnapshotWriter()
+
+
+class BoardEditCoalescer:
+    # 同時凸のメッセージ編集をまとめる
+    # 最後の変更からwindow秒(最初の変更からは最大max_delay秒)待ち、最新の状況で1回だけ編集する
+    def __init__(self, window: float, max_delay: float) -> None:
+        self.window = window
+        self.max_delay = max_delay
+        self.requested = 0
+        self.edited = 0
+        self.__running: dict[int, asyncio.Task] = {}
+        self.__pending: dict[int, tuple[Union[discord.Message, discord.PartialMessage], AttackBoard]] = {}
+        self.__first: dict[int, float] = {}
+        self.__last: dict[int, float] = {}
+
+    def schedule(self, message: Union[discord.Message, discord.PartialMessage], board: AttackBoard) -> None:
+        id = message.id
+        now = asyncio.get_running_loop().time()
+        self.requested += 1
+        self.__pending[id] = (message, board)
+        self.__first.setdefault(id, now)
+        self.__last[id] = now
+        if id not in self.__running:
+            self.__running[id] = create_background_task(self.__run(id))
+
+    async def __run(self, id: int) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while id in self.__pending:
+                while True:
+                    deadline = min(self.__last[id] + self.window, self.__first[id] + self.max_delay)
+                    wait = deadline - loop.time()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                message, board = self.__pending.pop(id)
+                del self.__first[id], self.__last[id]
+                try:
+                    await message.edit(content=board.render())
+                    self.edited += 1
+                except Exception:
+                    logger.error(
+                        "failed to edit concurrent attack board",
+                        exc_info=True,
+                        extra={"json_fields": {"message_id": id}},
+                    )
+        finally:
+            self.__running.pop(id, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": len(self.__pending), "requested": self.requested, "edited": self.edited}
+
+
+edit_coalescer = BoardEditCoalescer(window=config.board_edit_window, max_delay=config.board_edit_max_delay)
+
+
+async def load_board(id: int, src_content: str) -> AttackBoard:
+    # board_lock.hold(id)の中(複数プロセスで動かす場合の読み込みのみは外でもよい)で呼び出すこと
+    # キャッシュになければDBのスナップショット、なければ本文から復元する
+    # 複数プロセスで動かす場合は他のプロセスの更新を反映するため、毎回DBから読み込む
+    board = None if board_lock.shared else boards.get(id)
+    if board is None:
+        snapshot = await mongo.ConcurrentAttackBoard.Get(id)
+        if snapshot is not None:
+            entries = [AttackEntry.from_dict(d) for d in snapshot.entries]
+            board = AttackBoard(snapshot.header, entries, snapshot.separator)
+        else:
+            board = AttackBoard.parse(src_content)
+        boards.set(id, board)
+    return board
 
 
 class CancelUserSelect(Select):
-    def __init__(self, message: discord.Message, replace_method: Function):
-        atk_contents = message.content.splitlines()
-        usernames = [re.findall(r"  (.*) 目標\d+万 :", atk)[0] for atk in atk_contents[2:]]
-        options = [discord.SelectOption(label=u) for u in usernames]
+    def __init__(self, message: discord.Message, board: AttackBoard, update_method: UpdateBoardMethod):
+        options = [discord.SelectOption(label=u) for u in board.usernames()]
 
         # The placeholder is what will be shown when no option is chosen
         # The min and max values indicate we can only pick one of the three options
@@ -42,14 +164,22 @@ class CancelUserSelect(Select):
             options=options,
         )
         self.message_id = message.id
-        self.replace_function = replace_method
+        self.src_content = message.content
+        self.update_function = update_method
 
     @cb_log.info("submit a cancel user select")
     async def callback(self, interaction: discord.Interaction):
-        refresh_message = await interaction.channel.fetch_message(self.message_id)
-        repl_content = await self.replace_function(self.message_id, refresh_message.content, self.values)
-        await refresh_message.edit(content=repl_content)
-        await interaction.response.send_message(
+        def remove_users(board: AttackBoard) -> None:
+            for username in self.values:
+                board.remove(username)
+
+        await interaction.response.defer()
+        try:
+            board = await self.update_function(self.message_id, self.src_content, remove_users)
+        except BoardLockError:
+            return await send_board_busy(interaction)
+        edit_coalescer.schedule(interaction.channel.get_partial_message(self.message_id), board)
+        await interaction.followup.send(
             content="下記ユーザーの凸をキャンセルしました。\n{}".format("\n".join(self.values)), ephemeral=True
         )
 
@@ -59,47 +189,48 @@ class CancelUserSelect(Select):
 
 
 class ProxyCancelView(View):
-    def __init__(self, message, replace_method):
+    def __init__(self, message: discord.Message, board: AttackBoard, update_method: UpdateBoardMethod):
         super().__init__(timeout=120)
-        self.add_item(CancelUserSelect(message, replace_method))
+        self.add_item(CancelUserSelect(message, board, update_method))
 
 
 class DamageModal(Modal):
-    def __init__(self, message: discord.Message, username: str, replace_method: Function) -> None:
+    def __init__(
+        self, message: discord.Message, board: AttackBoard, username: str, update_method: UpdateBoardMethod
+    ) -> None:
         super().__init__(title="ダメージ入力")
         self.username = username
-        self.re_username = escape_regexp.sub(r"\\\1", username)
         self.message_id = message.id
-        self.replace_function = replace_method
-        atk_contents = message.content.splitlines()
-        self.boss_str = atk_contents[0].split(" ")[0]
+        self.src_content = message.content
+        self.update_function = update_method
+        self.boss_str = board.boss_str
 
-        self.target_attack = [atk for atk in atk_contents[2:] if re.search(rf"  {self.re_username} 目標\d+万 :", atk)][
-            0
-        ]
+        self.target_attack = board.get(username).render()
         cut_atk_message = self.target_attack[:44]
         self.add_item(InputText(label=cut_atk_message, placeholder="ダメージを入力して下さい"))
 
     @cb_log.info("submit a damage modal")
     async def callback(self, interaction: discord.Interaction):
-        refresh_message = await interaction.channel.fetch_message(self.message_id)
         damage = self.children[0].value
-        repl_content = await self.replace_function(
-            self.message_id, refresh_message.content, [self.username], note=damage
-        )
-        await interaction.response.edit_message(content=repl_content)
-
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
-        if notify is not None and notify.level >= 3:
-            attack = re.match(rf".*  {self.re_username} 目標\d+万 :", self.target_attack).group()
+        await interaction.response.defer()
+        try:
+            board = await self.update_function(
+                self.message_id, self.src_content, lambda b: b.set_note(self.username, damage)
+            )
+        except BoardLockError:
+            return await send_board_busy(interaction)
+        edit_coalescer.schedule(interaction.channel.get_partial_message(self.message_id), board)
+
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
+        entry = board.get(self.username)
+        if notify is not None and notify.level >= 3 and entry is not None:
+            attack = entry.attack_text()
             embed = discord.Embed(
                 title="ダメージ入力しました。",
                 fields=[discord.EmbedField(name=self.boss_str, value=f"{attack} {damage}")],
             )
             embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-            channel = interaction.guild.get_channel_or_thread(notify.channel_id)
-            channel = channel if channel is not None else await interaction.guild.fetch_channel(notify.channel_id)
-            await channel.send(embed=embed)
+            notify_dispatcher.submit(interaction.guild, notify.channel_id, embed=embed)
 
     @cb_log.error("error a damage modal")
     async def on_error(self, error: Exception, interaction: discord.Interaction) -> None:
@@ -107,11 +238,14 @@ class DamageModal(Modal):
 
 
 class TargetDamageModal(Modal):
-    def __init__(self, message: discord.Message, username: str, attack_kind: str, replace_method: Function) -> None:
+    def __init__(
+        self, message: discord.Message, user: discord.Member, attack_kind: str, update_method: UpdateBoardMethod
+    ) -> None:
         super().__init__(title=f"{attack_kind} 目標ダメージ入力")
-        self.username = username
+        self.username = user.display_name
+        self.user_id = user.id
         self.message_id = message.id
-        self.replace_function = replace_method
+        self.update_function = update_method
         self.atk_content = message.content
         self.attack_kind = attack_kind
         self.add_item(InputText(label="ダメージ(万)", placeholder="1234"))
@@ -119,35 +253,26 @@ class TargetDamageModal(Modal):
 
     @cb_log.info("submit a target damage modal")
     async def callback(self, interaction: discord.Interaction):
-        repl_content = await self.replace_function(
-            self.message_id,
-            self.atk_content,
-            [self.username],
-            repl_atk=self.attack_kind,
-            target_damage=int(self.children[0].value),
-            note=self.children[1].value,
-        )
-        await interaction.response.edit_message(content=repl_content)
-
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
+        target_damage = int(self.children[0].value)
+        note = self.children[1].value
+
+        def register_attack(board: AttackBoard) -> None:
+            board.register(self.username, self.attack_kind, target_damage, user_id=self.user_id)
+            if note is not None:
+                board.set_note(self.username, note)
+
+        await interaction.response.defer()
+        try:
+            board = await self.update_function(self.message_id, self.atk_content, register_attack)
+        except BoardLockError:
+            return await send_board_busy(interaction)
+        edit_coalescer.schedule(interaction.channel.get_partial_message(self.message_id), board)
+
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
         if notify is not None and notify.level >= 3:
-            await self.send_attack_notify(
-                notify_channel_id=notify.channel_id,
-                content=repl_content,
-                attack=self.attack_kind,
-                interaction=interaction,
-            )
-
-    async def send_attack_notify(
-        self, notify_channel_id: int, content: str, attack: str, interaction: discord.Interaction
-    ):
-        boss_match = re.match(r".* 残りHP", content)
-        boss_str = boss_match.group().removesuffix(" 残りHP") if boss_match else "error"
-        embed = discord.Embed(title=f"{boss_str} {attack}で登録しました。")
-        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-        channel = interaction.guild.get_channel_or_thread(notify_channel_id)
-        channel = channel if channel is not None else await interaction.guild.fetch_channel(notify_channel_id)
-        await channel.send(embed=embed)
+            embed = discord.Embed(title=f"{board.boss_label} {self.attack_kind}で登録しました。")
+            embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
+            notify_dispatcher.submit(interaction.guild, notify.channel_id, embed=embed)
 
     @cb_log.error("error a target damage modal")
     async def on_error(self, error: Exception, interaction: discord.Interaction) -> None:
@@ -156,13 +281,17 @@ class TargetDamageModal(Modal):
 
 class AttackStartModal(Modal):
     def __init__(
-        self, guild_id: int, members: list[discord.Member], boss_number: int, boss_name: str, message_url: str
+        self,
+        temp_msg: Optional[mongo.TemplateAttackStartMessage],
+        members: list[discord.Member],
+        boss_number: int,
+        boss_name: str,
+        message_url: str,
     ) -> None:
         super().__init__(title=f"{boss_number}ボス {boss_name} 同時凸開始")
         self.boss_number = boss_number
         self.message_url = message_url
         self.mentions = " ".join([mem.mention for mem in members])
-        temp_msg = mongo.TemplateAttackStartMessage.Get(guild_id=guild_id, boss_number=boss_number)
         if temp_msg:
             temp = Template(temp_msg.template)
             val_map = {"boss_number": boss_number, "boss_name": boss_name}
@@ -190,13 +319,11 @@ class AttackStartModal(Modal):
         embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
         if self.children[1].value:
             embed.set_image(url=self.children[1].value)
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
         if notify is not None:
             await interaction.response.defer()
             if notify.level >= 1:
-                channel = interaction.guild.get_channel_or_thread(notify.channel_id)
-                channel = channel if channel is not None else await interaction.guild.fetch_channel(notify.channel_id)
-                await channel.send(content=content, embed=embed)
+                notify_dispatcher.submit(interaction.guild, notify.channel_id, content=content, embed=embed)
         else:
             await interaction.response.send_message(content=content, embed=embed)
 
@@ -219,11 +346,16 @@ class AttackStartModal(Modal):
 
 
 class UnfreezeModal(Modal):
-    def __init__(self, guild_id: int, members: list[discord.Member], boss_number: int, boss_name: str) -> None:
+    def __init__(
+        self,
+        temp_msg: Optional[mongo.TemplateUnfreezeMessage],
+        members: list[discord.Member],
+        boss_number: int,
+        boss_name: str,
+    ) -> None:
         super().__init__(title=f"{boss_number}ボス {boss_name} 解凍")
         self.boss_number = boss_number
         self.mentions = " ".join([mem.mention for mem in members])
-        temp_msg = mongo.TemplateUnfreezeMessage.Get(guild_id=guild_id, boss_number=boss_number)
         if temp_msg:
             temp = Template(temp_msg.template)
             val_map = {"boss_number": boss_number, "boss_name": boss_name}
@@ -251,13 +383,11 @@ class UnfreezeModal(Modal):
         embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
         if self.children[1].value:
             embed.set_image(url=self.children[1].value)
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
         if notify is not None:
             await interaction.response.defer()
             if notify.level >= 1:
-                channel = interaction.guild.get_channel_or_thread(notify.channel_id)
-                channel = channel if channel is not None else await interaction.guild.fetch_channel(notify.channel_id)
-                await channel.send(content=content, embed=embed)
+                notify_dispatcher.submit(interaction.guild, notify.channel_id, content=content, embed=embed)
         else:
             await interaction.response.send_message(content=content, embed=embed)
 
@@ -277,65 +407,33 @@ class ConcurrentAttackButtonView(View):
     def __init__(self):
         # making None is important if you want the button work after restart!
         super().__init__(timeout=None)
-        self.lock_lock = asyncio.Lock()
-        self.replace_locks = {}
-        self.cache_contents = {}
 
-    async def sync_replace_content(
-        self,
-        id: int,
-        src_content: str,
-        usernames: list[str],
-        repl_atk: Optional[str] = None,
-        target_damage: Optional[int] = None,
-        note: Optional[str] = None,
-        is_change_battle_in: bool = False,
-    ) -> str:
-        async with self.lock_lock:
-            lock = self.replace_locks.get(id)
-            if lock is None:
-                lock = asyncio.Lock()
-                self.replace_locks[id] = lock
-
-        async with lock:
-            cache_content = self.cache_contents.get(id)
-            if cache_content is not None and src_content != cache_content:
-                src_content = cache_content
-            content_lines = src_content.splitlines()
-            atk_lines = content_lines[2:]
-            for username in usernames:
-                if is_change_battle_in:
-                    atk_lines = change_battle_in(atk_lines, username)
-                elif note is None:
-                    atk_lines = replace_attacks(atk_lines, username, repl_atk, target_damage)
-                else:
-                    if repl_atk is not None:
-                        atk_lines = replace_attacks(atk_lines, username, repl_atk, target_damage)
-                    atk_lines = add_note(atk_lines, username, note)
-            content_lines[2:] = atk_lines
-            self.cache_contents[id] = "\n".join(content_lines)
-            dst_content = self.cache_contents[id]
-        return dst_content
-
-    async def send_attack_notify(
-        self, notify_channel_id: int, content: str, attack: str, interaction: discord.Interaction
-    ):
-        boss_match = re.match(r".* 残りHP", content)
-        boss_str = boss_match.group().removesuffix(" 残りHP") if boss_match else "error"
-        embed = discord.Embed(title=f"{boss_str} {attack}で登録しました。")
-        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-        channel = interaction.guild.get_channel_or_thread(notify_channel_id)
-        channel = channel if channel is not None else await interaction.guild.fetch_channel(notify_channel_id)
-        await channel.send(embed=embed)
-
-    async def send_cancel_notify(self, notify_channel_id: int, content: str, interaction: discord.Interaction):
-        boss_match = re.match(r".* 残りHP", content)
-        boss_str = boss_match.group().removesuffix(" 残りHP") if boss_match else "error"
+    async def get_board(self, id: int, src_content: str) -> AttackBoard:
+        # メッセージ毎に一度だけ復元し、以降はメモリ上の状態を正とする
+        if board_lock.shared:
+            # 書き込まないためリースは取得せず、最新のスナップショットを読み込む
+            return await load_board(id, src_content)
+        board = boards.get(id)
+        if board is not None:
+            return board
+        async with board_lock.hold(id):
+            return await load_board(id, src_content)
+
+    async def sync_update_board(self, id: int, src_content: str, update: Callable[[AttackBoard], None]) -> AttackBoard:
+        async with board_lock.hold(id) as lease_owner:
+            board = await load_board(id, src_content)
+            update(board)
+            if board_lock.shared:
+                # 他のプロセスがロックを取得する前に書き込みを終える。リースを失っていれば書き込まずに失敗する
+                await save_board(id, board, lease_owner)
+            else:
+                snapshot_writer.schedule(id, board)
+        return board
+
+    def send_cancel_notify(self, notify_channel_id: int, boss_str: str, interaction: discord.Interaction) -> None:
         embed = discord.Embed(title=f"{boss_str} キャンセルしました。")
         embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-        channel = interaction.guild.get_channel_or_thread(notify_channel_id)
-        channel = channel if channel is not None else await interaction.guild.fetch_channel(notify_channel_id)
-        await channel.send(embed=embed)
+        notify_dispatcher.submit(interaction.guild, notify_channel_id, embed=embed)
 
     @discord.ui.select(
         placeholder="凸内容を選択",
@@ -349,9 +447,7 @@ class ConcurrentAttackButtonView(View):
     )
     async def AttackSelectCallback(self, select: discord.ui.Select, interaction: discord.Interaction):
         attack_kind = select.values[0]
-        modal = TargetDamageModal(
-            interaction.message, interaction.user.display_name, attack_kind, self.sync_replace_content
-        )
+        modal = TargetDamageModal(interaction.message, interaction.user, attack_kind, self.sync_update_board)
         await interaction.response.send_modal(modal=modal)
 
     # custom_id is required and should be unique for <commands.Bot.add_view>
@@ -360,25 +456,26 @@ class ConcurrentAttackButtonView(View):
     @discord.ui.button(style=discord.ButtonStyle.blurple, label="本戦", emoji="✈️", custom_id="declaration", row=2)
     @btn_log.log("push declaration button")
     async def DeclarationButton(self, button, interaction: discord.Interaction):
-        repl_content = await self.sync_replace_content(
-            interaction.message.id,
-            interaction.message.content,
-            [interaction.user.display_name],
-            is_change_battle_in=True,
-        )
-        await interaction.response.edit_message(content=repl_content)
+        await interaction.response.defer()
+        try:
+            board = await self.sync_update_board(
+                interaction.message.id,
+                interaction.message.content,
+                lambda b: b.toggle_battle_in(interaction.user.display_name),
+            )
+        except BoardLockError:
+            return await send_board_busy(interaction)
+        edit_coalescer.schedule(interaction.message, board)
 
     @discord.ui.button(
         style=discord.ButtonStyle.blurple, label="ダメ入力", emoji="📝", custom_id="input_damage", row=2
     )
     @btn_log.log("push input damage attack button")
     async def InputDamageButton(self, button, interaction: discord.Interaction):
-        atk_list = interaction.message.content.splitlines()
+        board = await self.get_board(interaction.message.id, interaction.message.content)
         username = interaction.user.display_name
-        re_username = escape_regexp.sub(r"\\\1", username)
-        matches = [atk for atk in atk_list[2:] if re.search(rf"  {re_username} 目標\d+万 :", atk)]
-        if len(matches) == 1:
-            modal = DamageModal(interaction.message, username, self.sync_replace_content)
+        if board.get(username) is not None:
+            modal = DamageModal(interaction.message, board, username, self.sync_update_board)
             await interaction.response.send_modal(modal)
         else:
             await interaction.response.send_message("対象凸がありません。", ephemeral=True)
@@ -386,28 +483,32 @@ class ConcurrentAttackButtonView(View):
     @discord.ui.button(style=discord.ButtonStyle.red, label="取消", emoji="🚮", custom_id="cancel_attack", row=2)
     @btn_log.log("push cancel attack button")
     async def CancelAttackButton(self, button, interaction: discord.Interaction):
-        repl_content = await self.sync_replace_content(
-            interaction.message.id,
-            interaction.message.content,
-            [interaction.user.display_name],
-        )
-        await interaction.response.edit_message(content=repl_content)
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
+        await interaction.response.defer()
+        try:
+            board = await self.sync_update_board(
+                interaction.message.id,
+                interaction.message.content,
+                lambda b: b.remove(interaction.user.display_name),
+            )
+        except BoardLockError:
+            return await send_board_busy(interaction)
+        edit_coalescer.schedule(interaction.message, board)
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=interaction.guild_id)
         if notify is not None and notify.level >= 3:
-            await self.send_cancel_notify(
-                notify_channel_id=notify.channel_id, content=repl_content, interaction=interaction
+            self.send_cancel_notify(
+                notify_channel_id=notify.channel_id, boss_str=board.boss_label, interaction=interaction
             )
 
     @discord.ui.button(style=discord.ButtonStyle.green, label="同凸開始", emoji="📢", custom_id="attack_start", row=3)
     @btn_log.log("push attack start button")
     async def AttackStartButton(self, button, interaction: discord.Interaction):
-        atk_list = interaction.message.content.splitlines()
-        members = get_attack_members(atk_list[2:], interaction.guild)
-        boss_content = atk_list[0].split(" ")[0]
-        boss_number = int(boss_content.split(":")[0])
-        boss_name = boss_content.split(":")[1]
+        board = await self.get_board(interaction.message.id, interaction.message.content)
+        members = get_attack_members(board, interaction.guild)
+        boss_number = board.boss_number
+        boss_name = board.boss_name
+        temp_msg = await mongo.TemplateAttackStartMessage.Get(guild_id=interaction.guild_id, boss_number=boss_number)
         modal = AttackStartModal(
-            guild_id=interaction.guild_id,
+            temp_msg=temp_msg,
             members=members,
             boss_number=boss_number,
             boss_name=boss_name,
@@ -418,24 +519,22 @@ class ConcurrentAttackButtonView(View):
     @discord.ui.button(style=discord.ButtonStyle.green, label="解凍", emoji="🔥", custom_id="unfreeze", row=3)
     @btn_log.log("push unfreeze button")
     async def UnfreezeButton(self, button, interaction: discord.Interaction):
-        atk_list = interaction.message.content.splitlines()
-        members = get_attack_members(atk_list[2:], interaction.guild)
-        boss_content = atk_list[0].split(" ")[0]
-        boss_number = int(boss_content.split(":")[0])
-        boss_name = boss_content.split(":")[1]
-        modal = UnfreezeModal(
-            guild_id=interaction.guild_id, members=members, boss_number=boss_number, boss_name=boss_name
-        )
+        board = await self.get_board(interaction.message.id, interaction.message.content)
+        members = get_attack_members(board, interaction.guild)
+        boss_number = board.boss_number
+        boss_name = board.boss_name
+        temp_msg = await mongo.TemplateUnfreezeMessage.Get(guild_id=interaction.guild_id, boss_number=boss_number)
+        modal = UnfreezeModal(temp_msg=temp_msg, members=members, boss_number=boss_number, boss_name=boss_name)
         await interaction.response.send_modal(modal)
 
     @discord.ui.button(style=discord.ButtonStyle.gray, label="代消", emoji="☢️", custom_id="proxy_cancel_attack", row=3)
     @btn_log.log("push proxy cancel attack button")
     async def ProxyCancelAttackButton(self, button, interaction: discord.Interaction):
-        atk_list = interaction.message.content.splitlines()
-        if len(atk_list) <= 2:
+        board = await self.get_board(interaction.message.id, interaction.message.content)
+        if not board.entries:
             return await interaction.response.defer()
 
-        pcview = ProxyCancelView(interaction.message, self.sync_replace_content)
+        pcview = ProxyCancelView(interaction.message, board, self.sync_update_board)
         resp_msg = await interaction.response.send_message(
             content="キャンセルする凸のユーザーを選択して下さい(複数可)", view=pcview, ephemeral=True
         )
@@ -468,12 +567,12 @@ class ConcurrentAttackCog(commands.Cog):
         hp: Option(int, hp_desc, required=False, default=None),
     ):
         navigator = ConcurrentAttackButtonView()
-        boss = mongo.BossInfo.Get(number=boss_num)
+        boss = await mongo.BossInfo.Get(number=boss_num)
         if boss is None:
             await ctx.respond(f"{boss_num}ボス情報が登録されていません。", ephemeral=True)
             return
         boss_hp = hp if hp is not None else boss.hp
-        await ctx.respond(f"{boss.number}:{boss.name} 残りHP(万):{boss_hp}\n------", view=navigator)
+        await ctx.respond(AttackBoard.create(boss.number, boss.name, boss_hp).render(), view=navigator)
 
     @ConcurrentAttackCommand.error
     @cmd_log.error("concurrent attack command error")
@@ -489,7 +588,7 @@ class ConcurrentAttackCog(commands.Cog):
         ctx: discord.ApplicationContext,
         level: Option(int, level_desc, choices=[0, 1, 2, 3]),
     ):
-        mongo.ConcurrentAttackNotify(guild_id=ctx.guild_id, channel_id=ctx.channel_id, level=level).Set()
+        await mongo.ConcurrentAttackNotify(guild_id=ctx.guild_id, channel_id=ctx.channel_id, level=level).Set()
         await ctx.respond(f"このチャンネルに同時凸の通知(level={level})を登録しました。", ephemeral=True)
 
     @NotifyConcurrentAttackRegisterCommand.error
@@ -502,9 +601,9 @@ class ConcurrentAttackCog(commands.Cog):
     )
     @cmd_log.info("call notify concurrent attack unregister command")
     async def NotifyConcurrentAttackUnregisterCommand(self, ctx: discord.ApplicationContext):
-        notify = mongo.ConcurrentAttackNotify.Get(guild_id=ctx.guild_id)
+        notify = await mongo.ConcurrentAttackNotify.Get(guild_id=ctx.guild_id)
         if notify is not None:
-            notify.Delete()
+            await notify.Delete()
             await ctx.respond(f"同時凸の通知(channel=<#{notify.channel_id}>)を登録解除しました。", ephemeral=True)
         else:
             await ctx.respond("このサーバーに同時凸の通知は登録されていません。", ephemeral=True)
@@ -525,7 +624,7 @@ class ConcurrentAttackCog(commands.Cog):
         template: Option(str, template_desc),
         img_url: Option(str, img_url_desc),
     ):
-        mongo.TemplateUnfreezeMessage(
+        await mongo.TemplateUnfreezeMessage(
             guild_id=ctx.guild_id, boss_number=boss_number, template=template, image_url=img_url
         ).Set()
         await ctx.respond(f"解凍メッセージ({boss_number}ボス)のテンプレートの設定をしました。", ephemeral=True)
@@ -544,9 +643,9 @@ class ConcurrentAttackCog(commands.Cog):
     async def RemoveUnfreezeTemplateCommand(
         self, ctx: discord.ApplicationContext, boss_number: Option(int, boss_num_desc, choices=[1, 2, 3, 4, 5])
     ):
-        temp_msg = mongo.TemplateUnfreezeMessage.Get(guild_id=ctx.guild_id, boss_number=boss_number)
+        temp_msg = await mongo.TemplateUnfreezeMessage.Get(guild_id=ctx.guild_id, boss_number=boss_number)
         if temp_msg is not None:
-            temp_msg.Delete()
+            await temp_msg.Delete()
             await ctx.respond(f"解凍メッセージ({boss_number}ボス)のテンプレートの設定を削除しました。", ephemeral=True)
         else:
             await ctx.respond(
@@ -571,7 +670,7 @@ class ConcurrentAttackCog(commands.Cog):
         template: Option(str, template_desc),
         img_url: Option(str, img_url_desc),
     ):
-        mongo.TemplateAttackStartMessage(
+        await mongo.TemplateAttackStartMessage(
             guild_id=ctx.guild_id, boss_number=boss_number, template=template, image_url=img_url
         ).Set()
         await ctx.respond(f"凸開始メッセージ({boss_number}ボス)のテンプレートの設定をしました。", ephemeral=True)
@@ -590,9 +689,9 @@ class ConcurrentAttackCog(commands.Cog):
     async def RemoveAttackStartTemplateCommand(
         self, ctx: discord.ApplicationContext, boss_number: Option(int, boss_num_desc, choices=[1, 2, 3, 4, 5])
     ):
-        temp_msg = mongo.TemplateUnfreezeMessage.Get(guild_id=ctx.guild_id, boss_number=boss_number)
+        temp_msg = await mongo.TemplateUnfreezeMessage.Get(guild_id=ctx.guild_id, boss_number=boss_number)
         if temp_msg is not None:
-            temp_msg.Delete()
+            await temp_msg.Delete()
             await ctx.respond(
                 f"凸開始メッセージ({boss_number}ボス)のテンプレートの設定を削除しました。", ephemeral=True
             )
@@ -606,66 +705,63 @@ class ConcurrentAttackCog(commands.Cog):
     async def RemoveAttackStartTemplateCommand_error(self, ctx: discord.ApplicationContext, error):
         return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
 
+    @slash_command(
+        guild_ids=[config.admin_guild_id],
+        name="get_board_cache_stats",
+        description="[admin]同時凸の状況キャッシュの参照",
+    )
+    @cmd_log.info("call get board cache stats command")
+    @commands.is_owner()
+    async def GetBoardCacheStatsCommand(self, ctx: discord.ApplicationContext):
+        stats = boards.stats()
+        edits = edit_coalescer.stats()
+        await ctx.respond(
+            f"件数:{stats['entries']}, 使用中:{stats['held']}, 削除数:{stats['evictions']}, "
+            f"サイズ:{stats['bytes'] // 1024}KB\n"
+            f"編集 要求:{edits['requested']}, 実行:{edits['edited']}, 待機中:{edits['pending']}",
+            ephemeral=True,
+        )
+
+    @GetBoardCacheStatsCommand.error
+    @cmd_log.error("get board cache stats command error")
+    async def GetBoardCacheStatsCommand_error(self, ctx: discord.ApplicationContext, error):
+        return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
+
+    @slash_command(
+        guild_ids=[config.admin_guild_id],
+        name="get_notify_stats",
+        description="[admin]同時凸の通知送信状況の参照",
+    )
+    @cmd_log.info("call get notify stats command")
+    @commands.is_owner()
+    async def GetNotifyStatsCommand(self, ctx: discord.ApplicationContext):
+        stats = notify_dispatcher.stats()
+        latency = stats["latency"]
+        buckets = " ".join(f"{k}:{v}" for k, v in latency["buckets"].items() if v > 0)
+        await ctx.respond(
+            f"待機中:{stats['depth']}, 送信:{stats['sent']}, 破棄:{stats['dropped']}, "
+            f"レート制限:{stats['rate_limited']}, 失敗:{latency['failures']}\n"
+            f"遅延 平均:{latency['avg_ms']}ms 最大:{latency['max_ms']}ms\n{buckets}",
+            ephemeral=True,
+        )
+
+    @GetNotifyStatsCommand.error
+    @cmd_log.error("get notify stats command error")
+    async def GetNotifyStatsCommand_error(self, ctx: discord.ApplicationContext, error):
+        return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
+
 
 def setup(bot: BotClass):
     logger.info("Load bot cog from %s", __name__)
     bot.add_cog(ConcurrentAttackCog(bot))
+    bot.close_callbacks.append(notify_dispatcher.close)
     bot.persistent_view_classes.add(ConcurrentAttackButtonView)
 
 
-def change_battle_in(atk_list: list[str], username: str) -> list[str]:
-    re_username = escape_regexp.sub(r"\\\1", username)
-    target_indexes = [i for i, atk in enumerate(atk_list) if re.search(rf"  {re_username} 目標\d+万 :.*", atk)]
-    for i in target_indexes:
-        already_battle_in = bool(re.match(r"本戦 ", atk_list[i]))
-        if already_battle_in:
-            atk_list[i] = atk_list[i].removeprefix("本戦 ")
-        else:
-            atk_list[i] = "本戦 " + atk_list[i]
-    return atk_list
-
-
-def replace_attacks(
-    atk_list: list[str], username: str, repl_atk: Optional[str], target_damage: Optional[int]
-) -> list[str]:
-    re_username = escape_regexp.sub(r"\\\1", username)
-    repl_atk_list = [atk for atk in atk_list if not re.search(rf"  {re_username} 目標\d+万 :.*", atk)]
-    if repl_atk is not None:
-        repl_atk_list.append(f"{repl_atk}  {username} 目標{target_damage}万 :")
-    return repl_atk_list
-
-
-def add_note(atk_list: list[str], username: str, note: str) -> list[str]:
-    re_username = escape_regexp.sub(r"\\\1", username)
-    target_indexes = [i for i, atk in enumerate(atk_list) if re.search(rf"  {re_username} 目標\d+万 :", atk)]
-    for i in target_indexes:
-        atk = re.match(rf".*  {re_username} 目標\d+万 :", atk_list[i]).group()
-        atk_list[i] = f"{atk} {note}"
-    sorted_atk_list = sort_by_damage(atk_list)
-    return sorted_atk_list
-
-
-def sort_by_damage(atk_list: list[str]) -> list[str]:
-    atks = [(atk, re.search(r"万 : .+$", atk)) for atk in atk_list]
-    atks_with_note = [
-        (atk, re.search(r"\d{3,}", note.group()), re.search(r"\+\d{2,}", note.group()))
-        for atk, note in atks
-        if note is not None
+def get_attack_members(board: AttackBoard, guild: discord.Guild) -> list[discord.Member]:
+    members = [
+        guild.get_member(e.user_id) if e.user_id is not None else member_index.find(guild, e.username)
+        for e in board.entries.values()
     ]
-    atks_with_dmg = [
-        (atk, int(dmg.group()) + int(add_dmg.group() if add_dmg is not None else "0"))
-        for atk, dmg, add_dmg in atks_with_note
-        if dmg is not None
-    ]
-    atks_with_dmg.sort(key=lambda a: a[1], reverse=True)
-    sorted_atks = [atk for atk, _ in atks_with_dmg]
-    atks_without_dmg = [atk for atk in atk_list if atk not in sorted_atks]
-    sorted_atks += atks_without_dmg
-    return sorted_atks
-
-
-def get_attack_members(atk_list: list[str], guild: discord.Guild) -> list[str]:
-    user_names = [re.findall(r"  (.+) 目標\d+万 :", atk)[0] for atk in atk_list if re.search(r"  .+ 目標\d+万 :", atk)]
-    members = [guild.get_member_named(u) for u in user_names]
     members = [m for m in members if m is not None]
     return members
@@ -8,6 +8,7 @@ from discord.ext import commands, tasks
 
 import app_config
 import mongo_data as mongo
+import mongo_monitor
 import scraping
 from log_decorator import CommandLogDecorator
 from mybot import BotClass
@@ -42,8 +43,7 @@ class DBCog(commands.Cog):
         name: Option(str, name_desc),
         hp: Option(int, hp_desc),
     ):
-        mongo.BossInfo(number=boss_num, name=name, hp=hp).Set()
-        boss = mongo.BossInfo.Get(number=boss_num)
+        boss = await mongo.BossInfo(number=boss_num, name=name, hp=hp).Set()
         if boss is None:
             await ctx.respond("ボス情報の登録に失敗しました。", ephemeral=True)
             return
@@ -66,7 +66,7 @@ class DBCog(commands.Cog):
     @cmd_log.info("call get bosses command")
     @commands.is_owner()
     async def GetBossesCommand(self, ctx: discord.ApplicationContext):
-        bosses = mongo.BossInfo.Gets()
+        bosses = await mongo.BossInfo.Gets()
         embed = discord.Embed(title="ボス情報一覧")
         for boss in bosses:
             embed.add_field(
@@ -94,11 +94,10 @@ class DBCog(commands.Cog):
         start_date: Option(str, start_date_desc),
         end_date: Option(str, end_date_desc),
     ):
-        mongo.ClanBattleSchedule(
+        schedule = await mongo.ClanBattleSchedule(
             start_date=date.fromisoformat(start_date),
             end_date=date.fromisoformat(end_date),
         ).Set()
-        schedule = mongo.ClanBattleSchedule.Get()
         if schedule is None:
             await ctx.respond("クランバトル開催期間の登録に失敗しました。", ephemeral=True)
             return
@@ -121,7 +120,7 @@ class DBCog(commands.Cog):
     @cmd_log.info("call get clan battle schedule command")
     @commands.is_owner()
     async def GetClanBattleScheduleCommand(self, ctx: discord.ApplicationContext):
-        schedule = mongo.ClanBattleSchedule.Get()
+        schedule = await mongo.ClanBattleSchedule.Get()
         embed = discord.Embed(title="クランバトル開催期間")
         if schedule is not None:
             embed.add_field(name="開始日", value=schedule.start_date)
@@ -149,8 +148,7 @@ class DBCog(commands.Cog):
         schedule_enabled: Option(bool),
         boss_info_enabled: Option(bool),
     ):
-        mongo.BotConfig(schedule_enabled, boss_info_enabled).Set()
-        bot_config = mongo.BotConfig.Get()
+        bot_config = await mongo.BotConfig(schedule_enabled, boss_info_enabled).Set()
         if bot_config is None:
             await ctx.respond("自動設定の登録に失敗しました。", ephemeral=True)
             return
@@ -165,10 +163,37 @@ class DBCog(commands.Cog):
     async def SetAutoSettingCommand_error(self, ctx: discord.ApplicationContext, error):
         return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
 
+    @slash_command(
+        guild_ids=[config.admin_guild_id],
+        name="get_mongo_stats",
+        description="[admin]DBコマンドのレイテンシ集計の参照",
+    )
+    @cmd_log.info("call get mongo stats command")
+    @commands.is_owner()
+    async def GetMongoStatsCommand(self, ctx: discord.ApplicationContext):
+        stats = mongo_monitor.command_monitor.stats()
+        embed = discord.Embed(title="DBコマンドのレイテンシ")
+        for name, s in list(stats.items())[:25]:
+            buckets = " ".join(f"{k}:{v}" for k, v in s["buckets"].items() if v > 0)
+            embed.add_field(
+                name=name,
+                value=f"回数:{s['count']} 失敗:{s['failures']} 平均:{s['avg_ms']}ms 最大:{s['max_ms']}ms\n{buckets}",
+                inline=False,
+            )
+        if not stats:
+            embed.set_footer(text="Not Found")
+
+        await ctx.respond(embed=embed, ephemeral=True)
+
+    @GetMongoStatsCommand.error
+    @cmd_log.error("get mongo stats command error")
+    async def GetMongoStatsCommand_error(self, ctx: discord.ApplicationContext, error):
+        return await ctx.respond(error, ephemeral=True)  # ephemeral makes "Only you can see this" message
+
     @tasks.loop(hours=6.0)
     async def scheduled_auto_setting(self):
         logger.info("run scheduled auto setting")
-        bot_config = mongo.BotConfig.Get()
+        bot_config = await mongo.BotConfig.Get()
         if bot_config is None:
             return
         guild = self.bot.get_guild(config.admin_guild_id)
@@ -184,10 +209,9 @@ class DBCog(commands.Cog):
         target_end_date = date(nowdate.year, nowdate.month, target_lastday)
 
         if bot_config.auto_set_clan_battle_schedule:
-            schedule = mongo.ClanBattleSchedule.Get()
+            schedule = await mongo.ClanBattleSchedule.Get()
             if schedule is None or schedule.start_date != target_start_date or schedule.end_date != target_end_date:
-                mongo.ClanBattleSchedule(target_start_date, target_end_date).Set()
-                schedule = mongo.ClanBattleSchedule.Get()
+                schedule = await mongo.ClanBattleSchedule(target_start_date, target_end_date).Set()
                 if schedule is None:
                     await channel.send("クランバトル開催期間の自動更新に失敗しました。")
                 else:
@@ -204,10 +228,9 @@ class DBCog(commands.Cog):
             if boss_map is not None:
                 for b in boss_map:
                     trim_hp = b.hp // 10000
-                    boss = mongo.BossInfo.Get(number=b.num)
+                    boss = await mongo.BossInfo.Get(number=b.num)
                     if boss is None or boss.name != b.name or boss.hp != trim_hp:
-                        mongo.BossInfo(number=b.num, name=b.name, hp=trim_hp).Set()
-                        boss = mongo.BossInfo.Get(number=b.num)
+                        boss = await mongo.BossInfo(number=b.num, name=b.name, hp=trim_hp).Set()
                         if boss is None:
                             await channel.send("ボス情報の自動更新に失敗しました。")
                         else:
@@ -8,6 +8,7 @@ import app_config
 import mongo_data as mongo
 from log_decorator import CommandLogDecorator
 from mybot import BotClass
+from role_sync import role_sync
 
 logger = getLogger(__name__)
 config = app_config.Config.get_instance()
@@ -76,7 +77,7 @@ class ManageCog(commands.Cog):
         role: Option(discord.Role, role_desc),
     ):
         role: discord.Role = role
-        mongo.ClanMemberRole(guild_id=ctx.guild_id, role_id=role.id).Set()
+        await mongo.ClanMemberRole(guild_id=ctx.guild_id, role_id=role.id).Set()
         return await ctx.respond(
             f"クランメンバーのロール(ID:{role.id}, Name:{role.name})を登録しました。", ephemeral=True
         )
@@ -96,7 +97,7 @@ class ManageCog(commands.Cog):
         self,
         ctx: discord.ApplicationContext,
     ):
-        clan_role = mongo.ClanMemberRole.Get(guild_id=ctx.guild_id)
+        clan_role = await mongo.ClanMemberRole.Get(guild_id=ctx.guild_id)
         if clan_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
@@ -118,11 +119,11 @@ class ManageCog(commands.Cog):
         self,
         ctx: discord.ApplicationContext,
     ):
-        clan_role = mongo.ClanMemberRole.Get(guild_id=ctx.guild_id)
+        clan_role = await mongo.ClanMemberRole.Get(guild_id=ctx.guild_id)
         if clan_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
-        clan_role.Delete()
+        await clan_role.Delete()
         return await ctx.respond(f"クランメンバーのロール(ID:{clan_role.role_id})を登録解除しました。", ephemeral=True)
 
     @RemoveClanMemberRoleCommand.error
@@ -138,7 +139,7 @@ class ManageCog(commands.Cog):
         role: Option(discord.Role, role_desc),
     ):
         role: discord.Role = role
-        mongo.YetCompleteRole(guild_id=ctx.guild_id, role_id=role.id).Set()
+        await mongo.YetCompleteRole(guild_id=ctx.guild_id, role_id=role.id).Set()
         return await ctx.respond(f"未完了凸のロール(ID:{role.id}, Name:{role.name})を登録しました。", ephemeral=True)
 
     @SetYetCompleteRoleCommand.error
@@ -156,7 +157,7 @@ class ManageCog(commands.Cog):
         self,
         ctx: discord.ApplicationContext,
     ):
-        clan_role = mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
+        clan_role = await mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
         if clan_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
@@ -178,11 +179,11 @@ class ManageCog(commands.Cog):
         self,
         ctx: discord.ApplicationContext,
     ):
-        clan_role = mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
+        clan_role = await mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
         if clan_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
-        clan_role.Delete()
+        await clan_role.Delete()
         return await ctx.respond(f"未完了凸のロール(ID:{clan_role.role_id})を登録解除しました。", ephemeral=True)
 
     @RemoveYetCompleteRoleCommand.error
@@ -200,7 +201,7 @@ class ManageCog(commands.Cog):
         self,
         ctx: discord.ApplicationContext,
     ):
-        clan_role = mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
+        clan_role = await mongo.YetCompleteRole.Get(guild_id=ctx.guild_id)
         if clan_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
@@ -210,11 +211,11 @@ class ManageCog(commands.Cog):
         if yc_role is None:
             return await ctx.respond("該当するロールが存在しません。", ephemeral=True)
 
-        cnt = len(yc_role.members)
-        for m in yc_role.members:
-            await m.remove_roles(yc_role)
+        result = await role_sync.sync(ctx.guild, yc_role, set())
         return await ctx.respond(
-            f"全ユーザ(対象:{cnt}名)の未完了凸のロール(ID:{clan_role.role_id})取り外し完了", ephemeral=True
+            f"全ユーザ(対象:{result.removed + result.failed}名)の未完了凸のロール(ID:{clan_role.role_id})取り外し完了"
+            + (f"(失敗:{result.failed}名)" if result.failed else ""),
+            ephemeral=True,
         )
 
     @DetachAllYetCompleteRoleCommand.error
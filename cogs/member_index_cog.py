@@ -0,0 +1,52 @@
+from logging import getLogger
+
+import discord
+from discord.ext import commands
+
+from member_index import member_index, role_index
+from mybot import BotClass
+
+logger = getLogger(__name__)
+
+
+class MemberIndexCog(commands.Cog):
+    # メンバーのイベントを表示名とロールの索引に反映する
+    def __init__(self, bot: BotClass):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        member_index.upsert(member)
+        role_index.upsert(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        member_index.upsert(after)
+        role_index.upsert(after)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        member_index.remove(payload.guild_id, payload.user.id)
+        role_index.remove(payload.guild_id, payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # グローバル表示名の変更はニックネーム未設定のギルド全てで表示名に影響する
+        for guild in self.bot.guilds:
+            member = guild.get_member(after.id)
+            if member is not None:
+                member_index.upsert(member)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        role_index.drop_role(role.guild.id, role.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        member_index.drop_guild(guild.id)
+        role_index.drop_guild(guild.id)
+
+
+def setup(bot: BotClass):
+    logger.info("Load bot cog from %s", __name__)
+    bot.add_cog(MemberIndexCog(bot))
@@ -57,7 +57,7 @@ class TLVideoCog(commands.Cog):
 
     async def search_tl_video(self, begin_time: datetime, end_time: datetime):
         logger.info("run scheduled tl search")
-        bosses = mongo.BossInfo.Gets()
+        bosses = await mongo.BossInfo.Gets()
         query = "({}) (段階目 | パーティ編成 | プリコネ | 敵UB)".format(
             " | ".join([f'intitle:"{b.name}"' for b in bosses])
         )
@@ -104,15 +104,16 @@ class TLVideoCog(commands.Cog):
             ]
 
             gotten_pub_after = end_time - timedelta(days=10.0)
-            gotten_videos = mongo.TLVideoGotten.Gets(published_after=gotten_pub_after, boss_number=boss.number)
-            gotten_vids = [g.video_id for g in gotten_videos]
+            gotten_videos = await mongo.TLVideoGotten.GetsRaw(
+                published_after=gotten_pub_after, boss_number=boss.number
+            )
+            gotten_vids = [video_id for video_id, _, _ in gotten_videos]
             gotten_vids = gotten_vids if gotten_vids is not None else []
             yet_gotten_videos = [
                 mongo.TLVideoGotten(v.vid, v.published_at, boss.number) for v in videos if v.vid not in gotten_vids
             ]
             yet_gotten_videos = yet_gotten_videos if yet_gotten_videos is not None else []
-            for yet_gv in yet_gotten_videos:
-                yet_gv.Set()
+            await mongo.TLVideoGotten.SetMany(yet_gotten_videos)
             target_vids = gotten_vids + [v.video_id for v in yet_gotten_videos]
             if not target_vids:
                 continue
@@ -156,7 +157,7 @@ class TLVideoCog(commands.Cog):
                     embeds,
                 )
 
-                subsc_msgs = mongo.ListTLSubscMessage.Gets(boss.number, is_carry_over)
+                subsc_msgs = await mongo.ListTLSubscMessage.Gets(boss.number, is_carry_over)
                 err_msgs: list[mongo.ListTLSubscMessage] = []
                 for msg in subsc_msgs:
                     await asyncio.sleep(1)
@@ -225,18 +226,18 @@ class TLVideoCog(commands.Cog):
                             },
                         },
                     )
-                    if em.Delete() is False:
-                        logger.error(
-                            "failed to remove subscribe message",
-                            extra={
-                                "json_fields": {
-                                    "boss_number": boss.number,
-                                    "guild_id": em.guild_id,
-                                    "channel_id": em.channel_id,
-                                    "message_id": em.message_id,
-                                },
+                deleted_count = await mongo.ListTLSubscMessage.DeleteMany(err_msgs)
+                if deleted_count < len(err_msgs):
+                    logger.error(
+                        "failed to remove subscribe message",
+                        extra={
+                            "json_fields": {
+                                "boss_number": boss.number,
+                                "target_count": len(err_msgs),
+                                "deleted_count": deleted_count,
                             },
-                        )
+                        },
+                    )
 
             target_videos_src.sort(key=lambda x: x.damage, reverse=True)
             yet_list = [(i, v) for i, v in enumerate(target_videos_src) if v.vid not in gotten_vids]
@@ -247,7 +248,7 @@ class TLVideoCog(commands.Cog):
                 ", ".join([f"**{str(i + 1)}**" if i <= 2 else str(i + 1) for i, _ in yet_list]),
             )
             notice_video_embeds = [create_video_embed(v, updated_at) for _, v in yet_list]
-            notify_list = mongo.TLVideoNotify.Gets()
+            notify_list = await mongo.TLVideoNotify.Gets()
             err_notify_list: list[mongo.TLVideoNotify] = []
             for notify in notify_list:
                 await asyncio.sleep(1)
@@ -310,7 +311,7 @@ class TLVideoCog(commands.Cog):
                         },
                     },
                 )
-                err_notify.Delete()
+            await mongo.TLVideoNotify.DeleteMany(err_notify_list)
 
     @slash_command(
         guild_ids=config.guild_ids,
@@ -340,7 +341,7 @@ class TLVideoCog(commands.Cog):
             )
             return
 
-        boss = mongo.BossInfo.Get(number=boss_num)
+        boss = await mongo.BossInfo.Get(number=boss_num)
         if boss is None:
             logger.warning(
                 "Misconfiguration of boss info resiger",
@@ -361,12 +362,12 @@ class TLVideoCog(commands.Cog):
             content += "\n次の定期更新までお待ちください。"
             interact: discord.Interaction = await ctx.respond(content)
             msg = await interact.original_response()
-            mongo.ListTLSubscMessage(msg.guild.id, msg.channel.id, msg.id, boss.number, is_carry_over).Set()
+            await mongo.ListTLSubscMessage(msg.guild.id, msg.channel.id, msg.id, boss.number, is_carry_over).Set()
         else:
             content, embeds = self.cached_embeds[f"{boss.number}_{int(is_carry_over)}"]
             interact: discord.Interaction = await ctx.respond(content, embeds=embeds)
             msg = await interact.original_response()
-            mongo.ListTLSubscMessage(msg.guild.id, msg.channel.id, msg.id, boss.number, is_carry_over).Set()
+            await mongo.ListTLSubscMessage(msg.guild.id, msg.channel.id, msg.id, boss.number, is_carry_over).Set()
 
     @ListTLVideosCommand.error
     @cmd_log.error("list tl videos command error")
@@ -405,16 +406,9 @@ class TLVideoCog(commands.Cog):
     )
     @cmd_log.info("call list tl videos notify register command")
     async def ListTLVideosNotifyRegisterCommand(self, ctx: discord.ApplicationContext):
-        notify_list = mongo.TLVideoNotify.Gets()
-        notify = next(
-            filter(
-                lambda x: x.guild_id == ctx.guild.id and x.channel_id == ctx.channel.id,
-                notify_list,
-            ),
-            None,
-        )
-        if notify is None:
-            mongo.TLVideoNotify(guild_id=ctx.guild_id, channel_id=ctx.channel_id).Set()
+        is_registered = await mongo.TLVideoNotify.Exists(guild_id=ctx.guild.id, channel_id=ctx.channel.id)
+        if not is_registered:
+            await mongo.TLVideoNotify(guild_id=ctx.guild_id, channel_id=ctx.channel_id).Set()
             return await ctx.respond("通知登録しました。")
         else:
             return await ctx.respond("既に登録されています。", ephemeral=True)
@@ -431,16 +425,9 @@ class TLVideoCog(commands.Cog):
     )
     @cmd_log.info("call list tl videos notify unregister command")
     async def ListTLVideosNotifyUnregisterCommand(self, ctx: discord.ApplicationContext):
-        notify_list = mongo.TLVideoNotify.Gets()
-        notyfy = next(
-            filter(
-                lambda x: x.guild_id == ctx.guild.id and x.channel_id == ctx.channel.id,
-                notify_list,
-            ),
-            None,
-        )
-        if notyfy is not None:
-            notyfy.Delete()
+        is_registered = await mongo.TLVideoNotify.Exists(guild_id=ctx.guild.id, channel_id=ctx.channel.id)
+        if is_registered:
+            await mongo.TLVideoNotify(guild_id=ctx.guild.id, channel_id=ctx.channel.id).Delete()
             return await ctx.respond("通知登録を解除しました。")
         else:
             return await ctx.respond("登録されていません。", ephemeral=True)
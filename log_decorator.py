@@ -3,6 +3,8 @@ from logging import Logger
 
 from discord import ApplicationContext, Interaction
 
+import mongo_monitor
+
 
 class CommandLogDecorator:
     def __init__(self, logger: Logger) -> None:
@@ -23,8 +25,10 @@ class CommandLogDecorator:
 
                 else:
                     self.logger.error(f"wrong number of arguments with {message}")
+                    extra = {}
 
-                return await func(*args, **kwargs)
+                with mongo_monitor.track_interaction(message, extra):
+                    return await func(*args, **kwargs)
 
             return wrapper
 
@@ -75,8 +79,10 @@ class ButtonLogDecorator:
 
                 else:
                     self.logger.error(f"wrong number of arguments with {message}")
+                    extra = {}
 
-                return await func(*args, **kwargs)
+                with mongo_monitor.track_interaction(message, extra):
+                    return await func(*args, **kwargs)
 
             return wrapper
 
@@ -103,8 +109,10 @@ class CallbackLogDecorator:
 
                 else:
                     self.logger.error(f"wrong number of arguments with {message}")
+                    extra = {}
 
-                return await func(*args, **kwargs)
+                with mongo_monitor.track_interaction(message, extra):
+                    return await func(*args, **kwargs)
 
             return wrapper
 
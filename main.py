@@ -4,6 +4,7 @@ import sentry_sdk
 from sentry_sdk.integrations.logging import LoggingIntegration
 
 import app_config
+import mongo_data
 from keep_alive import keep_alive
 from mongo_helper import MongoConn
 from mybot import BotClass
@@ -47,6 +48,7 @@ logger.info("bot start")
 
 def start():
     MongoConn.get_db()
+    mongo_data.create_indexes()
 
     try:
         bot = BotClass()
@@ -59,6 +61,7 @@ def start():
         bot.load_extension("cogs.attack_report_cog")
         bot.load_extension("cogs.carry_over_cog")
         bot.load_extension("cogs.tl_video_cog")
+        bot.load_extension("cogs.member_index_cog")
         bot.run(config.bot_token)
 
     finally:
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from logging import getLogger
+from typing import Optional
+
+import discord
+
+import app_config
+from mongo_monitor import create_background_task
+
+logger = getLogger(__name__)
+config = app_config.Config.get_instance()
+
+
+class MemberIndex:
+    # ギルド毎の表示名からメンバーIDへの索引。メンバーの参加・退出・更新イベントで更新する
+    # メンバーの取得(chunk)が完了したギルドのみ、初回参照時に作成する
+    def __init__(self) -> None:
+        self.__guilds: dict[int, dict[str, dict[int, None]]] = {}
+        self.__names: dict[tuple[int, int], str] = {}
+
+    def __build(self, guild: discord.Guild) -> dict[str, dict[int, None]]:
+        self.drop_guild(guild.id)
+        index: dict[str, dict[int, None]] = {}
+        self.__guilds[guild.id] = index
+        for member in guild.members:
+            self.__add(index, guild.id, member.id, member.display_name)
+        return index
+
+    def __add(self, index: dict[str, dict[int, None]], guild_id: int, user_id: int, name: str) -> None:
+        index.setdefault(name, {})[user_id] = None
+        self.__names[(guild_id, user_id)] = name
+
+    def __remove(self, index: dict[str, dict[int, None]], guild_id: int, user_id: int) -> None:
+        name = self.__names.pop((guild_id, user_id), None)
+        if name is None:
+            return
+        ids = index.get(name)
+        if ids is not None:
+            ids.pop(user_id, None)
+            if not ids:
+                del index[name]
+
+    def find(self, guild: discord.Guild, name: str) -> Optional[discord.Member]:
+        index = self.__guilds.get(guild.id)
+        if index is None:
+            if not guild.chunked:
+                return guild.get_member_named(name)
+            index = self.__build(guild)
+        # 同じ表示名のメンバーが複数いる場合は先に登録されたメンバーを返す
+        for user_id in index.get(name, ()):
+            member = guild.get_member(user_id)
+            if member is not None:
+                return member
+        return None
+
+    def upsert(self, member: discord.Member) -> None:
+        index = self.__guilds.get(member.guild.id)
+        if index is None:
+            return
+        if self.__names.get((member.guild.id, member.id)) == member.display_name:
+            return
+        self.__remove(index, member.guild.id, member.id)
+        self.__add(index, member.guild.id, member.id, member.display_name)
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        index = self.__guilds.get(guild_id)
+        if index is not None:
+            self.__remove(index, guild_id, user_id)
+
+    def drop_guild(self, guild_id: int) -> None:
+        index = self.__guilds.pop(guild_id, None)
+        if index is None:
+            return
+        for ids in index.values():
+            for user_id in ids:
+                self.__names.pop((guild_id, user_id), None)
+
+
+class RoleIndex:
+    # ギルド毎のロールからメンバーIDへの索引。メンバーの参加・退出・更新イベントで更新する
+    # メンバーの取得(chunk)が完了していないギルドは、ゲートウェイ経由の再取得を間隔と同時実行数を制限して行う
+    def __init__(self, refresh_interval: float, refresh_timeout: float) -> None:
+        self.refresh_interval = refresh_interval
+        self.refresh_timeout = refresh_timeout
+        self.refreshes = 0
+        self.__guilds: dict[int, dict[int, set[int]]] = {}
+        self.__roles: dict[tuple[int, int], frozenset[int]] = {}
+        self.__refreshed: dict[int, float] = {}
+        self.__refreshing: dict[int, asyncio.Task] = {}
+
+    def __build(self, guild: discord.Guild) -> dict[int, set[int]]:
+        self.drop_guild(guild.id)
+        index: dict[int, set[int]] = {}
+        self.__guilds[guild.id] = index
+        for member in guild.members:
+            self.__set(index, guild.id, member.id, frozenset(r.id for r in member.roles))
+        return index
+
+    def __set(self, index: dict[int, set[int]], guild_id: int, user_id: int, role_ids: frozenset[int]) -> None:
+        old = self.__roles.pop((guild_id, user_id), frozenset())
+        for role_id in old - role_ids:
+            ids = index.get(role_id)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del index[role_id]
+        for role_id in role_ids - old:
+            index.setdefault(role_id, set()).add(user_id)
+        if role_ids:
+            self.__roles[(guild_id, user_id)] = role_ids
+
+    def refresh_due(self, guild: discord.Guild) -> bool:
+        # 再取得中か、前回の再取得からrefresh_interval秒以上経過している
+        last = self.__refreshed.get(guild.id)
+        return guild.id in self.__refreshing or last is None or time.monotonic() - last >= self.refresh_interval
+
+    async def refresh(self, guild: discord.Guild) -> None:
+        # 同じギルドの再取得は同時に1回、refresh_interval秒に1回までとし、最大refresh_timeout秒だけ待つ
+        task = self.__refreshing.get(guild.id)
+        if task is None:
+            now = time.monotonic()
+            last = self.__refreshed.get(guild.id)
+            if last is not None and now - last < self.refresh_interval:
+                return
+            self.__refreshed[guild.id] = now
+            self.refreshes += 1
+            task = self.__refreshing[guild.id] = create_background_task(guild.chunk())
+            task.add_done_callback(lambda _: self.__refreshing.pop(guild.id, None))
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.refresh_timeout)
+        except Exception:
+            logger.warning(
+                "failed to refresh guild members", exc_info=True, extra={"json_fields": {"guild_id": guild.id}}
+            )
+
+    async def members(self, guild: discord.Guild, role_id: int) -> set[int]:
+        index = self.__guilds.get(guild.id)
+        if index is None:
+            if not guild.chunked:
+                await self.refresh(guild)
+            if not guild.chunked:
+                # 取得が完了しなかった場合はキャッシュ済みのメンバーのみで判定する
+                return {m.id for m in guild.members if m.get_role(role_id) is not None}
+            index = self.__build(guild)
+        return set(index.get(role_id, ()))
+
+    def upsert(self, member: discord.Member) -> None:
+        index = self.__guilds.get(member.guild.id)
+        if index is not None:
+            self.__set(index, member.guild.id, member.id, frozenset(r.id for r in member.roles))
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        index = self.__guilds.get(guild_id)
+        if index is not None:
+            self.__set(index, guild_id, user_id, frozenset())
+
+    def apply(self, guild_id: int, user_id: int, role_id: int, has_role: bool) -> None:
+        # ロールを付け外しした直後に、ゲートウェイのイベントを待たずに反映する
+        index = self.__guilds.get(guild_id)
+        if index is None:
+            return
+        role_ids = self.__roles.get((guild_id, user_id), frozenset())
+        self.__set(index, guild_id, user_id, role_ids | {role_id} if has_role else role_ids - {role_id})
+
+    def drop_role(self, guild_id: int, role_id: int) -> None:
+        index = self.__guilds.get(guild_id)
+        if index is None:
+            return
+        for user_id in index.pop(role_id, ()):
+            key = (guild_id, user_id)
+            role_ids = self.__roles[key] - {role_id}
+            if role_ids:
+                self.__roles[key] = role_ids
+            else:
+                del self.__roles[key]
+
+    def drop_guild(self, guild_id: int) -> None:
+        index = self.__guilds.pop(guild_id, None)
+        if index is None:
+            return
+        for user_ids in index.values():
+            for user_id in user_ids:
+                self.__roles.pop((guild_id, user_id), None)
+
+
+member_index = MemberIndex()
+role_index = RoleIndex(
+    refresh_interval=config.role_index_refresh_interval, refresh_timeout=config.role_index_refresh_timeout
+)
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from datetime import date, datetime
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from logging import getLogger
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional, TypeVar
 
 import app_config
 import mongo_helper as helper
@@ -10,68 +13,171 @@ import mongo_helper as helper
 logger = getLogger(__name__)
 config = app_config.Config.get_instance()
 
+R = TypeVar("R", bound="Record")
+
+
+class SettingsCache:
+    # ギルド毎の設定値のキャッシュ。Set/Deleteで無効化し、他プロセスからの更新はTTLで反映する
+    # 件数が上限を超えた場合、期限切れのものと最後に参照されてから最も古いものから削除する
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        # 読み込み中のキーの数と、読み込み中にinvalidateされた回数
+        self.__loading: dict[tuple, int] = {}
+        self.__generations: dict[tuple, int] = {}
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self.__entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        generation = self.__generations.get(key, 0)
+        self.__loading[key] = self.__loading.get(key, 0) + 1
+        try:
+            value = await loader()
+            # 読み込み中にinvalidateされた場合は古い値をキャッシュしない
+            if self.__generations.get(key, 0) == generation:
+                self.__entries[key] = (time.monotonic() + self.ttl, value)
+                self.__entries.move_to_end(key)
+                self.__evict()
+        finally:
+            self.__loading[key] -= 1
+            if self.__loading[key] == 0:
+                del self.__loading[key]
+                self.__generations.pop(key, None)
+        return value
+
+    def __evict(self) -> None:
+        now = time.monotonic()
+        while self.__entries:
+            key, (expires, _) = next(iter(self.__entries.items()))
+            if len(self.__entries) <= self.max_entries and expires > now:
+                break
+            del self.__entries[key]
+            self.evictions += 1
+
+    def invalidate(self, key: tuple) -> None:
+        self.__entries.pop(key, None)
+        if key in self.__loading:
+            self.__generations[key] = self.__generations.get(key, 0) + 1
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self.__entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+settings_cache = SettingsCache(ttl=config.settings_cache_ttl, max_entries=config.settings_cache_max_entries)
+
+
+class Record:
+    # __slots__で値を保持するイミュータブルなレコード。値の変更はreplaceで新しいインスタンスを作る
+    __slots__ = ()
+
+    def __init__(self, *values: Any) -> None:
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other: object) -> bool:
+        if type(self) is not type(other):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self) -> int:
+        return hash(self.astuple())
 
-class BossInfo:
+    @classmethod
+    def from_doc(cls: type[R], doc: dict) -> R:
+        # _idなどのフィールド以外のキーは無視する
+        return cls(*[doc[name] for name in cls.__slots__])
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def replace(self: R, **changes: Any) -> R:
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return type(self)(**values)
+
+
+class BossInfo(Record):
+    __slots__ = ("number", "name", "hp")
     __clt_name = "boss_info"
+    __indexes = [[("number", 1)]]
 
-    def __init__(self, number: int, name: str, hp: int, _id: Optional[str] = None) -> None:
-        self.number = number
-        self.name = name
-        self.hp = hp
+    def __init__(self, number: int, name: str, hp: int) -> None:
+        super().__init__(number, name, hp)
 
     @classmethod
-    def Get(cls, number: int) -> Optional[BossInfo]:
-        doc = helper.get_one(
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, number: int) -> Optional[BossInfo]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"number": number},
         )
         if doc is None:
             return None
-        return BossInfo(**doc)
+        return cls.from_doc(doc)
 
     @classmethod
-    def Gets(cls) -> list[BossInfo]:
-        docs = helper.get_many(cls.__clt_name)
-        return [BossInfo(**doc) for doc in docs]
+    async def Gets(cls) -> list[BossInfo]:
+        docs = await helper.get_many(cls.__clt_name)
+        return [cls.from_doc(doc) for doc in docs]
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[BossInfo]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"number": self.number},
             update={
                 "$set": {"name": self.name, "hp": self.hp},
             },
         )
+        return None if doc is None else self.from_doc(doc)
 
 
-class ListTLSubscMessage:
+class ListTLSubscMessage(Record):
+    __slots__ = ("guild_id", "channel_id", "message_id", "boss_number", "is_carry_over")
     __clt_name = "list_tl_subscribe"
+    __indexes = [
+        [("boss_number", 1), ("is_carry_over", 1)],
+        [("guild_id", 1), ("boss_number", 1), ("is_carry_over", 1)],
+    ]
 
-    def __init__(
-        self,
-        guild_id: int,
-        channel_id: int,
-        message_id: int,
-        boss_number: int,
-        is_carry_over: bool,
-        _id: Optional[str] = None,
-    ) -> None:
-        self.guild_id = guild_id
-        self.channel_id = channel_id
-        self.message_id = message_id
-        self.boss_number = boss_number
-        self.is_carry_over = is_carry_over
-
-    @classmethod
-    def Gets(cls, boss_number: int, is_carry_over: bool) -> list[ListTLSubscMessage]:
-        docs = helper.get_many(
+    def __init__(self, guild_id: int, channel_id: int, message_id: int, boss_number: int, is_carry_over: bool) -> None:
+        super().__init__(guild_id, channel_id, message_id, boss_number, is_carry_over)
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Gets(cls, boss_number: int, is_carry_over: bool) -> list[ListTLSubscMessage]:
+        docs = await helper.get_many(
             cls.__clt_name,
             filter={"$and": [{"boss_number": boss_number}, {"is_carry_over": is_carry_over}]},
         )
-        return [ListTLSubscMessage(**doc) for doc in docs]
+        return [cls.from_doc(doc) for doc in docs]
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[ListTLSubscMessage]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={
                 "$and": [
@@ -82,9 +188,10 @@ class ListTLSubscMessage:
             },
             update={"$set": {"channel_id": self.channel_id, "message_id": self.message_id}},
         )
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={
                 "$and": [
@@ -96,341 +203,582 @@ class ListTLSubscMessage:
         )
         return is_deleted
 
+    @classmethod
+    async def DeleteMany(cls, msgs: list[ListTLSubscMessage]) -> int:
+        deleted_count = await helper.bulk_delete(
+            cls.__clt_name,
+            filters=[
+                {"$and": [{"guild_id": m.guild_id}, {"channel_id": m.channel_id}, {"message_id": m.message_id}]}
+                for m in msgs
+            ],
+            ordered=False,
+        )
+        return deleted_count
+
 
-class AttackReportRegister:
+class AttackReportRegister(Record):
+    __slots__ = ("guild_id", "channel_id", "last_published")
     __clt_name = "attack_report_register"
+    __indexes = [[("guild_id", 1), ("channel_id", 1)]]
 
-    def __init__(
-        self, guild_id: int, channel_id: int, last_published: date | datetime, _id: Optional[str] = None
-    ) -> None:
-        self.guild_id = guild_id
-        self.channel_id = channel_id
-        self.last_published = date(last_published.year, last_published.month, last_published.day)
+    def __init__(self, guild_id: int, channel_id: int, last_published: date | datetime) -> None:
+        super().__init__(guild_id, channel_id, date(last_published.year, last_published.month, last_published.day))
 
     @classmethod
-    def Gets(cls) -> list[AttackReportRegister]:
-        docs = helper.get_many(cls.__clt_name)
-        return [AttackReportRegister(**doc) for doc in docs]
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Gets(cls) -> list[AttackReportRegister]:
+        docs = await helper.get_many(cls.__clt_name)
+        return [cls.from_doc(doc) for doc in docs]
+
+    @classmethod
+    async def Exists(cls, guild_id: int, channel_id: int) -> bool:
+        return await helper.exists(
+            cls.__clt_name,
+            filter={"$and": [{"guild_id": guild_id}, {"channel_id": channel_id}]},
+        )
 
-    def Set(self) -> None:
+    async def Set(self) -> Optional[AttackReportRegister]:
         last_pub_dt = datetime(self.last_published.year, self.last_published.month, self.last_published.day)
-        helper.upsert_one(
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"channel_id": self.channel_id}]},
             update={"$set": {"last_published": last_pub_dt}},
         )
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"channel_id": self.channel_id}]},
         )
         return is_deleted
 
+    @classmethod
+    async def SetMany(cls, regs: list[AttackReportRegister]) -> int:
+        requests = [
+            (
+                {"$and": [{"guild_id": r.guild_id}, {"channel_id": r.channel_id}]},
+                {
+                    "$set": {
+                        "last_published": datetime(r.last_published.year, r.last_published.month, r.last_published.day)
+                    }
+                },
+            )
+            for r in regs
+        ]
+        return await helper.bulk_upsert(cls.__clt_name, requests=requests, ordered=False)
 
-class ClanBattleSchedule:
+    @classmethod
+    async def DeleteMany(cls, regs: list[AttackReportRegister]) -> int:
+        deleted_count = await helper.bulk_delete(
+            cls.__clt_name,
+            filters=[{"$and": [{"guild_id": r.guild_id}, {"channel_id": r.channel_id}]} for r in regs],
+            ordered=False,
+        )
+        return deleted_count
+
+
+class ClanBattleSchedule(Record):
+    __slots__ = ("start_date", "end_date")
     __clt_name = "clan_battle_schedule"
+    __indexes = [[("id", 1)]]
 
-    def __init__(
-        self,
-        start_date: date | datetime,
-        end_date: date | datetime,
-        id: Optional[int] = None,
-        _id: Optional[str] = None,
-    ) -> None:
-        self.start_date = date(start_date.year, start_date.month, start_date.day)
-        self.end_date = date(end_date.year, end_date.month, end_date.day)
+    def __init__(self, start_date: date | datetime, end_date: date | datetime) -> None:
+        super().__init__(
+            date(start_date.year, start_date.month, start_date.day), date(end_date.year, end_date.month, end_date.day)
+        )
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
 
     @classmethod
-    def Get(cls) -> Optional[ClanBattleSchedule]:
-        doc = helper.get_one(
+    async def Get(cls) -> Optional[ClanBattleSchedule]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"id": 1},
         )
         if doc is None:
             return None
-        return ClanBattleSchedule(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
+    async def Set(self) -> Optional[ClanBattleSchedule]:
         start_datetime = datetime(self.start_date.year, self.start_date.month, self.start_date.day)
         end_datetime = datetime(self.end_date.year, self.end_date.month, self.end_date.day)
-        helper.upsert_one(
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"id": 1},
             update={"$set": {"start_date": start_datetime, "end_date": end_datetime}},
         )
+        return None if doc is None else self.from_doc(doc)
 
 
-class TLVideoNotify:
+class TLVideoNotify(Record):
+    __slots__ = ("guild_id", "channel_id")
     __clt_name = "tl_video_notify"
+    __indexes = [[("guild_id", 1), ("channel_id", 1)]]
+
+    def __init__(self, guild_id: int, channel_id: str) -> None:
+        super().__init__(guild_id, channel_id)
 
-    def __init__(self, guild_id: int, channel_id: str, _id: Optional[str] = None) -> None:
-        self.guild_id = guild_id
-        self.channel_id = channel_id
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
 
     @classmethod
-    def Gets(cls) -> list[TLVideoNotify]:
-        docs = helper.get_many(cls.__clt_name)
-        return [TLVideoNotify(**doc) for doc in docs]
+    async def Gets(cls) -> list[TLVideoNotify]:
+        docs = await helper.get_many(cls.__clt_name)
+        return [cls.from_doc(doc) for doc in docs]
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    @classmethod
+    async def Exists(cls, guild_id: int, channel_id: int) -> bool:
+        return await helper.exists(
+            cls.__clt_name,
+            filter={"$and": [{"guild_id": guild_id}, {"channel_id": channel_id}]},
+        )
+
+    async def Set(self) -> Optional[TLVideoNotify]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
             update={"$set": {"channel_id": self.channel_id}},
         )
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
         )
         return is_deleted
 
+    @classmethod
+    async def DeleteMany(cls, notifies: list[TLVideoNotify]) -> int:
+        deleted_count = await helper.bulk_delete(
+            cls.__clt_name,
+            filters=[{"guild_id": n.guild_id} for n in notifies],
+            ordered=False,
+        )
+        return deleted_count
+
 
-class TLVideoGotten:
+class TLVideoGotten(Record):
+    __slots__ = ("video_id", "published_at", "boss_number")
     __clt_name = "tl_video_gotten"
+    __indexes = [[("video_id", 1)], [("boss_number", 1), ("published_at", 1)]]
 
-    def __init__(self, video_id: str, published_at: datetime, boss_number: int, _id: Optional[str] = None) -> None:
-        self.video_id = video_id
-        self.published_at = published_at
-        self.boss_number = boss_number
+    def __init__(self, video_id: str, published_at: datetime, boss_number: int) -> None:
+        super().__init__(video_id, published_at, boss_number)
 
     @classmethod
-    def Gets(cls, published_after: datetime, boss_number: int) -> list[TLVideoGotten]:
-        docs = helper.get_many(
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Gets(cls, published_after: datetime, boss_number: int) -> list[TLVideoGotten]:
+        docs = await helper.get_many(
             cls.__clt_name,
             filter={"$and": [{"published_at": {"$gt": published_after}}, {"boss_number": boss_number}]},
         )
-        return [TLVideoGotten(**doc) for doc in docs]
+        return [cls.from_doc(doc) for doc in docs]
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    @classmethod
+    async def GetsRaw(cls, published_after: datetime, boss_number: int) -> list[tuple[str, datetime, int]]:
+        # 大量に走査する場合用。オブジェクトを作らず(video_id, published_at, boss_number)のタプルで返す
+        docs = await helper.get_many(
+            cls.__clt_name,
+            filter={"$and": [{"published_at": {"$gt": published_after}}, {"boss_number": boss_number}]},
+            projection={"_id": 0, "video_id": 1, "published_at": 1, "boss_number": 1},
+        )
+        return [(doc["video_id"], doc["published_at"], doc["boss_number"]) for doc in docs]
+
+    async def Set(self) -> Optional[TLVideoGotten]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"video_id": self.video_id},
             update={"$set": {"published_at": self.published_at, "boss_number": self.boss_number}},
         )
+        return None if doc is None else self.from_doc(doc)
 
+    @classmethod
+    async def SetMany(cls, videos: list[TLVideoGotten]) -> int:
+        requests = [
+            ({"video_id": v.video_id}, {"$set": {"published_at": v.published_at, "boss_number": v.boss_number}})
+            for v in videos
+        ]
+        return await helper.bulk_upsert(cls.__clt_name, requests=requests, ordered=False)
 
-class ClanMemberRole:
+
+class ClanMemberRole(Record):
+    __slots__ = ("guild_id", "role_id")
     __clt_name = "clan_member_role"
+    __indexes = [[("guild_id", 1)]]
+
+    def __init__(self, guild_id: int, role_id: int) -> None:
+        super().__init__(guild_id, role_id)
 
-    def __init__(self, guild_id: int, role_id: int, _id: Optional[str] = None) -> None:
-        self.guild_id = guild_id
-        self.role_id = role_id
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int) -> Optional[ClanMemberRole]:
+        return await settings_cache.get_or_load((cls.__clt_name, guild_id), lambda: cls.__Fetch(guild_id))
 
     @classmethod
-    def Get(cls, guild_id: int) -> Optional[ClanMemberRole]:
-        doc = helper.get_one(
+    async def __Fetch(cls, guild_id: int) -> Optional[ClanMemberRole]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"guild_id": guild_id},
         )
         if doc is None:
             return None
-        return ClanMemberRole(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[ClanMemberRole]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
             update={"$set": {"role_id": self.role_id}},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
         return is_deleted
 
 
-class YetCompleteRole:
+class YetCompleteRole(Record):
+    __slots__ = ("guild_id", "role_id")
     __clt_name = "yet_complete_role"
+    __indexes = [[("guild_id", 1)]]
 
-    def __init__(self, guild_id: int, role_id: int, _id: Optional[str] = None) -> None:
-        self.guild_id = guild_id
-        self.role_id = role_id
+    def __init__(self, guild_id: int, role_id: int) -> None:
+        super().__init__(guild_id, role_id)
 
     @classmethod
-    def Get(cls, guild_id: int) -> Optional[YetCompleteRole]:
-        doc = helper.get_one(
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int) -> Optional[YetCompleteRole]:
+        return await settings_cache.get_or_load((cls.__clt_name, guild_id), lambda: cls.__Fetch(guild_id))
+
+    @classmethod
+    async def __Fetch(cls, guild_id: int) -> Optional[YetCompleteRole]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"guild_id": guild_id},
         )
         if doc is None:
             return None
-        return YetCompleteRole(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[YetCompleteRole]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
             update={"$set": {"role_id": self.role_id}},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
         return is_deleted
 
 
-class ConcurrentAttackNotify:
+class ConcurrentAttackNotify(Record):
+    __slots__ = ("guild_id", "channel_id", "level")
     __clt_name = "concurrent_attack_notify"
+    __indexes = [[("guild_id", 1)]]
+
+    def __init__(self, guild_id: int, channel_id: int, level: int) -> None:
+        super().__init__(guild_id, channel_id, level)
 
-    def __init__(self, guild_id: int, channel_id: int, level: int, _id: Optional[str] = None) -> None:
-        self.guild_id = guild_id
-        self.channel_id = channel_id
-        self.level = level
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int) -> Optional[ConcurrentAttackNotify]:
+        return await settings_cache.get_or_load((cls.__clt_name, guild_id), lambda: cls.__Fetch(guild_id))
 
     @classmethod
-    def Get(cls, guild_id: int) -> Optional[ConcurrentAttackNotify]:
-        doc = helper.get_one(
+    async def __Fetch(cls, guild_id: int) -> Optional[ConcurrentAttackNotify]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"guild_id": guild_id},
         )
         if doc is None:
             return None
-        return ConcurrentAttackNotify(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[ConcurrentAttackNotify]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
             update={"$set": {"channel_id": self.channel_id, "level": self.level}},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"guild_id": self.guild_id},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id))
         return is_deleted
 
 
-class TemplateUnfreezeMessage:
+class TemplateUnfreezeMessage(Record):
+    __slots__ = ("guild_id", "boss_number", "template", "image_url")
     __clt_name = "template_unfreeze_message"
+    __indexes = [[("guild_id", 1), ("boss_number", 1)]]
 
-    def __init__(
-        self, guild_id: int, boss_number: int, template: str, image_url: str, _id: Optional[str] = None
-    ) -> None:
-        self.guild_id = guild_id
-        self.boss_number = boss_number
-        self.template = template
-        self.image_url = image_url
+    def __init__(self, guild_id: int, boss_number: int, template: str, image_url: str) -> None:
+        super().__init__(guild_id, boss_number, template, image_url)
 
     @classmethod
-    def Get(cls, guild_id: int, boss_number: int) -> Optional[TemplateUnfreezeMessage]:
-        doc = helper.get_one(
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int, boss_number: int) -> Optional[TemplateUnfreezeMessage]:
+        return await settings_cache.get_or_load(
+            (cls.__clt_name, guild_id, boss_number), lambda: cls.__Fetch(guild_id, boss_number)
+        )
+
+    @classmethod
+    async def __Fetch(cls, guild_id: int, boss_number: int) -> Optional[TemplateUnfreezeMessage]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"$and": [{"guild_id": guild_id}, {"boss_number": boss_number}]},
         )
         if doc is None:
             return None
-        return TemplateUnfreezeMessage(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[TemplateUnfreezeMessage]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"boss_number": self.boss_number}]},
             update={"$set": {"template": self.template, "image_url": self.image_url}},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id, self.boss_number))
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"boss_number": self.boss_number}]},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id, self.boss_number))
         return is_deleted
 
 
-class TemplateAttackStartMessage:
+class TemplateAttackStartMessage(Record):
+    __slots__ = ("guild_id", "boss_number", "template", "image_url")
     __clt_name = "template_attack_start_message"
+    __indexes = [[("guild_id", 1), ("boss_number", 1)]]
 
-    def __init__(
-        self, guild_id: int, boss_number: int, template: str, image_url: str, _id: Optional[str] = None
-    ) -> None:
-        self.guild_id = guild_id
-        self.boss_number = boss_number
-        self.template = template
-        self.image_url = image_url
+    def __init__(self, guild_id: int, boss_number: int, template: str, image_url: str) -> None:
+        super().__init__(guild_id, boss_number, template, image_url)
 
     @classmethod
-    def Get(cls, guild_id: int, boss_number: int) -> Optional[TemplateAttackStartMessage]:
-        doc = helper.get_one(
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int, boss_number: int) -> Optional[TemplateAttackStartMessage]:
+        return await settings_cache.get_or_load(
+            (cls.__clt_name, guild_id, boss_number), lambda: cls.__Fetch(guild_id, boss_number)
+        )
+
+    @classmethod
+    async def __Fetch(cls, guild_id: int, boss_number: int) -> Optional[TemplateAttackStartMessage]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"$and": [{"guild_id": guild_id}, {"boss_number": boss_number}]},
         )
         if doc is None:
             return None
-        return TemplateAttackStartMessage(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[TemplateAttackStartMessage]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"boss_number": self.boss_number}]},
             update={"$set": {"template": self.template, "image_url": self.image_url}},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id, self.boss_number))
+        return None if doc is None else self.from_doc(doc)
 
-    def Delete(self) -> bool:
-        is_deleted = helper.delete_one(
+    async def Delete(self) -> bool:
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={"$and": [{"guild_id": self.guild_id}, {"boss_number": self.boss_number}]},
         )
+        settings_cache.invalidate((self.__clt_name, self.guild_id, self.boss_number))
         return is_deleted
 
 
-class AttackReport:
+class ReportChange:
+    # 凸状況の変更内容。oldがNoneの場合はnewで置き換え、それ以外は最初のoldをnewに置換する
+    def __init__(self, old: Optional[str], new: str) -> None:
+        self.old = old
+        self.new = new
+
+    def apply(self, report: str) -> str:
+        if self.old is None:
+            return self.new
+        return report.replace(self.old, self.new, 1)
+
+    def expr(self, report_expr: str) -> Any:
+        if self.old is None:
+            return {"$literal": self.new}
+        return {"$replaceOne": {"input": report_expr, "find": self.old, "replacement": self.new}}
+
+
+class AttackReport(Record):
+    __slots__ = ("guild_id", "target_date", "user_id", "report", "memo")
     __clt_name = "attack_report"
+    __indexes = [[("guild_id", 1), ("target_date", 1), ("user_id", 1)]]
+
+    def __init__(self, guild_id: int, target_date: date | datetime, user_id: int, report: str, memo: str) -> None:
+        super().__init__(guild_id, date(target_date.year, target_date.month, target_date.day), user_id, report, memo)
+
+    @staticmethod
+    def is_board_storage() -> bool:
+        return config.attack_report_storage == "board"
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
+
+    @classmethod
+    async def Get(cls, guild_id: int, target_date: date, user_id: int) -> Optional[AttackReport]:
+        if cls.is_board_storage() or report_buffer.enabled:
+            reports = await cls.Gets(guild_id, target_date)
+            return next(filter(lambda r: r.user_id == user_id, reports), None)
 
-    def __init__(
-        self,
-        guild_id: int,
-        target_date: date | datetime,
-        user_id: int,
-        report: str,
-        memo: str,
-        _id: Optional[str] = None,
-    ) -> None:
-        self.guild_id = guild_id
-        self.target_date = date(target_date.year, target_date.month, target_date.day)
-        self.user_id = user_id
-        self.report = report
-        self.memo = memo
-
-    @classmethod
-    def Get(cls, guild_id: int, target_date: date, user_id: int) -> Optional[AttackReport]:
         target_datetime = datetime(target_date.year, target_date.month, target_date.day)
-        doc = helper.get_one(
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"$and": [{"guild_id": guild_id}, {"target_date": target_datetime}, {"user_id": user_id}]},
         )
         if doc is None:
             return None
-        return AttackReport(**doc)
+        return cls.from_doc(doc)
+
+    @classmethod
+    async def Gets(cls, guild_id: int, target_date: date) -> list[AttackReport]:
+        if report_buffer.enabled:
+            return await report_buffer.Gets(guild_id, target_date)
+        return await cls.Fetch(guild_id, target_date)
 
     @classmethod
-    def Gets(cls, guild_id: int, target_date: date) -> list[AttackReport]:
+    async def Fetch(cls, guild_id: int, target_date: date) -> list[AttackReport]:
+        # 書き込みバッファを通さずにDBから読み込む
+        if cls.is_board_storage():
+            board = await AttackReportBoard.Get(guild_id, target_date)
+            return [] if board is None else board.to_reports()
+
         target_datetime = datetime(target_date.year, target_date.month, target_date.day)
-        docs = helper.get_many(
+        docs = await helper.get_many(
             cls.__clt_name,
             filter={"$and": [{"guild_id": guild_id}, {"target_date": target_datetime}]},
         )
-        return [AttackReport(**doc) for doc in docs]
+        return [cls.from_doc(doc) for doc in docs]
+
+    @classmethod
+    async def Change(
+        cls,
+        guild_id: int,
+        target_date: date,
+        user_id: int,
+        change: Optional[ReportChange] = None,
+        memo: Optional[str] = None,
+    ) -> Optional[list[AttackReport]]:
+        # 対象ユーザーの凸状況・メモを変更し、変更後の当日分の凸状況を返す。対象ユーザーがいない場合はNone
+        if report_buffer.enabled:
+            reports = await report_buffer.Change(guild_id, target_date, user_id, change=change, memo=memo)
+            if reports is not None:
+                report_versions.Bump(guild_id, target_date)
+            return reports
+        if cls.is_board_storage():
+            board = await AttackReportBoard.Change(guild_id, target_date, user_id, change=change, memo=memo)
+            if board is None:
+                return None
+            report_versions.Bump(guild_id, target_date)
+            return board.to_reports()
+
+        reports = await cls.Gets(guild_id, target_date)
+        index = next((i for i, r in enumerate(reports) if r.user_id == user_id), None)
+        if index is None:
+            return None
+        target_repo = reports[index]
+        if change is not None:
+            target_repo = target_repo.replace(report=change.apply(target_repo.report))
+        if memo is not None:
+            target_repo = target_repo.replace(memo=memo)
+        await target_repo.Set()
+        reports[index] = target_repo
+        return reports
+
+    async def Set(self) -> Optional[AttackReport]:
+        report_versions.Bump(self.guild_id, self.target_date)
+        if report_buffer.enabled:
+            await report_buffer.Put([self])
+            return self
+        if self.is_board_storage():
+            board = await AttackReportBoard.Change(
+                self.guild_id, self.target_date, self.user_id, change=ReportChange(None, self.report), memo=self.memo
+            )
+            if board is None:
+                board = await AttackReportBoard.Push(self.guild_id, self.target_date, [self])
+            if board is None:
+                return None
+            return next(filter(lambda r: r.user_id == self.user_id, board.to_reports()), None)
 
-    def Set(self) -> None:
         target_datetime = datetime(self.target_date.year, self.target_date.month, self.target_date.day)
-        helper.upsert_one(
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={
                 "$and": [{"guild_id": self.guild_id}, {"target_date": target_datetime}, {"user_id": self.user_id}]
             },
             update={"$set": {"report": self.report, "memo": self.memo}},
         )
+        return None if doc is None else self.from_doc(doc)
 
     @classmethod
-    def Sets(cls, reports: list[AttackReport]):
+    async def Sets(cls, reports: list[AttackReport]):
+        for guild_id, target_date in {(r.guild_id, r.target_date) for r in reports}:
+            report_versions.Bump(guild_id, target_date)
+        if report_buffer.enabled:
+            await report_buffer.Put(reports)
+            return len(reports) > 0
+        if cls.is_board_storage():
+            boards: dict[tuple[int, date], list[AttackReport]] = {}
+            for r in reports:
+                boards.setdefault((r.guild_id, r.target_date), []).append(r)
+            for (guild_id, target_date), board_reports in boards.items():
+                await AttackReportBoard.Push(guild_id, target_date, board_reports)
+            return len(reports) > 0
+
         docs = [
             {
                 "guild_id": r.guild_id,
@@ -441,11 +789,48 @@ class AttackReport:
             }
             for r in reports
         ]
-        return helper.insert_many(cls.__clt_name, docs=docs)
+        return await helper.insert_many(cls.__clt_name, docs=docs)
+
+    @classmethod
+    async def Store(cls, reports: list[AttackReport]) -> int:
+        # 書き込みバッファを通さずにDBへ書き込む。既存の凸状況は上書き、ない場合は追加する
+        if cls.is_board_storage():
+            missing: dict[tuple[int, date], list[AttackReport]] = {}
+            for r in reports:
+                board = await AttackReportBoard.Change(
+                    r.guild_id, r.target_date, r.user_id, change=ReportChange(None, r.report), memo=r.memo
+                )
+                if board is None:
+                    missing.setdefault((r.guild_id, r.target_date), []).append(r)
+            for (guild_id, target_date), board_reports in missing.items():
+                await AttackReportBoard.Push(guild_id, target_date, board_reports)
+            return len(reports)
+
+        requests = [
+            (
+                {
+                    "$and": [
+                        {"guild_id": r.guild_id},
+                        {"target_date": datetime(r.target_date.year, r.target_date.month, r.target_date.day)},
+                        {"user_id": r.user_id},
+                    ]
+                },
+                {"$set": {"report": r.report, "memo": r.memo}},
+            )
+            for r in reports
+        ]
+        return await helper.bulk_upsert(cls.__clt_name, requests=requests, ordered=False)
+
+    async def Delete(self) -> bool:
+        report_versions.Bump(self.guild_id, self.target_date)
+        if report_buffer.enabled:
+            await report_buffer.Remove([self])
+            return True
+        if self.is_board_storage():
+            return await AttackReportBoard.Pull(self.guild_id, self.target_date, [self.user_id])
 
-    def Delete(self) -> bool:
         target_datetime = datetime(self.target_date.year, self.target_date.month, self.target_date.day)
-        is_deleted = helper.delete_one(
+        is_deleted = await helper.delete_one(
             self.__clt_name,
             filter={
                 "$and": [{"guild_id": self.guild_id}, {"target_date": target_datetime}, {"user_id": self.user_id}]
@@ -453,32 +838,399 @@ class AttackReport:
         )
         return is_deleted
 
+    @classmethod
+    async def DeleteMany(cls, reports: list[AttackReport]) -> int:
+        for guild_id, target_date in {(r.guild_id, r.target_date) for r in reports}:
+            report_versions.Bump(guild_id, target_date)
+        if report_buffer.enabled:
+            await report_buffer.Remove(reports)
+            return len(reports)
+        return await cls.Erase(reports)
 
-class BotConfig:
-    __clt_name = "bot_config"
+    @classmethod
+    async def Erase(cls, reports: list[AttackReport]) -> int:
+        # 書き込みバッファを通さずにDBから削除する
+        if cls.is_board_storage():
+            boards: dict[tuple[int, date], list[int]] = {}
+            for r in reports:
+                boards.setdefault((r.guild_id, r.target_date), []).append(r.user_id)
+            for (guild_id, target_date), user_ids in boards.items():
+                await AttackReportBoard.Pull(guild_id, target_date, user_ids)
+            return len(reports)
+
+        filters = [
+            {
+                "$and": [
+                    {"guild_id": r.guild_id},
+                    {"target_date": datetime(r.target_date.year, r.target_date.month, r.target_date.day)},
+                    {"user_id": r.user_id},
+                ]
+            }
+            for r in reports
+        ]
+        return await helper.bulk_delete(cls.__clt_name, filters=filters, ordered=False)
+
+
+class AttackReportBoard(Record):
+    # ギルドの1日分の凸状況を1ドキュメントで保持する(ATTACK_REPORT_STORAGE=board)
+    __slots__ = ("guild_id", "target_date", "reports")
+    __clt_name = "attack_report_board"
+    __indexes = [[("guild_id", 1), ("target_date", 1)]]
+
+    def __init__(self, guild_id: int, target_date: date | datetime, reports: list[dict]) -> None:
+        super().__init__(guild_id, date(target_date.year, target_date.month, target_date.day), reports)
+
+    def to_reports(self) -> list[AttackReport]:
+        return [
+            AttackReport(self.guild_id, self.target_date, r["user_id"], r["report"], r["memo"]) for r in self.reports
+        ]
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes, unique=True)
+
+    @classmethod
+    async def Get(cls, guild_id: int, target_date: date) -> Optional[AttackReportBoard]:
+        target_datetime = datetime(target_date.year, target_date.month, target_date.day)
+        doc = await helper.get_one(
+            cls.__clt_name,
+            filter={"guild_id": guild_id, "target_date": target_datetime},
+        )
+        if doc is None:
+            return None
+        return cls.from_doc(doc)
 
-    def __init__(
+    @classmethod
+    async def Change(
+        cls,
+        guild_id: int,
+        target_date: date,
+        user_id: int,
+        change: Optional[ReportChange] = None,
+        memo: Optional[str] = None,
+    ) -> Optional[AttackReportBoard]:
+        target_datetime = datetime(target_date.year, target_date.month, target_date.day)
+        if change is None or change.old is None:
+            fields = {}
+            if change is not None:
+                fields["reports.$.report"] = change.new
+            if memo is not None:
+                fields["reports.$.memo"] = memo
+            update = {"$set": fields}
+        else:
+            # 置換は現在値に依存するため、パイプライン更新でサーバー側で適用する
+            fields = {"report": change.expr("$$r.report")}
+            if memo is not None:
+                fields["memo"] = {"$literal": memo}
+            update = [
+                {
+                    "$set": {
+                        "reports": {
+                            "$map": {
+                                "input": "$reports",
+                                "as": "r",
+                                "in": {
+                                    "$cond": [
+                                        {"$eq": ["$$r.user_id", user_id]},
+                                        {"$mergeObjects": ["$$r", fields]},
+                                        "$$r",
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            ]
+        doc = await helper.find_one_and_update(
+            cls.__clt_name,
+            filter={"guild_id": guild_id, "target_date": target_datetime, "reports.user_id": user_id},
+            update=update,
+        )
+        if doc is None:
+            return None
+        return cls.from_doc(doc)
+
+    @classmethod
+    async def Push(cls, guild_id: int, target_date: date, reports: list[AttackReport]) -> Optional[AttackReportBoard]:
+        target_datetime = datetime(target_date.year, target_date.month, target_date.day)
+        docs = [{"user_id": r.user_id, "report": r.report, "memo": r.memo} for r in reports]
+        doc = await helper.upsert_one(
+            cls.__clt_name,
+            filter={"guild_id": guild_id, "target_date": target_datetime},
+            update={"$push": {"reports": {"$each": docs}}},
+        )
+        if doc is None:
+            return None
+        return cls.from_doc(doc)
+
+    @classmethod
+    async def Pull(cls, guild_id: int, target_date: date, user_ids: list[int]) -> bool:
+        target_datetime = datetime(target_date.year, target_date.month, target_date.day)
+        is_pulled = await helper.update_one(
+            cls.__clt_name,
+            filter={"guild_id": guild_id, "target_date": target_datetime},
+            update={"$pull": {"reports": {"user_id": {"$in": user_ids}}}},
+        )
+        return is_pulled
+
+
+class AttackReportBuffer:
+    # 凸状況の書き込みバッファ(ATTACK_REPORT_WRITE_BEHIND=true)
+    # 一度読み込んだ日の凸状況はメモリ上の内容を正とし、変更はFlushでまとめてDBへ書き込む
+    # Flushは一定間隔・bot終了時・手動で実行する。Flush前にプロセスが落ちた場合、未書き込みの変更は失われる
+    # 書き込みに失敗した変更は、その後に新しい変更がなければ次回のFlushで再度書き込む
+    # 同じ凸状況を複数プロセスから更新する構成では使用しないこと
+    idle_seconds = 3600.0
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.flushed = 0
+        self.failures = 0
+        self.__boards: dict[tuple[int, date], dict[int, AttackReport]] = {}
+        # Noneは削除を表す
+        self.__dirty: dict[tuple[int, date], dict[int, Optional[AttackReport]]] = {}
+        self.__touched: dict[tuple[int, date], float] = {}
+        self.__load_locks: dict[tuple[int, date], asyncio.Lock] = {}
+        self.__flush_lock: Optional[asyncio.Lock] = None
+
+    async def __Board(self, guild_id: int, target_date: date) -> dict[int, AttackReport]:
+        key = (guild_id, target_date)
+        board = self.__boards.get(key)
+        if board is None:
+            lock = self.__load_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                board = self.__boards.get(key)
+                if board is None:
+                    reports = await AttackReport.Fetch(guild_id, target_date)
+                    board = self.__boards[key] = {r.user_id: r for r in reports}
+                    report_versions.Reset(guild_id, target_date)
+            self.__load_locks.pop(key, None)
+        self.__touched[key] = time.monotonic()
+        return board
+
+    async def Gets(self, guild_id: int, target_date: date) -> list[AttackReport]:
+        board = await self.__Board(guild_id, target_date)
+        return list(board.values())
+
+    async def Change(
         self,
-        auto_set_clan_battle_schedule: bool,
-        auto_set_boss_info: bool,
-        id: Optional[int] = None,
-        _id: Optional[str] = None,
-    ) -> None:
-        self.auto_set_clan_battle_schedule = auto_set_clan_battle_schedule
-        self.auto_set_boss_info = auto_set_boss_info
+        guild_id: int,
+        target_date: date,
+        user_id: int,
+        change: Optional[ReportChange] = None,
+        memo: Optional[str] = None,
+    ) -> Optional[list[AttackReport]]:
+        board = await self.__Board(guild_id, target_date)
+        target_repo = board.get(user_id)
+        if target_repo is None:
+            return None
+        if change is not None:
+            target_repo = target_repo.replace(report=change.apply(target_repo.report))
+        if memo is not None:
+            target_repo = target_repo.replace(memo=memo)
+        board[user_id] = target_repo
+        self.__dirty.setdefault((guild_id, target_date), {})[user_id] = target_repo
+        return list(board.values())
+
+    async def Put(self, reports: list[AttackReport]) -> None:
+        for r in reports:
+            board = await self.__Board(r.guild_id, r.target_date)
+            board[r.user_id] = r
+            self.__dirty.setdefault((r.guild_id, r.target_date), {})[r.user_id] = r
+
+    async def Remove(self, reports: list[AttackReport]) -> None:
+        for r in reports:
+            board = await self.__Board(r.guild_id, r.target_date)
+            board.pop(r.user_id, None)
+            self.__dirty.setdefault((r.guild_id, r.target_date), {})[r.user_id] = None
+
+    async def Flush(self) -> int:
+        if self.__flush_lock is None:
+            self.__flush_lock = asyncio.Lock()
+        async with self.__flush_lock:
+            dirty, self.__dirty = self.__dirty, {}
+            rows = [(key, user_id, r) for key, board_rows in dirty.items() for user_id, r in board_rows.items()]
+            upserts = [r for _, _, r in rows if r is not None]
+            erases = [AttackReport(key[0], key[1], user_id, "", "") for key, user_id, r in rows if r is None]
+            try:
+                if upserts:
+                    await AttackReport.Store(upserts)
+                if erases:
+                    await AttackReport.Erase(erases)
+            except Exception:
+                for key, user_id, r in rows:
+                    self.__dirty.setdefault(key, {}).setdefault(user_id, r)
+                self.failures += 1
+                logger.error(
+                    "failed to flush attack report buffer", exc_info=True, extra={"json_fields": {"rows": len(rows)}}
+                )
+                raise
+
+            self.flushed += len(rows)
+            self.__Evict()
+            return len(rows)
+
+    def __Evict(self) -> None:
+        # 変更がなく、しばらく参照されていない日の凸状況をメモリから外す
+        expired = time.monotonic() - self.idle_seconds
+        for key in [k for k, t in self.__touched.items() if t < expired and k not in self.__dirty]:
+            self.__boards.pop(key, None)
+            self.__touched.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "boards": len(self.__boards),
+            "dirty": sum(len(rows) for rows in self.__dirty.values()),
+            "flushed": self.flushed,
+            "failures": self.failures,
+        }
+
+
+report_buffer = AttackReportBuffer(enabled=config.attack_report_write_behind)
+
+
+class ReportVersions:
+    # ギルド・日付毎の、このプロセスでの凸状況の書き込み回数。集計が最新かを報告を比べずに判定するために使う
+    # 版は(世代, 回数)で、DBから読み直した場合や件数の上限で削除された場合は新しい世代から数え直す
+    # 他プロセスからの書き込みは数えない
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.__epoch = 0
+        self.__versions: OrderedDict[tuple[int, date], tuple[int, int]] = OrderedDict()
+
+    def Get(self, guild_id: int, target_date: date) -> Optional[tuple[int, int]]:
+        return self.__versions.get((guild_id, target_date))
+
+    def Bump(self, guild_id: int, target_date: date) -> None:
+        key = (guild_id, target_date)
+        version = self.__versions.pop(key, None)
+        if version is None:
+            self.__epoch += 1
+            version = (self.__epoch, 0)
+        self.__versions[key] = (version[0], version[1] + 1)
+        while len(self.__versions) > self.max_entries:
+            self.__versions.popitem(last=False)
+
+    def Reset(self, guild_id: int, target_date: date) -> None:
+        self.__versions.pop((guild_id, target_date), None)
+
+
+report_versions = ReportVersions(max_entries=config.report_cache_size)
+
+
+class ConcurrentAttackBoard(Record):
+    __slots__ = ("message_id", "header", "separator", "entries")
+    # 同時凸の状況のスナップショット。再起動後の最初の操作時に読み込む
+    __clt_name = "concurrent_attack_board"
+    __indexes = [[("message_id", 1)]]
+    __ttl_indexes = [[("updated_at", 1)]]
+    __ttl_seconds = 7 * 24 * 3600
+
+    def __init__(self, message_id: int, header: str, separator: str, entries: list[dict]) -> None:
+        super().__init__(message_id, header, separator, entries)
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        names = helper.create_indexes(cls.__clt_name, cls.__indexes, unique=True)
+        names += helper.create_indexes(cls.__clt_name, cls.__ttl_indexes, expire_after_seconds=cls.__ttl_seconds)
+        return names
+
+    @classmethod
+    async def Get(cls, message_id: int) -> Optional[ConcurrentAttackBoard]:
+        # リースの取得のみで状況を書き込んでいないドキュメントは除く
+        doc = await helper.get_one(
+            cls.__clt_name,
+            filter={"message_id": message_id, "entries": {"$exists": True}},
+        )
+        if doc is None:
+            return None
+        return cls.from_doc(doc)
+
+    async def Set(self, lease_owner: Optional[str] = None) -> Optional[ConcurrentAttackBoard]:
+        # lease_ownerを指定した場合はそのリースを保持している間のみ書き込み、他のプロセスに取得されていればNoneを返す
+        fields = {
+            "header": self.header,
+            "separator": self.separator,
+            "entries": self.entries,
+            "updated_at": datetime.utcnow(),
+        }
+        if lease_owner is None:
+            doc = await helper.upsert_one(
+                self.__clt_name, filter={"message_id": self.message_id}, update={"$set": fields}
+            )
+        else:
+            doc = await helper.find_one_and_update(
+                self.__clt_name,
+                filter={"message_id": self.message_id, "lease_owner": lease_owner},
+                update={"$set": fields},
+            )
+        return None if doc is None else self.from_doc(doc)
+
+
+class ConcurrentAttackBoardLease(Record):
+    __slots__ = ("message_id", "lease_owner", "lease_expires_at")
+    # 複数プロセスで同時凸の状況を更新する際のリース(期限付きのロック)
+    # 状況と同じドキュメントに保持し、状況の書き込みをリースの保持者に限定する
+    __clt_name = "concurrent_attack_board"
+
+    def __init__(self, message_id: int, lease_owner: str, lease_expires_at: Optional[datetime] = None) -> None:
+        super().__init__(message_id, lease_owner, lease_expires_at)
+
+    async def Acquire(self, lease_seconds: float) -> Optional[ConcurrentAttackBoardLease]:
+        # 期限切れ・未取得か自身が保持しているリースのみ取得できる。他のプロセスが保持している場合はNoneを返す
+        now = datetime.utcnow()
+        doc = await helper.compare_and_upsert(
+            self.__clt_name,
+            filter={
+                "message_id": self.message_id,
+                "$or": [
+                    {"lease_expires_at": {"$lte": now}},
+                    {"lease_expires_at": {"$exists": False}},
+                    {"lease_owner": self.lease_owner},
+                ],
+            },
+            update={
+                "$set": {
+                    "lease_owner": self.lease_owner,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "updated_at": now,
+                }
+            },
+        )
+        return None if doc is None else self.from_doc(doc)
+
+    async def Release(self) -> bool:
+        return await helper.update_one(
+            self.__clt_name,
+            filter={"message_id": self.message_id, "lease_owner": self.lease_owner},
+            update={"$unset": {"lease_owner": "", "lease_expires_at": ""}},
+        )
+
+
+class BotConfig(Record):
+    __slots__ = ("auto_set_clan_battle_schedule", "auto_set_boss_info")
+    __clt_name = "bot_config"
+    __indexes = [[("id", 1)]]
+
+    def __init__(self, auto_set_clan_battle_schedule: bool, auto_set_boss_info: bool) -> None:
+        super().__init__(auto_set_clan_battle_schedule, auto_set_boss_info)
+
+    @classmethod
+    def CreateIndexes(cls) -> list[str]:
+        return helper.create_indexes(cls.__clt_name, cls.__indexes)
 
     @classmethod
-    def Get(cls) -> Optional[BotConfig]:
-        doc = helper.get_one(
+    async def Get(cls) -> Optional[BotConfig]:
+        doc = await helper.get_one(
             cls.__clt_name,
             filter={"id": 1},
         )
         if doc is None:
             return None
-        return BotConfig(**doc)
+        return cls.from_doc(doc)
 
-    def Set(self) -> None:
-        helper.upsert_one(
+    async def Set(self) -> Optional[BotConfig]:
+        doc = await helper.upsert_one(
             self.__clt_name,
             filter={"id": 1},
             update={
@@ -488,3 +1240,29 @@ class BotConfig:
                 }
             },
         )
+        return None if doc is None else self.from_doc(doc)
+
+
+def create_indexes() -> None:
+    models = [
+        BossInfo,
+        ListTLSubscMessage,
+        AttackReportRegister,
+        ClanBattleSchedule,
+        TLVideoNotify,
+        TLVideoGotten,
+        ClanMemberRole,
+        YetCompleteRole,
+        ConcurrentAttackNotify,
+        TemplateUnfreezeMessage,
+        TemplateAttackStartMessage,
+        AttackReport,
+        AttackReportBoard,
+        ConcurrentAttackBoard,
+        BotConfig,
+    ]
+    for model in models:
+        try:
+            model.CreateIndexes()
+        except Exception:
+            logger.error(f"failed to create indexes. model: {model.__name__}", exc_info=True)
@@ -1,15 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+from functools import wraps
 from logging import getLogger
-from typing import Iterable, Optional
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
 
 import pymongo
 
 import app_config
+import mongo_monitor
 
 logger = getLogger(__name__)
 config = app_config.Config.get_instance()
 
+T = TypeVar("T")
+
 
 class MongoConn:
     __db = None
@@ -19,7 +24,9 @@ class MongoConn:
     def get_db(cls):
         if cls.__db is None:
             logger.info("mongodb connection")
-            cls.__db = pymongo.MongoClient(config.database_url)[cls.__db_name]
+            cls.__db = pymongo.MongoClient(config.database_url, event_listeners=[mongo_monitor.command_monitor])[
+                cls.__db_name
+            ]
         return cls.__db
 
     @classmethod
@@ -28,6 +35,16 @@ class MongoConn:
             cls.__db.client.close()
 
 
+def run_in_thread(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    # pymongoの呼び出しはブロッキングするため、イベントループを止めないようにスレッドで実行する
+    @wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    return wrapper
+
+
+@run_in_thread
 def get_one(clt_name: str, filter: dict) -> Optional[dict]:
     db = MongoConn.get_db()
     collection = db[clt_name]
@@ -35,21 +52,72 @@ def get_one(clt_name: str, filter: dict) -> Optional[dict]:
     return doc
 
 
-def get_many(clt_name: str, filter: Optional[dict] = None) -> Iterable[dict]:
+@run_in_thread
+def get_many(
+    clt_name: str, filter: Optional[dict] = None, projection: Optional[dict] = None, batch_size: int = 0
+) -> list[dict]:
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    docs = collection.find(filter=filter, projection=projection, batch_size=batch_size)
+    return list(docs)
+
+
+@run_in_thread
+def count(clt_name: str, filter: dict) -> int:
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    return collection.count_documents(filter=filter)
+
+
+@run_in_thread
+def exists(clt_name: str, filter: dict) -> bool:
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    doc = collection.find_one(filter=filter, projection={"_id": 1})
+    return doc is not None
+
+
+@run_in_thread
+def upsert_one(clt_name: str, filter: dict, update: dict) -> Optional[dict]:
+    # 更新後のドキュメントを返すため、書き込み後の再読み込みは不要
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    doc = collection.find_one_and_update(
+        filter=filter, update=update, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+    )
+    return doc
+
+
+@run_in_thread
+def compare_and_upsert(clt_name: str, filter: dict, update: dict) -> Optional[dict]:
+    # 条件に一致しない既存ドキュメントがあり、一意制約で挿入できない場合はNoneを返す
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    try:
+        return collection.find_one_and_update(
+            filter=filter, update=update, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+        )
+    except pymongo.errors.DuplicateKeyError:
+        return None
+
+
+@run_in_thread
+def update_one(clt_name: str, filter: dict, update: dict) -> bool:
     db = MongoConn.get_db()
     collection = db[clt_name]
-    docs = collection.find(filter=filter)
-    for doc in docs:
-        yield doc
+    result = collection.update_one(filter=filter, update=update)
+    return result.modified_count > 0
 
 
-def upsert_one(clt_name: str, filter: dict, update: dict) -> bool:
+@run_in_thread
+def find_one_and_update(clt_name: str, filter: dict, update: dict | list[dict]) -> Optional[dict]:
     db = MongoConn.get_db()
     collection = db[clt_name]
-    result = collection.update_one(filter=filter, update=update, upsert=True)
-    return result.matched_count > 0
+    doc = collection.find_one_and_update(filter=filter, update=update, return_document=pymongo.ReturnDocument.AFTER)
+    return doc
 
 
+@run_in_thread
 def insert_many(clt_name: str, docs: Iterable[dict]) -> bool:
     db = MongoConn.get_db()
     collection = db[clt_name]
@@ -57,8 +125,50 @@ def insert_many(clt_name: str, docs: Iterable[dict]) -> bool:
     return len(result.inserted_ids) > 0
 
 
+@run_in_thread
+def bulk_upsert(clt_name: str, requests: list[tuple[dict, dict]], ordered: bool = True) -> int:
+    if not requests:
+        return 0
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    result = collection.bulk_write(
+        [pymongo.UpdateOne(filter=filter, update=update, upsert=True) for filter, update in requests], ordered=ordered
+    )
+    return result.matched_count + result.upserted_count
+
+
+@run_in_thread
 def delete_one(clt_name: str, filter: dict) -> bool:
     db = MongoConn.get_db()
     collection = db[clt_name]
     result = collection.delete_one(filter=filter)
     return result.deleted_count > 0
+
+
+@run_in_thread
+def bulk_delete(clt_name: str, filters: list[dict], ordered: bool = True) -> int:
+    if not filters:
+        return 0
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    result = collection.bulk_write([pymongo.DeleteOne(filter=filter) for filter in filters], ordered=ordered)
+    return result.deleted_count
+
+
+def create_indexes(
+    clt_name: str,
+    indexes: list[list[tuple[str, int]]],
+    unique: bool = False,
+    expire_after_seconds: Optional[int] = None,
+) -> list[str]:
+    db = MongoConn.get_db()
+    collection = db[clt_name]
+    exist_names = collection.index_information().keys()
+    options = {"unique": unique}
+    if expire_after_seconds is not None:
+        options["expireAfterSeconds"] = expire_after_seconds
+    names = collection.create_indexes([pymongo.IndexModel(keys, **options) for keys in indexes])
+    created_names = [n for n in names if n not in exist_names]
+    for name in created_names:
+        logger.info(f"created index. collection: {clt_name}, index: {name}")
+    return created_names
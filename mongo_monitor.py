@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Any, Coroutine, Iterator, Optional
+
+from pymongo import monitoring
+
+import app_config
+
+logger = getLogger(__name__)
+config = app_config.Config.get_instance()
+
+# レイテンシヒストグラムのバケット上限(ms)。最後のバケットはそれ以上
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class InteractionStats:
+    # 1回のコマンド・ボタン操作で発行したMongoコマンドの集計
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.round_trips = 0
+        self.duration_ms = 0.0
+        self.__lock = threading.Lock()
+
+    def add(self, duration_ms: float) -> None:
+        with self.__lock:
+            self.round_trips += 1
+            self.duration_ms += duration_ms
+
+
+current_interaction: contextvars.ContextVar[Optional[InteractionStats]] = contextvars.ContextVar(
+    "current_interaction", default=None
+)
+
+
+def create_background_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    # タスクは作成時のコンテキストを引き継ぐため、バックグラウンドのタスクのMongoコマンドが
+    # タスクを作成した操作に集計されないよう、操作を外したコンテキストで作成する
+    context = contextvars.copy_context()
+    context.run(current_interaction.set, None)
+    return context.run(asyncio.create_task, coro)
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.failures = 0
+
+    def observe(self, duration_ms: float, failed: bool) -> None:
+        index = next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if duration_ms <= b), len(LATENCY_BUCKETS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        if failed:
+            self.failures += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+def filter_shape(filter: Any) -> Any:
+    # 値を伏せてクエリの形だけを残す
+    if isinstance(filter, dict):
+        return {k: filter_shape(v) for k, v in filter.items()}
+    if isinstance(filter, (list, tuple)):
+        return [filter_shape(v) for v in filter]
+    return "?"
+
+
+def command_filter(command_name: str, command: dict) -> Any:
+    if command_name == "find":
+        return command.get("filter")
+    if command_name in ("count", "findAndModify"):
+        return command.get("query")
+    if command_name == "update" and command.get("updates"):
+        return command["updates"][0].get("q")
+    if command_name == "delete" and command.get("deletes"):
+        return command["deletes"][0].get("q")
+    if command_name == "aggregate":
+        return next((s["$match"] for s in command.get("pipeline", []) if "$match" in s), None)
+    return None
+
+
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, slow_query_ms: float) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.__lock = threading.Lock()
+        self.__pending: dict[tuple, tuple[str, Any, Optional[InteractionStats]]] = {}
+        self.__histograms: dict[tuple[str, str], LatencyHistogram] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "-")
+        shape = filter_shape(command_filter(event.command_name, event.command))
+        # リスナーは呼び出し元スレッドで実行されるため、to_threadでコピーされたコンテキストを参照できる
+        with self.__lock:
+            self.__pending[(event.connection_id, event.request_id)] = (collection, shape, current_interaction.get())
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self.__finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self.__finish(event, failed=True)
+
+    def __finish(self, event: monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent, failed: bool) -> None:
+        duration_ms = event.duration_micros / 1000
+        with self.__lock:
+            pending = self.__pending.pop((event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            collection, shape, interaction = pending
+            key = (collection, event.command_name)
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = LatencyHistogram()
+            histogram.observe(duration_ms, failed)
+
+        if interaction is not None:
+            interaction.add(duration_ms)
+        if duration_ms >= self.slow_query_ms:
+            logger.warning(
+                "slow mongo command",
+                extra={
+                    "json_fields": {
+                        "collection": collection,
+                        "command": event.command_name,
+                        "duration_ms": round(duration_ms, 2),
+                        "filter": shape,
+                        "interaction": interaction.name if interaction else None,
+                        "failed": failed,
+                    }
+                },
+            )
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        with self.__lock:
+            return {f"{c}.{op}": h.to_dict() for (c, op), h in sorted(self.__histograms.items())}
+
+
+command_monitor = CommandMonitor(slow_query_ms=config.mongo_slow_query_ms)
+
+
+@contextmanager
+def track_interaction(name: str, extra: dict) -> Iterator[InteractionStats]:
+    # 操作中に発行したMongoコマンドの往復回数と合計時間をログに残す
+    stats = InteractionStats(name)
+    token = current_interaction.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        current_interaction.reset(token)
+        if stats.round_trips > 0:
+            logger.info(
+                "mongo round trips",
+                extra={
+                    "json_fields": {
+                        **extra,
+                        "interaction": name,
+                        "round_trips": stats.round_trips,
+                        "mongo_ms": round(stats.duration_ms, 2),
+                        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+                    }
+                },
+            )
@@ -1,4 +1,5 @@
 from logging import getLogger
+from typing import Awaitable, Callable
 
 import discord
 
@@ -15,6 +16,16 @@ class BotClass(discord.Bot):
         super().__init__(intents=intents)
         self.persistent_views_added = False
         self.persistent_view_classes = set()
+        self.close_callbacks: list[Callable[[], Awaitable[None]]] = []
+
+    async def close(self):
+        # 終了前の後処理(書き込みバッファのflushなど)
+        for callback in self.close_callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.error("failed to run close callback", exc_info=True)
+        await super().close()
 
     # For making the intreaction Button works even after restart.
     async def on_ready(self):
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from logging import getLogger
+from typing import Any
+
+import discord
+
+import app_config
+from mongo_monitor import LatencyHistogram, create_background_task
+
+logger = getLogger(__name__)
+config = app_config.Config.get_instance()
+
+# レート制限(429)で送信に失敗した場合の再送回数
+MAX_RATE_LIMIT_RETRIES = 3
+
+
+class NotifyJob:
+    __slots__ = ("guild", "channel_id", "kwargs", "queued")
+
+    def __init__(self, guild: discord.Guild, channel_id: int, kwargs: dict[str, Any]) -> None:
+        self.guild = guild
+        self.channel_id = channel_id
+        self.kwargs = kwargs
+        self.queued = time.monotonic()
+
+
+class NotifyDispatcher:
+    # 通知チャンネルへの送信をボタン操作の応答から切り離してバックグラウンドで行う
+    # チャンネル毎の送信順を保つため、チャンネルIDで振り分けたワーカー毎のキューから順に送信する
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.sent = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.latency = LatencyHistogram()
+        self.__queues: list[asyncio.Queue[NotifyJob]] = []
+        self.__tasks: list[asyncio.Task] = []
+
+    def __start(self) -> None:
+        # キューはイベントループ上で作成する必要があるため初回の送信時に作成する
+        if not self.__queues:
+            self.__queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+            self.__tasks = [create_background_task(self.__work(q)) for q in self.__queues]
+
+    def submit(self, guild: discord.Guild, channel_id: int, **kwargs: Any) -> bool:
+        self.__start()
+        queue = self.__queues[channel_id % self.workers]
+        try:
+            queue.put_nowait(NotifyJob(guild, channel_id, kwargs))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("notify queue is full", extra={"json_fields": {"channel_id": channel_id}})
+            return False
+        return True
+
+    async def __work(self, queue: asyncio.Queue[NotifyJob]) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                await self.__send(job)
+            finally:
+                queue.task_done()
+
+    async def __send(self, job: NotifyJob) -> None:
+        failed = False
+        try:
+            channel = job.guild.get_channel_or_thread(job.channel_id)
+            channel = channel if channel is not None else await job.guild.fetch_channel(job.channel_id)
+            for retry in range(MAX_RATE_LIMIT_RETRIES + 1):
+                try:
+                    await channel.send(**job.kwargs)
+                    self.sent += 1
+                    break
+                except discord.HTTPException as e:
+                    # 通常のレート制限はライブラリ内で待機して再送されるため、ここには再送を諦めた場合のみ来る
+                    if e.status != 429 or retry == MAX_RATE_LIMIT_RETRIES:
+                        raise
+                    self.rate_limited += 1
+                    await asyncio.sleep(float(e.response.headers.get("Retry-After", 1)))
+        except Exception:
+            failed = True
+            logger.error(
+                "failed to send notify",
+                exc_info=True,
+                extra={"json_fields": {"guild_id": job.guild.id, "channel_id": job.channel_id}},
+            )
+        self.latency.observe((time.monotonic() - job.queued) * 1000, failed)
+
+    async def close(self, timeout: float = 5) -> None:
+        # 未送信の通知を待ってからワーカーを停止する
+        if self.__queues:
+            try:
+                await asyncio.wait_for(asyncio.gather(*[q.join() for q in self.__queues]), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("notify queue was not drained", extra={"json_fields": self.stats()})
+        for task in self.__tasks:
+            task.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "depth": sum(q.qsize() for q in self.__queues),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "rate_limited": self.rate_limited,
+            "latency": self.latency.to_dict(),
+        }
+
+
+notify_dispatcher = NotifyDispatcher(workers=config.notify_workers, queue_size=config.notify_queue_size)
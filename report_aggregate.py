@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from typing import Optional
+
+import mongo_data as mongo
+
+EMOJI_YET_ATK = "🍖"
+EMOJI_CMP_ATK = "🦴"
+EMOJI_CARRY = "🍰"
+
+# 並び順の区分。見つからないメンバーを末尾に、その他は残凸、持越の多い順に並べる
+GroupKey = tuple[bool, int, int]
+
+
+def group_key(report: mongo.AttackReport, lost: bool) -> GroupKey:
+    return (lost, -report.report.count(EMOJI_YET_ATK), -report.report.count(EMOJI_CARRY))
+
+
+def report_counts(report: mongo.AttackReport) -> tuple[int, int, int]:
+    return (
+        report.report.count(EMOJI_YET_ATK, 0, 3),
+        report.report.count(EMOJI_CMP_ATK, 0, 3),
+        report.report.count(EMOJI_CARRY, 0, 3),
+    )
+
+
+def report_line(report: mongo.AttackReport, name: Optional[str]) -> str:
+    if name is None:
+        return f"{report.report} : ユーザID: {report.user_id} が見つかりませんでした。"
+    return f"{report.report} : {name} : {report.memo}"
+
+
+class ReportAggregate:
+    # 1ギルド1日分の凸状況の集計と表示。変更された報告の分だけ件数・並び順・表示行を更新する
+    # 区分内は最初に渡された報告の順に並べ、表示は区分毎に組み立てたものを使い回す
+    def __init__(
+        self,
+        reports: list[mongo.AttackReport],
+        names: dict[int, Optional[str]],
+        version: Optional[tuple[int, int]] = None,
+    ) -> None:
+        # versionは集計に反映済みの書き込みの版(mongo.report_versions)
+        self.version = version
+        self.yet_atk_count = 0
+        self.cmp_atk_count = 0
+        self.carry_count = 0
+        self.__ranks: dict[int, int] = {}
+        self.__reports: dict[int, tuple[mongo.AttackReport, GroupKey, str]] = {}
+        self.__groups: dict[GroupKey, list[tuple[int, int]]] = {}
+        self.__texts: dict[GroupKey, str] = {}
+        self.__yet_user_ids: set[int] = set()
+        self.__lost_user_ids: set[int] = set()
+        for report in reports:
+            self.update(report, names.get(report.user_id))
+
+    def __len__(self) -> int:
+        return len(self.__reports)
+
+    def update(self, report: mongo.AttackReport, name: Optional[str]) -> None:
+        user_id = report.user_id
+        rank = self.__ranks.setdefault(user_id, len(self.__ranks))
+        old = self.__reports.get(user_id)
+        if old is not None:
+            self.__count(old[0], -1)
+            group = self.__groups[old[1]]
+            del group[bisect_left(group, (rank, user_id))]
+            self.__texts.pop(old[1], None)
+        key = group_key(report, name is None)
+        self.__reports[user_id] = (report, key, report_line(report, name))
+        self.__count(report, 1)
+        insort(self.__groups.setdefault(key, []), (rank, user_id))
+        self.__texts.pop(key, None)
+        if name is None:
+            self.__lost_user_ids.add(user_id)
+        else:
+            self.__lost_user_ids.discard(user_id)
+        if report.report != EMOJI_CMP_ATK * 3:
+            self.__yet_user_ids.add(user_id)
+        else:
+            self.__yet_user_ids.discard(user_id)
+
+    def rename(self, user_id: int, name: Optional[str]) -> None:
+        # 表示名の変更・メンバーの退出を反映する。Noneは見つからないメンバーとして末尾に並べる
+        entry = self.__reports.get(user_id)
+        if entry is not None:
+            self.update(entry[0], name)
+
+    def __count(self, report: mongo.AttackReport, sign: int) -> None:
+        yet_atk, cmp_atk, carry = report_counts(report)
+        self.yet_atk_count += yet_atk * sign
+        self.cmp_atk_count += cmp_atk * sign
+        self.carry_count += carry * sign
+
+    def get(self, user_id: int) -> Optional[mongo.AttackReport]:
+        entry = self.__reports.get(user_id)
+        return None if entry is None else entry[0]
+
+    def yet_complete_user_ids(self) -> set[int]:
+        return set(self.__yet_user_ids)
+
+    def lost_user_ids(self) -> set[int]:
+        return set(self.__lost_user_ids)
+
+    def summary(self) -> str:
+        return (
+            f"凸状況 (残凸`{EMOJI_YET_ATK}`= **{self.yet_atk_count}** , "
+            f"持越`{EMOJI_CARRY}`= **{self.carry_count}** , "
+            f"消化`{EMOJI_CMP_ATK}`= **{self.cmp_atk_count}** )"
+        )
+
+    def render(self) -> str:
+        texts = []
+        for key in sorted(k for k, group in self.__groups.items() if group):
+            text = self.__texts.get(key)
+            if text is None:
+                text = self.__texts[key] = "\n".join(self.__reports[uid][2] for _, uid in self.__groups[key])
+            texts.append(text)
+        return "```\n" + "\n".join(texts) + "\n```"
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+from logging import getLogger
+from typing import Optional
+
+import discord
+
+import app_config
+from bounded_map import BoundedLockMap
+from member_index import role_index
+from mongo_monitor import create_background_task
+
+logger = getLogger(__name__)
+config = app_config.Config.get_instance()
+
+RoleKey = tuple[int, int]
+
+
+class RoleSyncResult:
+    __slots__ = ("added", "removed", "failed")
+
+    def __init__(self) -> None:
+        self.added = 0
+        self.removed = 0
+        self.failed = 0
+
+
+class RoleSyncEngine:
+    # ロールを付けるべきメンバーの集合と現在のロールの差分のみを、同時実行数を制限して並行に付け外しする
+    # 短時間に繰り返し要求された同期は、最後に要求された内容で1回だけ行う
+    def __init__(self, concurrency: int, debounce: float, cache_size: int, cache_idle_seconds: float) -> None:
+        self.concurrency = concurrency
+        self.debounce = debounce
+        self.__desired: dict[RoleKey, tuple[discord.Guild, discord.Role, set[int]]] = {}
+        self.__running: dict[RoleKey, asyncio.Task] = {}
+        self.__locks: BoundedLockMap[RoleKey, None] = BoundedLockMap(
+            max_entries=cache_size, idle_seconds=cache_idle_seconds
+        )
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+
+    def request(self, guild: discord.Guild, role: discord.Role, desired: set[int]) -> None:
+        key = (guild.id, role.id)
+        self.__desired[key] = (guild, role, desired)
+        if key not in self.__running:
+            self.__running[key] = create_background_task(self.__run(key))
+
+    async def __run(self, key: RoleKey) -> None:
+        try:
+            while key in self.__desired:
+                await asyncio.sleep(self.debounce)
+                request = self.__desired.pop(key, None)
+                if request is None:
+                    break
+                try:
+                    await self.sync(*request)
+                except Exception:
+                    logger.error(
+                        "failed to sync role",
+                        exc_info=True,
+                        extra={"json_fields": {"guild_id": key[0], "role_id": key[1]}},
+                    )
+        finally:
+            self.__running.pop(key, None)
+
+    async def sync(self, guild: discord.Guild, role: discord.Role, desired: set[int]) -> RoleSyncResult:
+        key = (guild.id, role.id)
+        # 待機中の要求より後に指定された内容を優先する
+        self.__desired.pop(key, None)
+        result = RoleSyncResult()
+        async with self.__locks.hold(key):
+            current = await role_index.members(guild, role.id)
+            changes = [(uid, True) for uid in desired - current] + [(uid, False) for uid in current - desired]
+            if changes:
+                await asyncio.gather(*[self.__change(guild, role, uid, add, result) for uid, add in changes])
+        return result
+
+    def stats(self) -> dict[str, int]:
+        return {**self.__locks.stats(), "pending": len(self.__desired), "running": len(self.__running)}
+
+    async def __change(
+        self, guild: discord.Guild, role: discord.Role, user_id: int, add: bool, result: RoleSyncResult
+    ) -> None:
+        member = guild.get_member(user_id)
+        if member is None:
+            return
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        # 同時実行数のみ制限し、レート制限の待機はライブラリに任せる
+        async with self.__semaphore:
+            try:
+                if add:
+                    await member.add_roles(role)
+                else:
+                    await member.remove_roles(role)
+            except discord.HTTPException:
+                result.failed += 1
+                logger.warning(
+                    "failed to change role",
+                    exc_info=True,
+                    extra={"json_fields": {"guild_id": guild.id, "role_id": role.id, "user_id": user_id}},
+                )
+                return
+        # ゲートウェイのイベントを待たずに索引へ反映し、直後の同期で同じ変更を繰り返さないようにする
+        role_index.apply(guild.id, user_id, role.id, add)
+        if add:
+            result.added += 1
+        else:
+            result.removed += 1
+
+
+role_sync = RoleSyncEngine(
+    concurrency=config.role_sync_concurrency,
+    debounce=config.role_sync_debounce,
+    cache_size=config.role_sync_cache_size,
+    cache_idle_seconds=config.role_sync_cache_idle_seconds,
+)
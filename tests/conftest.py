@@ -0,0 +1,4 @@
+import os
+
+# app_configは必須の環境変数がない場合に読み込めないため、テストでは空の値を設定する
+os.environ.setdefault("SCRAPING_TEMPLATE_URL", "")
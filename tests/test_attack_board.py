@@ -0,0 +1,105 @@
+import random
+import re
+from typing import Optional
+
+import pytest
+
+from attack_board import AttackBoard, AttackEntry
+
+ATTACK_KINDS = ["　新凸　 物🗡️", "　新凸　 魔✡️", "★持越★ 物🗡️", "★持越★ 魔✡️"]
+
+
+def old_sort_by_damage(atk_list: list[str]) -> list[str]:
+    # 本文の行を直接並べ替えていた以前の実装。比較の基準とする
+    atks = [(atk, re.search(r"万 : .+$", atk)) for atk in atk_list]
+    atks_with_note = [
+        (atk, re.search(r"\d{3,}", note.group()), re.search(r"\+\d{2,}", note.group()))
+        for atk, note in atks
+        if note is not None
+    ]
+    atks_with_dmg = [
+        (atk, int(dmg.group()) + int(add_dmg.group() if add_dmg is not None else "0"))
+        for atk, dmg, add_dmg in atks_with_note
+        if dmg is not None
+    ]
+    atks_with_dmg.sort(key=lambda a: a[1], reverse=True)
+    sorted_atks = [atk for atk, _ in atks_with_dmg]
+    atks_without_dmg = [atk for atk in atk_list if atk not in sorted_atks]
+    sorted_atks += atks_without_dmg
+    return sorted_atks
+
+
+def random_note(rng: random.Random) -> Optional[str]:
+    damage = str(rng.choice([rng.randint(100, 3000), rng.randint(100, 120), rng.randint(0, 99)]))
+    return rng.choice(
+        [
+            None,
+            "",
+            damage,
+            f"{damage}+{rng.randint(10, 99)}",
+            f"+{rng.randint(10, 99)} {damage}",
+            f"{damage}+{rng.randint(0, 9)}",
+            "物理 持越",
+            f"残り{damage}万",
+        ]
+    )
+
+
+def random_board(rng: random.Random) -> AttackBoard:
+    header = AttackBoard.create(rng.randint(1, 5), "ワイバーン", rng.randint(1000, 9000)).header
+    entries = [
+        AttackEntry(
+            f"user{i}",
+            rng.choice(ATTACK_KINDS),
+            rng.randint(100, 3000),
+            note=random_note(rng),
+            is_battle_in=rng.random() < 0.3,
+        )
+        for i in rng.sample(range(100), k=rng.randint(0, 30))
+    ]
+    return AttackBoard(header, entries)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_sort_by_damage_matches_text_sort(seed: int) -> None:
+    rng = random.Random(seed)
+    board = random_board(rng)
+    lines = [e.render() for e in board.entries.values()]
+
+    board.sort_by_damage()
+
+    expected = old_sort_by_damage(lines)
+    assert [e.render() for e in board.entries.values()] == expected
+    assert board.render() == "\n".join([board.header, board.separator] + expected)
+    # 本文から復元した場合も同じ順に並ぶ
+    reparsed = AttackBoard.parse("\n".join([board.header, board.separator] + lines))
+    reparsed.sort_by_damage()
+    assert reparsed.render() == board.render()
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_set_note_keeps_entries_without_damage_in_order(seed: int) -> None:
+    rng = random.Random(seed)
+    board = random_board(rng)
+    if not board.entries:
+        return
+    username = rng.choice(board.usernames())
+    note = random_note(rng) or "1500"
+    lines = [e.render() if e.username != username else f"{e.attack_text()} {note}" for e in board.entries.values()]
+
+    board.set_note(username, note)
+
+    assert [e.render() for e in board.entries.values()] == old_sort_by_damage(lines)
+
+
+@pytest.mark.parametrize("boss_name", ["ワイバーン", "ワイルド グリフォン", "ゴブリン グレート 2"])
+def test_header_round_trip(boss_name: str) -> None:
+    board = AttackBoard.create(3, boss_name, 6000)
+    board.register("user1", ATTACK_KINDS[0], 1500)
+
+    parsed = AttackBoard.parse(board.render())
+
+    assert (parsed.boss_number, parsed.boss_name, parsed.boss_hp) == (3, boss_name, "6000")
+    assert parsed.boss_label == f"3:{boss_name}"
+    assert parsed.boss_str == board.boss_str
+    assert parsed.render() == board.render()
@@ -0,0 +1,83 @@
+import random
+from datetime import date
+from typing import Optional
+
+import pytest
+
+import mongo_data as mongo
+from report_aggregate import EMOJI_CARRY, EMOJI_CMP_ATK, EMOJI_YET_ATK, ReportAggregate
+
+TARGET_DATE = date(2024, 1, 1)
+CHANGES = [
+    mongo.ReportChange(EMOJI_YET_ATK, EMOJI_CMP_ATK),
+    mongo.ReportChange(EMOJI_YET_ATK, EMOJI_CARRY),
+    mongo.ReportChange(EMOJI_CARRY, EMOJI_CMP_ATK),
+    mongo.ReportChange(None, EMOJI_CMP_ATK * 3),
+    mongo.ReportChange(None, EMOJI_YET_ATK * 3),
+]
+
+
+def old_render(reports: list[mongo.AttackReport], names: dict[int, Optional[str]]) -> tuple[str, str]:
+    # 操作毎に全員分を数え直して並べ替えていた以前の実装。比較の基準とする
+    reports = sorted(reports, key=lambda r: (r.report.count(EMOJI_YET_ATK), r.report.count(EMOJI_CARRY)), reverse=True)
+    repo_list = [f"{r.report} : {names[r.user_id]} : {r.memo}" for r in reports if names[r.user_id] is not None]
+    lost_repo_list = [
+        f"{r.report} : ユーザID: {r.user_id} が見つかりませんでした。" for r in reports if names[r.user_id] is None
+    ]
+    yet_atk_count = sum([r.report.count(EMOJI_YET_ATK, 0, 3) for r in reports])
+    cmp_atk_count = sum([r.report.count(EMOJI_CMP_ATK, 0, 3) for r in reports])
+    carry_count = sum([r.report.count(EMOJI_CARRY, 0, 3) for r in reports])
+    summary = (
+        f"凸状況 (残凸`{EMOJI_YET_ATK}`= **{yet_atk_count}** , "
+        f"持越`{EMOJI_CARRY}`= **{carry_count}** , "
+        f"消化`{EMOJI_CMP_ATK}`= **{cmp_atk_count}** )"
+    )
+    return "```\n" + "\n".join(repo_list + lost_repo_list) + "\n```", summary
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_incremental_updates_match_full_render(seed: int) -> None:
+    rng = random.Random(seed)
+    user_ids = rng.sample(range(1000), k=rng.randint(1, 40))
+    reports = [mongo.AttackReport(1, TARGET_DATE, uid, EMOJI_YET_ATK * 3, "") for uid in user_ids]
+    names: dict[int, Optional[str]] = {uid: None if rng.random() < 0.1 else f"member{uid}" for uid in user_ids}
+    aggregate = ReportAggregate(reports, names)
+
+    for step in range(100):
+        index = rng.randrange(len(reports))
+        report = reports[index]
+        if rng.random() < 0.1:
+            report = report.replace(memo=f"memo{step}")
+        else:
+            report = report.replace(report=rng.choice(CHANGES).apply(report.report))
+        reports[index] = report
+        if rng.random() < 0.05:
+            names[report.user_id] = None if names[report.user_id] is not None else f"renamed{step}"
+            aggregate.rename(report.user_id, names[report.user_id])
+        aggregate.update(report, names[report.user_id])
+
+        assert (aggregate.render(), aggregate.summary()) == old_render(reports, names)
+        assert aggregate.yet_complete_user_ids() == {r.user_id for r in reports if r.report != EMOJI_CMP_ATK * 3}
+        assert aggregate.lost_user_ids() == {uid for uid, name in names.items() if name is None}
+
+
+def test_report_versions_advance_by_one_per_write() -> None:
+    versions = mongo.ReportVersions(max_entries=2)
+    assert versions.Get(1, TARGET_DATE) is None
+
+    versions.Bump(1, TARGET_DATE)
+    first = versions.Get(1, TARGET_DATE)
+    versions.Bump(1, TARGET_DATE)
+    # 集計後の書き込みが1回だけなら版は回数だけが1つ進む
+    assert versions.Get(1, TARGET_DATE) == (first[0], first[1] + 1)
+
+    # DBから読み直した場合、件数の上限で削除された場合は別の世代から数え直し、以前の版とは一致しない
+    versions.Reset(1, TARGET_DATE)
+    versions.Bump(1, TARGET_DATE)
+    second = versions.Get(1, TARGET_DATE)
+    assert second[0] != first[0]
+    versions.Bump(2, TARGET_DATE)
+    versions.Bump(3, TARGET_DATE)
+    assert versions.Get(1, TARGET_DATE) is None
+    versions.Bump(1, TARGET_DATE)
+    assert versions.Get(1, TARGET_DATE)[0] not in (first[0], second[0])
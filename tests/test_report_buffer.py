@@ -0,0 +1,117 @@
+import asyncio
+from datetime import date
+from typing import Optional
+
+import discord
+import pytest
+
+import mongo_data as mongo
+from mybot import BotClass
+
+TARGET_DATE = date(2024, 1, 1)
+YET = "🍖🍖🍖"
+COMPLETE = "🦴🦴🦴"
+
+
+class FakeReportStore:
+    # AttackReport.Fetch/Store/Eraseの代わりにメモリ上で読み書きし、指定した回数だけ書き込みを失敗させる
+    def __init__(self, reports: list[mongo.AttackReport]) -> None:
+        self.rows = {(r.guild_id, r.target_date, r.user_id): r for r in reports}
+        self.failures = 0
+        self.before_store: Optional[asyncio.Future] = None
+
+    async def fetch(self, guild_id: int, target_date: date) -> list[mongo.AttackReport]:
+        return [r for (g, d, _), r in self.rows.items() if g == guild_id and d == target_date]
+
+    async def store(self, reports: list[mongo.AttackReport]) -> int:
+        if self.before_store is not None:
+            await self.before_store
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("mongo is down")
+        for r in reports:
+            self.rows[(r.guild_id, r.target_date, r.user_id)] = r
+        return len(reports)
+
+    async def erase(self, reports: list[mongo.AttackReport]) -> int:
+        for r in reports:
+            self.rows.pop((r.guild_id, r.target_date, r.user_id), None)
+        return len(reports)
+
+
+@pytest.fixture
+def store(monkeypatch: pytest.MonkeyPatch) -> FakeReportStore:
+    store = FakeReportStore([mongo.AttackReport(1, TARGET_DATE, uid, YET, "") for uid in (10, 20)])
+    monkeypatch.setattr(mongo.AttackReport, "Fetch", classmethod(lambda cls, g, d: store.fetch(g, d)))
+    monkeypatch.setattr(mongo.AttackReport, "Store", classmethod(lambda cls, reports: store.store(reports)))
+    monkeypatch.setattr(mongo.AttackReport, "Erase", classmethod(lambda cls, reports: store.erase(reports)))
+    return store
+
+
+def stored_report(store: FakeReportStore, user_id: int) -> str:
+    return store.rows[(1, TARGET_DATE, user_id)].report
+
+
+def test_failed_flush_restores_rows_and_retries(store: FakeReportStore) -> None:
+    async def run() -> None:
+        buffer = mongo.AttackReportBuffer(enabled=True)
+        await buffer.Change(1, TARGET_DATE, 10, change=mongo.ReportChange(None, COMPLETE))
+        await buffer.Remove([mongo.AttackReport(1, TARGET_DATE, 20, "", "")])
+
+        store.failures = 1
+        with pytest.raises(ConnectionError):
+            await buffer.Flush()
+        assert stored_report(store, 10) == YET
+        assert buffer.stats()["dirty"] == 2
+        assert buffer.stats()["failures"] == 1
+
+        assert await buffer.Flush() == 2
+        assert stored_report(store, 10) == COMPLETE
+        assert (1, TARGET_DATE, 20) not in store.rows
+        assert buffer.stats()["dirty"] == 0
+
+    asyncio.run(run())
+
+
+def test_change_during_failed_flush_wins_over_restored_row(store: FakeReportStore) -> None:
+    async def run() -> None:
+        buffer = mongo.AttackReportBuffer(enabled=True)
+        await buffer.Change(1, TARGET_DATE, 10, change=mongo.ReportChange(None, COMPLETE))
+
+        store.failures = 1
+        store.before_store = asyncio.get_running_loop().create_future()
+        flush = asyncio.create_task(buffer.Flush())
+        await asyncio.sleep(0)
+        # 書き込み中に同じメンバーの凸状況を変更してから、書き込みを失敗させる
+        await buffer.Change(1, TARGET_DATE, 10, change=mongo.ReportChange(None, YET), memo="retry")
+        store.before_store.set_result(None)
+        with pytest.raises(ConnectionError):
+            await flush
+
+        assert await buffer.Flush() == 1
+        assert store.rows[(1, TARGET_DATE, 10)] == mongo.AttackReport(1, TARGET_DATE, 10, YET, "retry")
+        assert [r.report for r in await buffer.Gets(1, TARGET_DATE) if r.user_id == 10] == [YET]
+
+    asyncio.run(run())
+
+
+def test_close_flushes_dirty_rows(store: FakeReportStore, monkeypatch: pytest.MonkeyPatch) -> None:
+    async def run() -> None:
+        buffer = mongo.AttackReportBuffer(enabled=True)
+        await buffer.Change(1, TARGET_DATE, 20, change=mongo.ReportChange(None, COMPLETE))
+
+        bot = BotClass()
+        closed = []
+
+        async def close_client(self) -> None:
+            closed.append(self)
+
+        monkeypatch.setattr(discord.Bot, "close", close_client)
+        bot.close_callbacks.append(buffer.Flush)
+        await bot.close()
+
+        assert closed == [bot]
+        assert stored_report(store, 20) == COMPLETE
+        assert buffer.stats()["dirty"] == 0
+
+    asyncio.run(run())